@@ -7,8 +7,8 @@ FUNCTION:  Provides classes and methods to reliably receive and send fixed-
    USAGE:  messagesocket is imported and used within main programs.  It is
            compatible with Python 2.7.16 and all versions of Python 3.x.
   AUTHOR:  papamac
- VERSION:  1.1.1
-    DATE:  May 22, 2020
+ VERSION:  1.1.14
+    DATE:  October 19, 2026
 
 
 MIT LICENSE:
@@ -45,17 +45,30 @@ DEPENDENCIES/LIMITATIONS:
 """
 
 __author__ = 'papamac'
-__version__ = '1.1.1'
-__date__ = 'May 22, 2020'
+__version__ = '1.1.14'
+__date__ = 'October 19, 2026'
 
+from bisect import bisect_left
 from binascii import crc32
 from datetime import datetime
+from uuid import uuid4
+from errno import EAGAIN, EWOULDBLOCK
 from logging import DEBUG, ERROR
 from math import sqrt
 from socket import *
-from threading import Thread, Lock
-
-from .colortext import getLogger
+from collections import deque
+from threading import Condition, Event, Lock, Thread, current_thread
+from time import sleep
+try:
+    from time import monotonic
+except ImportError:  # Python 2.7 has no monotonic clock.
+    from time import time as monotonic
+try:
+    import selectors
+except ImportError:  # Python 2.7; SelectorMessageServer is not available.
+    selectors = None
+
+from .colortext import getLogger, DATA
 
 # Global constants:
 
@@ -72,6 +85,45 @@ SOCKET_TIMEOUT = 10.0                   # Timeout limit for socket connection,
 STATUS_INTERVAL = 600.0                 # Status reporting interval (sec).
 #                                         Also imported by the PiDACS package
 #                                         (iomgr.py)
+CLIENT_QUEUE_LEN = 1000                 # Maximum messages queued for a
+#                                         MessageServer client.
+LAGGING_POLICIES = ('drop', 'disconnect')
+#                                         Policies for clients with full
+#                                         queues.
+GET_MESSAGE_WAIT = 0.05                 # Maximum wait when MessageServer
+#                                         get_message returns nothing (sec).
+BACKLOG = 1024                          # Default MessageServer listen
+#                                         backlog.
+SUBSCRIBE = 'subscribe'                 # MessageServer client requests to
+UNSUBSCRIBE = 'unsubscribe'             # add or remove DATA channels.
+ALL_CHANNELS = '*'                      # Wildcard subscription channel.
+RESUME = 'resume'                       # Client handshake keyword to open or
+#                                         resume a session.
+SESSION = 'session'                     # Server handshake reply keyword.
+NEW_SESSION = '-'                       # Session id to request a new session.
+REPLAY_LEN = 1000                       # Frames kept for session replay.
+SESSION_TIMEOUT = 600.0                 # Time a session without a client is
+#                                         kept (sec).
+RESOLVE_TTL = 300.0                     # Time a resolved address is cached
+#                                         (sec).
+RESOLVE_NEGATIVE_TTL = 30.0             # Time a failed lookup is cached (sec).
+RESOLVE_TIMEOUT = 2.0                   # Time to wait for a lookup (sec).
+RESOLVE_RESULTS = ('hit', 'miss', 'stale', 'timeout', 'failure')
+#                                         Resolver.counts keys.
+COUNTER_NAMES = ('shorts', 'crc_errs', 'dt_errs', 'seq_errs', 'recvd',
+                 'sent')                # MessageStatus.counters keys.
+LATENCY_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0,
+                   1000.0, 2000.0, 5000.0, 10000.0)
+#                                         Histogram bucket upper bounds (ms).
+STAGE_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5) + LATENCY_BUCKETS
+#                                         Stage timing bucket bounds (ms).
+STAGE_NAMES = ('recv_wait', 'read', 'header', 'parse', 'indigo')
+#                                         Instrumented receive and dispatch
+#                                         stages.
+STAGES = None                           # Stage timing histograms indexed by
+#                                         stage name when instrumentation is
+#                                         enabled; None otherwise.
+RESOLVER = None                         # Shared Resolver (see get_resolver).
 
 
 # messagesocket module functions:
@@ -90,11 +142,87 @@ def set_status_interval(status_interval):  # Allow using modules to change the
     STATUS_INTERVAL = status_interval
 
 
+def set_instrumentation(enabled):     # Enable/disable stage timing.
+    LOG.threaddebug('messagesocket.set_instrumentation called %s', enabled)
+    global STAGES
+    if enabled and STAGES is None:
+        STAGES = dict((stage, Histogram(STAGE_BUCKETS))
+                      for stage in STAGE_NAMES)
+    elif not enabled:
+        STAGES = None
+
+
+def get_resolver():                     # Return the shared Resolver.
+    global RESOLVER
+    if RESOLVER is None:
+        RESOLVER = Resolver()
+    return RESOLVER
+
+
 def next_seq(seq):
     # LOG.threaddebug('messagesocket.next_seq called')
     return seq + 1 if seq < 0xffffffff else 0
 
 
+def encode_message(message, seq, now_dt=None):
+    """
+    Return a fixed-length byte message with the crc, sequence number, and
+    datetime header followed by the message data.  Blanks are removed and the
+    message is truncated if necessary.
+    """
+    message = message.strip()
+    if len(message) > DATA_LEN:
+        LOG.warning('send: message truncated "%s"', message)
+        message = message[:DATA_LEN]
+    now_dt = now_dt or datetime.now()
+    iso_dt = now_dt.isoformat('|')
+    if not now_dt.microsecond:
+        iso_dt += '.000000'
+    message = '%08x%s%s' % (seq, iso_dt, message)
+    crc = crc32(message.encode()) & 0xffffffff  # Works with 2.7, 3.x
+    message = '%08x%s' % (crc, message)
+    return message.ljust(MSG_LEN).encode()
+
+
+def data_channels(message):
+    """
+    Return a tuple of the names that identify the channel of a DATA message
+    (the alias and the channel name for an aliased channel id such as
+    'sw1[ab00]'), or None if the message is not a DATA message.
+    """
+    split = message.split(None, 2)
+    if len(split) < 2 or split[0] != str(DATA):
+        return None
+    channel_id = split[1]
+    if '[' in channel_id:
+        alias, channel_name = channel_id.split('[', 1)
+        return alias, channel_name.rstrip(']')
+    return channel_id,
+
+
+def bucket_percentile(bounds, counts, pct, min_, max_):
+    """
+    Estimate a percentile from histogram bucket counts by interpolating
+    within the bucket that contains the requested rank.  min_ and max_ bound
+    the estimate and the overflow bucket.
+    """
+    count = sum(counts)
+    if not count:
+        return 0.0
+    rank = pct / 100.0 * count
+    cumulative = 0
+    for index, bucket_count in enumerate(counts):
+        if bucket_count and cumulative + bucket_count >= rank:
+            lower = bounds[index - 1] if index else 0.0
+            upper = bounds[index] if index < len(bounds) else max_
+            lower = max(lower, min_)
+            upper = min(upper, max_)
+            fraction = (rank - cumulative) / float(bucket_count)
+            return lower + fraction * (upper - lower)
+        cumulative += bucket_count
+    return max_
+
+
 class MessageSocket(Thread):
     """
     **************************** needs work ***********************************
@@ -114,6 +242,12 @@ class MessageSocket(Thread):
         self._status = None
         self._recvd_dt = datetime.now()
         self._send_seq = 0
+        self._send_lock = Lock()  # Serializes _send_seq and frame writes.
+        self._capture = None
+        self._stopping = False
+        self.handshake = None  # Client handshake message (server side).
+        self.session = None    # Session id (client side).
+        self.resumed = False   # True if the session was resumed.
         self.connected = False
         self.running = False
 
@@ -122,22 +256,104 @@ class MessageSocket(Thread):
         Shutdown the message socket after a terminal error or shutdown by the
         peer process.  When multiple recv/send threads have near-simultaneous
         errors, perform shutdown for the first one and record a debug message
-        for the second.
+        for the second.  Errors caused by stop (or a disconnect marked by
+        expect_disconnect) are expected; they are logged as debug messages
+        and the disconnected callback is not called.
         """
         LOG.threaddebug('MessageSocket._shutdown called "%s"', self.name)
         if self.connected:
             self.connected = False
             self.running = False
-            LOG.error(err_msg)
+            LOG.log(DEBUG if self._stopping else ERROR, err_msg)
             self._socket.close()
-            if self._disconnected:
+            self.set_capture(None)
+            if self._disconnected and not self._stopping:
                 self._disconnected(self._reference_name)
         else:
             LOG.debug(err_msg)
 
+    def _write_frame(self, byte_msg):
+        """
+        Write a fixed-length byte message in multiple segments.  Return None
+        if it was written, or an error message.  The caller holds _send_lock
+        and shuts down the socket after releasing it.
+        """
+        bytes_sent = 0
+        while bytes_sent < MSG_LEN:
+
+            # Try sending a segment and handle exceptions.
+
+            try:
+                segment_bytes_sent = self._socket.send(byte_msg[bytes_sent:])
+            except timeout:
+                return 'send: timeout "%s"' % self.name
+            except OSError as err:
+                return 'send: error "%s": %s' % (self.name, err)
+            except Exception as err:  # Catch-all exception, just in case.
+                return 'send: exception "%s": %s' % (self.name, err)
+            if not segment_bytes_sent:  # Error; segment not sent.
+                return 'send: error "%s": segment not sent' % self.name
+
+            # Segment sent; continue.
+
+            bytes_sent += segment_bytes_sent
+
+        # Full-length byte_msg sent.
+
+        if self._capture:
+            self._capture.append(b'S', byte_msg)
+        self._status.send()
+
+    def _write_frames(self, frames):
+        """
+        Write a list of fixed-length byte messages with a single sendall
+        call.  Return None or an error message as _write_frame does.
+        """
+        try:
+            self._socket.sendall(b''.join(frames))
+        except timeout:
+            return 'send: timeout "%s"' % self.name
+        except OSError as err:
+            return 'send: error "%s": %s' % (self.name, err)
+        except Exception as err:  # Catch-all exception, just in case.
+            return 'send: exception "%s": %s' % (self.name, err)
+        for frame in frames:
+            if self._capture:
+                self._capture.append(b'S', frame)
+            self._status.send()
+
     # Public methods.
 
-    def connect_to_client(self, client_socket, client_address_tuple):
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def reference_name(self):
+        return self._reference_name
+
+    @property
+    def resume_point(self):
+        """
+        Return the (session id, next expected sequence number) to resume the
+        session after a disconnect, or None if there is no session.
+        """
+        if self.session and self._status:
+            return self.session, self._status.expected_seq
+        return None
+
+    def set_capture(self, capture):
+        """
+        Start capturing raw received and sent frames to a
+        msgcapture.CaptureWriter, or stop capturing if capture is None.
+        """
+        LOG.threaddebug('MessageSocket.set_capture called "%s"', self.name)
+        previous, self._capture = self._capture, capture
+        if previous:
+            previous.close()
+
+    def connect_to_client(self, client_socket, client_address_tuple,
+                          hostname=None):
         LOG.threaddebug('MessageSocket.connect_to_client called')
 
         # Complete messagesocket initialization.
@@ -149,20 +365,40 @@ class MessageSocket(Thread):
         self.name = '[%s:%s]' % (ipv4, port_number)
         self._status = MessageStatus(self.name)
 
-        # Receive hostname from client and add it to messagesocket name.
+        # Receive hostname from client (unless it is already known) and add
+        # it to messagesocket name.  The handshake message may also contain a
+        # session resume request (see SessionRegistry).
 
-        hostname = self.recv()
+        hostname = hostname or self.recv()
         if hostname:
-            self.name = hostname + self.name
+            self.handshake = hostname
+            self.name = hostname.split()[0] + self.name
             LOG.info('connected "%s"', self.name)
             self._status = MessageStatus(self.name)
         else:
             err_msg = 'connect_to_client: connection aborted "%s"' % self.name
             self._shutdown(err_msg)
 
-    def connect_to_server(self, server, port_number):
+    def connect_to_server(self, server, port_number, session=None):
+        """
+        Connect to a MessageServer and send the hostname.  If session is
+        given, open a session (session = (NEW_SESSION, 0)) or resume a
+        previous one (session = resume_point from the previous connection)
+        and wait for the server's reply.  After a resumed session, the server
+        retransmits the frames that were missed; otherwise (resumed is False)
+        the client must resynchronize.
+        """
         LOG.threaddebug('MessageSocket.connect_to_server called')
 
+        # Resolve the server address using the shared resolver cache.
+
+        try:
+            address = get_resolver().resolve(server)
+        except gaierror as err:
+            LOG.error('connect_to_server: server address error "%s:%s" %s',
+                      server, port_number, err)
+            return
+
         # Complete messagesocket initialization.
 
         self._socket = socket(AF_INET, SOCK_STREAM)
@@ -171,7 +407,7 @@ class MessageSocket(Thread):
         # Try connecting to server and handle exceptions.
 
         try:
-            self._socket.connect((server, port_number))
+            self._socket.connect((address, port_number))
         except timeout:
             LOG.error('connect_to_server: connection timeout "%s:%s"', server,
                       port_number)
@@ -196,7 +432,22 @@ class MessageSocket(Thread):
         self.name = '%s[%s:%s]' % (server, ipv4, port)
         LOG.info('connected "%s"', self.name)
         self._status = MessageStatus(self.name)
-        self.send(gethostname())
+        if session is None:
+            self.send(gethostname())
+            return
+        session_id, next_seq = session
+        self.send('%s %s %s %08x' % (gethostname(), RESUME, session_id,
+                                     next_seq))
+        reply = self.recv()
+        split = reply.split() if reply else []
+        if len(split) != 4 or split[0] != SESSION:
+            self._shutdown('connect_to_server: no session reply "%s"'
+                           % self.name)
+            return
+        self.session = split[1]
+        self.resumed = split[2] == 'resumed'
+        self._status.expect(int(split[3], 16))
+        LOG.info('session %s %s "%s"', self.session, split[2], self.name)
 
     def run(self):
         LOG.threaddebug('MessageSocket.run called "%s"', self.name)
@@ -206,14 +457,38 @@ class MessageSocket(Thread):
             if message and self._process_message:
                 self._process_message(self._reference_name, message)
 
-    def stop(self):
+    def expect_disconnect(self):
+        """
+        Mark a coming disconnect by the peer as expected.  Unlike stop, the
+        socket is left open, so the run thread reads the frames that are
+        still in transit before it sees the disconnect.
+        """
+        LOG.threaddebug('MessageSocket.expect_disconnect called "%s"',
+                        self.name)
+        self._stopping = True
+
+    def stop(self, timeout=None):
+        """
+        Stop the run thread cooperatively.  Shut down the socket to wake a
+        recv that is blocked on it, then wait up to timeout seconds (without
+        limit if timeout is None) for the thread to end.  Return True if the
+        thread ended.
+        """
         LOG.threaddebug('MessageSocket.stop called "%s"', self.name)
+        self._stopping = True
         self.running = False
-        if self.is_alive():
-            self.join()
         if self.connected:
-            self._socket.shutdown(SHUT_RDWR)
+            try:
+                self._socket.shutdown(SHUT_RDWR)
+            except (OSError, error):
+                pass
+        if self.is_alive() and current_thread() is not self:
+            self.join(timeout)
+        if self.connected:
+            self.connected = False
             self._socket.close()
+        self.set_capture(None)
+        return not self.is_alive()
 
     def recv(self):
         """
@@ -232,6 +507,10 @@ class MessageSocket(Thread):
                      disconnection.
         """
         LOG.threaddebug('MessageSocket.recv called "%s"', self.name)
+        stages = STAGES
+        if stages is not None:
+            start_time = monotonic()
+            first_time = None
         byte_msg = b''
         bytes_received = 0
         while bytes_received < MSG_LEN:
@@ -265,20 +544,33 @@ class MessageSocket(Thread):
 
             # Segment received; continue.
 
+            if stages is not None and first_time is None:
+                first_time = monotonic()
             byte_msg += segment
             bytes_received = len(byte_msg)
 
         # Full-length byte_msg received.
 
+        if self._capture:
+            self._capture.append(b'R', byte_msg)
         message = byte_msg.decode().strip()
         self._recvd_dt = datetime.now()
+        if stages is not None:
+            read_time = monotonic()
+            stages['recv_wait'].add(1000.0 * (first_time - start_time))
+            stages['read'].add(1000.0 * (read_time - first_time))
         message = self._status.recv(message, self._recvd_dt)
+        if stages is not None:
+            stages['header'].add(1000.0 * (monotonic() - read_time))
         return message  # Return the message without the header or a null
 #                         string as determined by _status.recv.
 
     def send(self, message):
         """
-        Send a fixed-length message in multiple segments.
+        Send a fixed-length message in multiple segments.  The send methods
+        are thread-safe; each message is numbered and written under
+        _send_lock, so concurrent senders cannot reuse a sequence number or
+        interleave segments.
 
         send has two possible returns:
 
@@ -289,61 +581,63 @@ class MessageSocket(Thread):
                      exceptions, and segment not sent.
         """
         LOG.threaddebug('MessageSocket.send called "%s"', self.name)
+        with self._send_lock:
+            err_msg = self._write_frame(encode_message(message,
+                                                       self._send_seq))
+            if not err_msg:
+                self._send_seq = next_seq(self._send_seq)
+        if err_msg:
+            self._shutdown(err_msg)
+            return
+        return MSG_LEN
 
-        # Remove blanks and truncate message if necessary.
-
-        message = message.strip()
-        if len(message) > DATA_LEN:
-            LOG.warning('send: message truncated "%s"', message)
-            message = message[:DATA_LEN]
-
-        # Add the crc, sequence number, and datetime to create a fixed-length
-        # byte message.
-
-        now_dt = datetime.now()
-        iso_dt = now_dt.isoformat('|')
-        if not now_dt.microsecond:
-            iso_dt += '.000000'
-        message = '%08x%s%s' % (self._send_seq, iso_dt, message)
-        crc = crc32(message.encode()) & 0xffffffff  # Works with 2.7, 3.x
-        message = '%08x%s' % (crc, message)
-        byte_msg = message.ljust(MSG_LEN).encode()
-
-        # Send the byte_msg in multiple segments.
-
-        bytes_sent = 0
-        while bytes_sent < MSG_LEN:
-
-            # Try sending a segment and handle exceptions.
-
-            try:
-                segment_bytes_sent = self._socket.send(byte_msg[bytes_sent:])
-            except timeout:
-                err_msg = 'send: timeout "%s"' % self.name
-                self._shutdown(err_msg)
-                return
-            except OSError as err:
-                err_msg = ('send: error "%s": %s' % (self.name, err))
-                self._shutdown(err_msg)
-                return
-            except Exception as err:  # Catch-all exception, just in case.
-                err_msg = ('send: exception "%s": %s' % (self.name, err))
-                self._shutdown(err_msg)
-                return
-            if not segment_bytes_sent:  # Error; segment not sent.
-                err_msg = 'send: error "%s": segment not sent' % self.name
-                self._shutdown(err_msg)
-                return
-
-            # Segment sent; continue.
-
-            bytes_sent += segment_bytes_sent
+    def send_batch(self, messages):
+        """
+        Send several fixed-length messages with a single sendall call.
+        send_batch returns the number of bytes sent, or None if the socket
+        was shut down.
+        """
+        LOG.threaddebug('MessageSocket.send_batch called "%s"', self.name)
+        with self._send_lock:
+            frames = []
+            seq = self._send_seq
+            for message in messages:
+                frames.append(encode_message(message, seq))
+                seq = next_seq(seq)
+            err_msg = self._write_frames(frames)
+            if not err_msg:
+                self._send_seq = seq
+        if err_msg:
+            self._shutdown(err_msg)
+            return
+        return MSG_LEN * len(frames)
 
-        # Full-length byte_msg sent.
+    def send_frames(self, frames):
+        """
+        Send a list of fixed-length byte messages that already have their
+        headers with a single sendall call.  send_frames has the same returns
+        as send_batch.
+        """
+        LOG.threaddebug('MessageSocket.send_frames called "%s"', self.name)
+        with self._send_lock:
+            err_msg = self._write_frames(frames)
+        if err_msg:
+            self._shutdown(err_msg)
+            return
+        return MSG_LEN * len(frames)
 
-        self._status.send()
-        self._send_seq = next_seq(self._send_seq)
-        return bytes_sent
+    def send_frame(self, byte_msg):
+        """
+        Send a fixed-length byte message that already has its header.
+        send_frame has the same returns as send.
+        """
+        LOG.threaddebug('MessageSocket.send_frame called "%s"', self.name)
+        with self._send_lock:
+            err_msg = self._write_frame(byte_msg)
+        if err_msg:
+            self._shutdown(err_msg)
+            return
+        return MSG_LEN
 
 
 class MessageStatus:
@@ -360,16 +654,30 @@ class MessageStatus:
         self._min = None
         self._max = None
         self._recv_seq = None
+        self._totals = dict.fromkeys(COUNTER_NAMES, 0)
+        self._shorts = self._crc_errs = self._dt_errs = self._seq_errs = 0
+        self._recvd = self._sent = 0
+        self.latency = Histogram()  # Cumulative receive latency (ms).
+        self.last_frame = None      # monotonic time of the last frame.
+        self.last_dt = None         # Send datetime of the last valid frame.
+        self._aggregates_time = monotonic()
+        self._aggregates_prev = (0, 0, 0, self.latency.snapshot()[0])
         self._init()
 
     def _init(self):
         LOG.threaddebug('MessageStatus._init called "%s"', self._name)
+        for key, value in zip(COUNTER_NAMES, self._interval_counts()):
+            self._totals[key] += value
         self._shorts = self._crc_errs = self._dt_errs = self._seq_errs = 0
         self._recvd = self._sent = 0
         self._min = 1000000.0
         self._max = self._sum = self._sum2 = 0.0
         self._status_dt = datetime.now()
 
+    def _interval_counts(self):
+        return (self._shorts, self._crc_errs, self._dt_errs, self._seq_errs,
+                self._recvd, self._sent)
+
     def _report(self):
         """
         Report accumulated status data if the status interval has expired.
@@ -407,6 +715,7 @@ class MessageStatus:
         error).
         """
         LOG.threaddebug('MessageStatus.recv called "%s"', self._name)
+        self.last_frame = monotonic()
         if len(message) < HDR_LEN:  # Check for short message.
             self._shorts += 1
             self._report()
@@ -434,58 +743,433 @@ class MessageStatus:
 
         self._recvd += 1
         self._recv_seq = next_seq(self._recv_seq)
+        self.last_dt = msg_dt
         latency = 1000.0 * (recvd_dt - msg_dt).total_seconds()
         self._min = min(latency, self._min)
         self._max = max(latency, self._max)
         self._sum += latency
         self._sum2 += latency * latency
+        self.latency.add(latency)
         self._report()
         return message[HDR_LEN:]  # Good message; return it without header.
 
+    def merge(self, counts=None, latency=None):
+        """
+        Add message and error counts (a dictionary with COUNTER_NAMES keys)
+        and/or the latency of one message measured elsewhere, for example in a
+        msgshard process.  Merged data is not reported by _report; the
+        measuring MessageStatus reports it.
+        """
+        with self._lock:
+            if counts:
+                for key in COUNTER_NAMES:
+                    self._totals[key] += counts.get(key, 0)
+            if latency is not None:
+                self.last_frame = monotonic()
+                self.latency.add(latency)
+
+    @property
+    def expected_seq(self):
+        return self._recv_seq or 0
+
+    def expect(self, seq):
+        """
+        Set the sequence number expected in the next message.
+        """
+        self._recv_seq = seq
+
     def send(self):
         LOG.threaddebug('MessageStatus.send called "%s"', self._name)
         self._sent += 1
         self._report()
 
+    def counters(self):
+        """
+        Return a dictionary of the cumulative message and error counts since
+        the MessageStatus object was created.  Unlike the interval status
+        data, these counts are never reset.
+        """
+        with self._lock:
+            return dict((key, self._totals[key] + value) for key, value
+                        in zip(COUNTER_NAMES, self._interval_counts()))
+
+    def aggregates(self):
+        """
+        Return a dictionary of link-health aggregates for the period since
+        the previous call (or since the MessageStatus object was created):
+        receive and send rates (messages/sec), header error count, 50th and
+        99th percentile latency (ms), and the time since the last frame was
+        received (sec, None if no frames have been received).
+        """
+        now = monotonic()
+        counts = self.counters()
+        buckets, count, sum_, min_, max_ = self.latency.snapshot()
+        errors = (counts['shorts'] + counts['crc_errs'] + counts['dt_errs']
+                  + counts['seq_errs'])
+        prev_recvd, prev_sent, prev_errors, prev_buckets = \
+            self._aggregates_prev
+        period = max(now - self._aggregates_time, 0.001)
+        deltas = [bucket - prev for bucket, prev in zip(buckets, prev_buckets)]
+        self._aggregates_time = now
+        self._aggregates_prev = (counts['recvd'], counts['sent'], errors,
+                                 buckets)
+        bounds = self.latency.bounds
+        return {'recv_rate': (counts['recvd'] - prev_recvd) / period,
+                'send_rate': (counts['sent'] - prev_sent) / period,
+                'errors': errors - prev_errors,
+                'latency_p50': bucket_percentile(bounds, deltas, 50, min_ or 0,
+                                                 max_ or 0),
+                'latency_p99': bucket_percentile(bounds, deltas, 99, min_ or 0,
+                                                 max_ or 0),
+                'last_frame_age': (now - self.last_frame
+                                   if self.last_frame else None)}
+
+
+class ChannelFilter:
+    """
+    The channel subscriptions of a MessageServer client.  A client that has
+    never subscribed receives all messages.  After its first subscribe or
+    unsubscribe request, the client receives DATA messages only for its
+    subscribed channels; all other messages are always delivered.  Requests
+    have the form 'subscribe name [name ...]' or 'unsubscribe name
+    [name ...]' where a name is a channel name or alias.  'subscribe *'
+    restores delivery of all DATA messages and 'unsubscribe *' stops it.
+    The channel set is replaced (never modified in place), so accepts may be
+    called from any thread.
+    """
+
+    def __init__(self):
+        self.channels = None  # None = all channels.
+
+    def request(self, message):
+        """
+        Apply a subscribe or unsubscribe request.  Return False if the
+        message is not a subscription request.
+        """
+        split = message.split()
+        if not split or split[0] not in (SUBSCRIBE, UNSUBSCRIBE):
+            return False
+        names = frozenset(split[1:])
+        if split[0] == SUBSCRIBE:
+            if ALL_CHANNELS in names:
+                self.channels = None
+            elif self.channels is not None:
+                self.channels = self.channels | names
+            else:
+                self.channels = names
+        elif ALL_CHANNELS in names:
+            self.channels = frozenset()
+        else:
+            self.channels = (self.channels or frozenset()) - names
+        LOG.debug('channel subscriptions %s',
+                  'all' if self.channels is None
+                  else ' '.join(sorted(self.channels)) or 'none')
+        return True
+
+    def accepts(self, channels):
+        """
+        Return True if a message with the given data_channels should be
+        delivered.
+        """
+        subscribed = self.channels
+        return (channels is None or subscribed is None
+                or not subscribed.isdisjoint(channels))
+
+
+class Session:
+    """
+    A MessageServer client session that survives reconnection.  Every frame
+    sent in the session is encoded with the session's sequence number and
+    kept in a bounded replay buffer.  While the session has no connected
+    client, published messages are still recorded (subject to the session's
+    ChannelFilter) so they can be replayed when the client resumes.
+    """
+
+    def __init__(self, session_id, replay_len):
+        self.id = session_id
+        self.filter = ChannelFilter()
+        self.client = None
+        self.idle_time = None   # monotonic time the session became idle.
+        self._lock = Lock()
+        self._frames = deque(maxlen=replay_len)
+        self._send_seq = 0
+
+    @property
+    def send_seq(self):
+        return self._send_seq
+
+    def idle(self):
+        return self.client is None or not self.client.connected
+
+    def encode(self, message, now_dt=None):
+        """
+        Return a frame for the message with the next session sequence number
+        and add it to the replay buffer.
+        """
+        with self._lock:
+            frame = encode_message(message, self._send_seq, now_dt)
+            self._frames.append(frame)
+            self._send_seq = next_seq(self._send_seq)
+        return frame
+
+    def replay_from(self, seq):
+        """
+        Return the buffered frames from sequence number seq through the last
+        frame sent, or None if seq is no longer in the buffer.
+        """
+        with self._lock:
+            if seq == self._send_seq:
+                return []
+            offset = (seq - self._send_seq + len(self._frames)) & 0xffffffff
+            if offset >= len(self._frames):
+                return None
+            return list(self._frames)[offset:]
+
+
+class SessionRegistry:
+    """
+    The sessions of a MessageServer.  A client opens or resumes a session by
+    sending a handshake message of the form 'hostname resume session_id
+    next_seq' (hex) instead of the hostname alone; session_id is
+    NEW_SESSION for a new session.  The server replies with 'session
+    session_id state first_seq' where state is 'new', 'resumed', or
+    'resync' (the requested frames are no longer buffered) and first_seq is
+    the sequence number of the next frame.  For a resumed session, the
+    buffered frames from next_seq are retransmitted before any new frames.
+    A client without a session request is served as before.  Sessions
+    without a client expire after timeout seconds.
+    """
+
+    def __init__(self, replay_len=REPLAY_LEN, timeout=SESSION_TIMEOUT):
+        self._replay_len = replay_len
+        self._timeout = timeout
+        self._lock = Lock()
+        self._sessions = {}
+
+    def _expire(self, now):
+        for session_id, session in list(self._sessions.items()):
+            if session.idle():
+                if session.idle_time is None:
+                    session.idle_time = now
+                elif now - session.idle_time >= self._timeout:
+                    del self._sessions[session_id]
+                    LOG.debug('session %s expired', session_id)
+
+    def open(self, client):
+        """
+        Open or resume the session requested in a client's handshake.  Take
+        over a resumed session from a previous connection that has not yet
+        been closed.  Return (session, reply frames to send), or (None, [])
+        if the client did not request a session.
+        """
+        split = client.handshake.split() if client.handshake else []
+        if len(split) != 4 or split[1] != RESUME:
+            return None, []
+        session_id = split[2]
+        try:
+            next_seq = int(split[3], 16)
+        except ValueError:
+            next_seq = 0
+        with self._lock:
+            self._expire(monotonic())
+            session = self._sessions.get(session_id)
+            if session:
+                previous = session.client
+                if previous and previous.connected:
+                    previous.disconnect('session %s resumed by "%s"'
+                                        % (session_id, client.name))
+                frames = session.replay_from(next_seq)
+                state = 'resync' if frames is None else 'resumed'
+                frames = frames or []
+            else:
+                session_id = uuid4().hex[:16]
+                session = Session(session_id, self._replay_len)
+                self._sessions[session_id] = session
+                state = 'new'
+                frames = []
+            session.client = client
+            session.idle_time = None
+        first_seq = session.send_seq if not frames else (
+            (session.send_seq - len(frames)) & 0xffffffff)
+        reply = encode_message('%s %s %s %08x' % (SESSION, session_id, state,
+                                                  first_seq),
+                               (first_seq - 1) & 0xffffffff)
+        LOG.info('session %s %s "%s" (%i frames replayed)', session_id,
+                 state, client.name, len(frames))
+        return session, [reply] + frames
+
+    def record(self, message, channels):
+        """
+        Record a published message in every idle session that accepts it.
+        """
+        with self._lock:
+            sessions = [session for session in self._sessions.values()
+                        if session.idle()]
+        for session in sessions:
+            if session.filter.accepts(channels):
+                session.encode(message)
+
+
+class MessageClient(MessageSocket):
+    """
+    A MessageServer connection to a single client.  Outbound messages are
+    queued in a bounded queue and sent by a dedicated sender thread, so a slow
+    or dead client never delays delivery to the other clients.  When the
+    queue is full, the lagging policy either drops the oldest queued message
+    ('drop') or disconnects the client ('disconnect').  Subscription requests
+    from the client update its ChannelFilter; all other requests are passed
+    to process_message.  Messages are framed when they are queued, using the
+    client's Session if it has one.
+    """
+
+    # Private methods:
+
+    def __init__(self, reference_name, queue_len=CLIENT_QUEUE_LEN,
+                 lagging='drop', **kwargs):
+        LOG.threaddebug('MessageClient.__init__ called')
+        MessageSocket.__init__(self, reference_name, **kwargs)
+        self._process_request = self._process_message
+        self._process_message = self._request
+        self.filter = ChannelFilter()
+        self._queue = deque()
+        self._queue_len = queue_len
+        self._lagging = lagging
+        self._ready = Condition(Lock())
+        self._sender = Thread(name='MessageClient sender',
+                              target=self._send_queued)
+        self._session = None
+        self.dropped = 0
+
+    def _request(self, reference_name, message):
+        if not self.filter.request(message) and self._process_request:
+            self._process_request(reference_name, message)
+
+    def _send_queued(self):
+        LOG.threaddebug('MessageClient._send_queued called "%s"', self.name)
+        while self.running:
+            with self._ready:
+                while self.running and not self._queue:
+                    self._ready.wait(1.0)
+                if not self.running:
+                    break
+                frame = self._queue.popleft()
+            self.send_frame(frame)
+
+    # Public methods:
+
+    def attach(self, session, frames):
+        """
+        Use a session for all subsequent messages and queue the session reply
+        and replay frames ahead of them.
+        """
+        LOG.threaddebug('MessageClient.attach called "%s"', self.name)
+        with self._ready:
+            self._session = session
+            self.filter = session.filter
+            self._queue.extend(frames)
+            self._ready.notify()
+
+    def start(self):
+        LOG.threaddebug('MessageClient.start called "%s"', self.name)
+        self.running = self.connected
+        MessageSocket.start(self)
+        self._sender.name = self.name + ' sender'
+        self._sender.start()
+
+    def stop(self, timeout=None):
+        LOG.threaddebug('MessageClient.stop called "%s"', self.name)
+        with self._ready:
+            self.running = False
+            self._ready.notify()
+        stopped = MessageSocket.stop(self, timeout)  # Also wakes the sender.
+        if self._sender.is_alive():
+            self._sender.join(timeout)
+        return stopped and not self._sender.is_alive()
+
+    def enqueue(self, message):
+        """
+        Queue a message for the sender thread without blocking.  Return False
+        if the client was disconnected by the lagging policy.
+        """
+        with self._ready:
+            if len(self._queue) >= self._queue_len:
+                if self._lagging == 'disconnect':
+                    self.disconnect('lagging client disconnected "%s"'
+                                    % self.name)
+                    return False
+                self._queue.popleft()
+                self.dropped += 1
+                if self.dropped == 1:
+                    LOG.warning('lagging client "%s"; dropping messages',
+                                self.name)
+            if self._session:
+                frame = self._session.encode(message)
+            else:
+                frame = encode_message(message, self._send_seq)
+                self._send_seq = next_seq(self._send_seq)
+            self._queue.append(frame)
+            self._ready.notify()
+        return True
+
+    def disconnect(self, err_msg):
+        """
+        Shut down the client socket without waiting for the recv or sender
+        threads.  Both threads end when their blocked socket calls fail.
+        """
+        LOG.threaddebug('MessageClient.disconnect called "%s"', self.name)
+        self.running = False
+        if self.connected:
+            try:
+                self._socket.shutdown(SHUT_RDWR)
+            except (OSError, error):
+                pass
+            self._shutdown(err_msg)
+
 
 class MessageServer:
     """
-    **************************** needs work ***********************************
+    Accept client connections and fan out messages to all connected clients.
+    Messages are obtained by calling get_message on the serve thread or are
+    delivered by calling publish from any thread.  Requests received from a
+    client are passed to process_request, except for subscription requests
+    that limit the DATA messages delivered to the client (see
+    ChannelFilter).  Each client has its own bounded
+    outbound queue (see MessageClient), and disconnected clients are removed
+    from the client list.  If snapshot is given, the messages it returns are
+    queued for each new client before any published messages.  Clients may
+    open sessions that are resumed after a reconnection (see
+    SessionRegistry).
     """
 
     # Private methods:
 
-    def __init__(self, port_number, get_message=None, process_request=None):
+    def __init__(self, port_number, get_message=None, process_request=None,
+                 queue_len=CLIENT_QUEUE_LEN, lagging='drop', backlog=BACKLOG,
+                 snapshot=None, replay_len=REPLAY_LEN):
         LOG.threaddebug('MessageServer.__init__ called')
+        if lagging not in LAGGING_POLICIES:
+            raise ValueError('invalid lagging client policy "%s"' % lagging)
         self._socket = socket(AF_INET, SOCK_STREAM)
         self._socket.settimeout(SOCKET_TIMEOUT)
         self._socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
         self._socket.bind(('', port_number))
         self._get_message = get_message
         self._process_request = process_request
+        self._queue_len = queue_len
+        self._lagging = lagging
+        self._backlog = backlog
+        self._snapshot = snapshot
+        self.sessions = SessionRegistry(replay_len)
         self._accept = Thread(name='accept_client_connections',
                               target=self._accept_client_connections)
         self._serve = Thread(name='serve_clients',
                              target=self._serve_clients)
         self._clients = []
+        self._clients_lock = Lock()
         self.running = False
 
-    def start(self):
-        LOG.threaddebug('MessageServer.start called')
-        self.running = True
-        self._accept.start()
-        self._serve.start()
-
-    def stop(self):
-        LOG.threaddebug('MessageServer.stop called')
-        self._accept.join()
-        self._serve.join()
-        for client in self._clients:
-            client.stop()
-
     def _accept_client_connections(self):
         LOG.threaddebug('MessageServer._accept_client_connections called')
-        self._socket.listen(5)
         ipv4, port = self._socket.getsockname()
         name = '%s[%s:%s]' % (gethostname(), ipv4, port)
         LOG.info('accepting client connections "%s"', name)
@@ -494,16 +1178,531 @@ class MessageServer:
                 client_socket, client_address_tuple = self._socket.accept()
             except timeout:
                 continue
-            client = MessageSocket(name, process_message=self._process_request)
+            except (OSError, error) as err:
+                if self.running:
+                    LOG.error('accept: error "%s": %s', name, err)
+                continue
+            client = MessageClient(name, queue_len=self._queue_len,
+                                   lagging=self._lagging,
+                                   process_message=self._process_request)
             client.connect_to_client(client_socket, client_address_tuple)
-            client.start()
-            self._clients.append(client)
+            if client.connected:
+                client.start()
+                with self._clients_lock:  # No publish between the session
+                    session, frames = self.sessions.open(client)  # replay,
+                    if session:           # the snapshot, and adding the
+                        client.attach(session, frames)  # client.
+                    if self._snapshot:
+                        for message in self._snapshot():
+                            client.enqueue(message)
+                    self._clients.append(client)
 
     def _serve_clients(self):
+        """
+        Call get_message and fan out the messages it returns.  get_message may
+        block or return immediately; when it returns no message, wait with an
+        increasing delay (up to GET_MESSAGE_WAIT) so that an idle, non-blocking
+        get_message does not spin.
+        """
         LOG.threaddebug('MessageServer._serve_clients called')
+        wait = 0.001
         while self.running:
-            message = self._get_message() if self._get_message else 'test msg'
+            message = self._get_message()
             if message:
-                for client in self._clients:
-                    if client.running:
-                        client.send(message)
+                self.publish(message)
+                wait = 0.001
+            else:
+                sleep(wait)
+                wait = min(2 * wait, GET_MESSAGE_WAIT)
+
+    # Public methods:
+
+    def start(self):
+        LOG.threaddebug('MessageServer.start called')
+        self._socket.listen(self._backlog)
+        self.running = True
+        self._accept.start()
+        if self._get_message:
+            self._serve.start()
+
+    def stop(self):
+        LOG.threaddebug('MessageServer.stop called')
+        self.running = False
+        for thread in (self._accept, self._serve):
+            if thread.is_alive():
+                thread.join()
+        self._socket.close()
+        with self._clients_lock:
+            clients, self._clients = self._clients, []
+        for client in clients:
+            client.stop()
+
+    @property
+    def clients(self):
+        with self._clients_lock:
+            return list(self._clients)
+
+    def publish(self, message):
+        """
+        Queue a message for every connected client that accepts it without
+        blocking, and remove clients that have disconnected.
+        """
+        channels = data_channels(message)
+        with self._clients_lock:
+            clients = self._clients
+            if not all(client.connected for client in clients):
+                clients = self._clients = [client for client in clients
+                                           if client.connected]
+            self.sessions.record(message, channels)
+        for client in clients:
+            if client.filter.accepts(channels):
+                client.enqueue(message)
+
+
+class SelectorClient:
+    """
+    The state of one SelectorMessageServer client connection: the
+    receive buffer, the outbound byte buffer of whole fixed-length frames
+    (possibly preceded by the unsent tail of a partially sent frame), and
+    the MessageStatus.  All methods except stop are called on the server's
+    I/O thread.
+    """
+
+    # Private methods:
+
+    def __init__(self, server, client_socket, client_address_tuple):
+        ipv4, port_number = client_address_tuple[:2]
+        self._server = server
+        self.socket = client_socket
+        self.name = '[%s:%s]' % (ipv4, port_number)
+        self.status = MessageStatus(self.name)
+        self.deadline = monotonic() + server.handshake_timeout
+        self.in_buffer = bytearray()
+        self.out_buffer = bytearray()
+        self.send_seq = 0
+        self.dropped = 0
+        self.handshake = None   # Handshake message once received.
+        self.session = None
+        self.connected = True
+        self.filter = ChannelFilter()
+
+    # Public methods:
+
+    def queued(self):
+        return len(self.out_buffer) // MSG_LEN
+
+    def enqueue(self, message, now_dt=None):
+        """
+        Add a message to the outbound buffer, applying the lagging client
+        policy if the buffer is full.  Return False if the client was
+        disconnected.
+        """
+        if self.queued() >= self._server.queue_len:
+            if self._server.lagging == 'disconnect':
+                self._server.close_client(
+                    self, 'lagging client disconnected "%s"' % self.name)
+                return False
+            start = len(self.out_buffer) % MSG_LEN  # Skip a partial frame.
+            del self.out_buffer[start:start + MSG_LEN]
+            self.dropped += 1
+            if self.dropped == 1:
+                LOG.warning('lagging client "%s"; dropping messages',
+                            self.name)
+        if self.session:
+            self.out_buffer += self.session.encode(message, now_dt)
+        else:
+            self.out_buffer += encode_message(message, self.send_seq, now_dt)
+            self.send_seq = next_seq(self.send_seq)
+        return True
+
+    def disconnect(self, err_msg):
+        self._server.close_client(self, err_msg)
+
+    def stop(self):
+        self._server.wake(lambda: self._server.close_client(self))
+
+
+class SelectorMessageServer(MessageServer):
+    """
+    A MessageServer that handles the listening socket and all client
+    connections on a single I/O thread using the selectors module.  Client
+    hostname handshakes proceed concurrently and are closed if they are not
+    completed within handshake_timeout.  There are no per-client threads, so
+    hundreds of clients can be served.  process_request is called on the
+    I/O thread and should not block.
+    """
+
+    # Private methods:
+
+    def __init__(self, port_number, get_message=None, process_request=None,
+                 queue_len=CLIENT_QUEUE_LEN, lagging='drop', backlog=BACKLOG,
+                 snapshot=None, replay_len=REPLAY_LEN,
+                 handshake_timeout=SOCKET_TIMEOUT):
+        LOG.threaddebug('SelectorMessageServer.__init__ called')
+        if selectors is None:
+            raise RuntimeError('SelectorMessageServer requires Python 3')
+        MessageServer.__init__(self, port_number, get_message,
+                               process_request, queue_len, lagging, backlog,
+                               snapshot, replay_len)
+        self.queue_len = queue_len
+        self.lagging = lagging
+        self.handshake_timeout = handshake_timeout
+        self._accept = Thread(name='selector_message_server',
+                              target=self._run_selector)
+        self._selector = selectors.DefaultSelector()
+        self._wake_recv, self._wake_send = socketpair()
+        self._wake_send.setblocking(False)
+        self._calls = deque()  # Calls queued for the I/O thread.
+        self._calls_lock = Lock()
+        self._name = None
+
+    def _run_selector(self):
+        LOG.threaddebug('SelectorMessageServer._run_selector called')
+        ipv4, port = self._socket.getsockname()
+        self._name = '%s[%s:%s]' % (gethostname(), ipv4, port)
+        self._socket.setblocking(False)
+        self._wake_recv.setblocking(False)
+        self._selector.register(self._socket, selectors.EVENT_READ)
+        self._selector.register(self._wake_recv, selectors.EVENT_READ)
+        LOG.info('accepting client connections "%s"', self._name)
+        next_check = monotonic() + 1.0
+        while self.running:
+            for key, events in self._selector.select(1.0):
+                if key.fileobj is self._socket:
+                    self._accept_clients()
+                elif key.fileobj is self._wake_recv:
+                    self._run_calls()
+                else:
+                    client = key.data
+                    if events & selectors.EVENT_READ:
+                        self._read(client)
+                    if events & selectors.EVENT_WRITE and client.connected:
+                        self._write(client)
+            if monotonic() >= next_check:
+                self._check_handshakes()
+                next_check = monotonic() + 1.0
+        for key in list(self._selector.get_map().values()):
+            if key.data:  # Connected and pending handshake clients.
+                self.close_client(key.data)
+        self._selector.close()
+        self._wake_recv.close()
+        self._wake_send.close()
+
+    def _accept_clients(self):
+        while True:  # Accept all pending connections.
+            try:
+                client_socket, client_address_tuple = self._socket.accept()
+            except (OSError, error):
+                return
+            client_socket.setblocking(False)
+            client = SelectorClient(self, client_socket, client_address_tuple)
+            self._selector.register(client_socket, selectors.EVENT_READ,
+                                    client)
+
+    def _check_handshakes(self):
+        now = monotonic()
+        for key in list(self._selector.get_map().values()):
+            client = key.data
+            if client and client.handshake is None and now >= client.deadline:
+                self.close_client(client, 'connect_to_client: handshake '
+                                          'timeout "%s"' % client.name)
+
+    def _run_calls(self):
+        try:
+            while self._wake_recv.recv(4096):
+                pass
+        except (OSError, error):
+            pass
+        while True:
+            with self._calls_lock:
+                if not self._calls:
+                    return
+                call = self._calls.popleft()
+            call()
+
+    def _read(self, client):
+        try:
+            data = client.socket.recv(65536)
+        except (OSError, error) as err:
+            if err.args and err.args[0] in (EAGAIN, EWOULDBLOCK):
+                return
+            self.close_client(client, 'recv: error "%s": %s'
+                              % (client.name, err))
+            return
+        if not data:
+            self.close_client(client, 'recv: disconnected "%s"' % client.name)
+            return
+        client.in_buffer += data
+        while len(client.in_buffer) >= MSG_LEN:
+            message = bytes(client.in_buffer[:MSG_LEN]).decode().strip()
+            del client.in_buffer[:MSG_LEN]
+            message = client.status.recv(message, datetime.now())
+            if client.handshake is None:
+                if not message:
+                    self.close_client(client, 'connect_to_client: connection '
+                                              'aborted "%s"' % client.name)
+                    return
+                client.handshake = message
+                client.name = message.split()[0] + client.name
+                client.status = MessageStatus(client.name)
+                client.session, frames = self.sessions.open(client)
+                if client.session:
+                    client.filter = client.session.filter
+                    for frame in frames:
+                        client.out_buffer += frame
+                with self._clients_lock:
+                    if self._snapshot:
+                        now_dt = datetime.now()
+                        for message in self._snapshot():
+                            client.enqueue(message, now_dt)
+                    self._clients.append(client)
+                if client.out_buffer:
+                    self._selector.modify(
+                        client.socket,
+                        selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+                LOG.info('connected "%s"', client.name)
+            elif (message and not client.filter.request(message)
+                  and self._process_request):
+                self._process_request(self._name, message)
+
+    def _write(self, client):
+        try:
+            sent = client.socket.send(client.out_buffer[:65536])
+        except (OSError, error) as err:
+            if err.args and err.args[0] in (EAGAIN, EWOULDBLOCK):
+                return
+            self.close_client(client, 'send: error "%s": %s'
+                              % (client.name, err))
+            return
+        frames = (len(client.out_buffer) + MSG_LEN - 1) // MSG_LEN
+        del client.out_buffer[:sent]
+        frames -= (len(client.out_buffer) + MSG_LEN - 1) // MSG_LEN
+        for frame in range(frames):  # Count each completely sent frame.
+            client.status.send()
+        if not client.out_buffer:
+            self._selector.modify(client.socket, selectors.EVENT_READ, client)
+
+    def _fan_out(self, message):
+        with self._clients_lock:
+            clients = list(self._clients)
+        channels = data_channels(message)
+        now_dt = datetime.now()  # One timestamp for all clients.
+        self.sessions.record(message, channels)
+        for client in clients:
+            if not client.filter.accepts(channels):
+                continue
+            was_empty = not client.out_buffer
+            if client.enqueue(message, now_dt) and was_empty:
+                self._write(client)  # Optimistic write; most sends complete.
+                if client.connected and client.out_buffer:
+                    self._selector.modify(
+                        client.socket,
+                        selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+
+    # Public methods:
+
+    def wake(self, call):
+        """
+        Queue a call to be run on the I/O thread and wake the thread if no
+        other calls are pending.  The check and append are made under
+        _calls_lock so that _run_calls cannot empty the queue in between and
+        leave the call without a wake.
+        """
+        with self._calls_lock:
+            idle = not self._calls
+            self._calls.append(call)
+        if idle:
+            try:
+                self._wake_send.send(b'w')
+            except (OSError, error):  # Wake buffer full; already awake.
+                pass
+
+    def close_client(self, client, err_msg=None):
+        """
+        Close a client connection (on the I/O thread).
+        """
+        if not client.connected:
+            return
+        client.connected = False
+        if err_msg:
+            LOG.error(err_msg)
+        try:
+            self._selector.unregister(client.socket)
+        except (KeyError, ValueError):
+            pass
+        client.socket.close()
+        with self._clients_lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def publish(self, message):
+        """
+        Fan out a message to every connected client.  The message is queued
+        for the I/O thread, so publish never blocks.
+        """
+        self.wake(lambda: self._fan_out(message))
+
+    def stop(self):
+        LOG.threaddebug('SelectorMessageServer.stop called')
+        self.running = False
+        self.wake(lambda: None)
+        MessageServer.stop(self)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram for latency and timing measurements.  Each bucket
+    counts the values that are less than or equal to its upper bound; values
+    above the last bound are counted in an overflow bucket.  add may be called
+    from any thread.  percentile returns an estimate interpolated within the
+    bucket that contains the requested rank.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self.bounds) + 1)
+            self.count = 0
+            self.sum = 0.0
+            self.min = None
+            self.max = None
+
+    def add(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def snapshot(self):
+        """
+        Return a consistent copy of the bucket counts, count, sum, min, and
+        max.
+        """
+        with self._lock:
+            return (list(self._counts), self.count, self.sum, self.min,
+                    self.max)
+
+    def percentile(self, pct):
+        counts, count, sum_, min_, max_ = self.snapshot()
+        return bucket_percentile(self.bounds, counts, pct, min_, max_)
+
+
+class Resolver:
+    """
+    Shared cache of hostname to IPv4 address lookups.  Successful lookups are
+    cached for ttl seconds and failed lookups for negative_ttl seconds.
+    Lookups run on a separate thread; resolve waits for at most timeout
+    seconds, and a lookup that is still running when the wait ends updates
+    the cache when it completes.  Concurrent requests for the same host share
+    one lookup.  When a lookup fails or times out, resolve returns the last
+    address that was resolved for the host, if any.  Lookup results are
+    counted by RESOLVE_RESULTS key and lookup durations are recorded in a
+    histogram.
+    """
+
+    # Private methods:
+
+    def __init__(self, ttl=RESOLVE_TTL, negative_ttl=RESOLVE_NEGATIVE_TTL,
+                 timeout=RESOLVE_TIMEOUT):
+        LOG.threaddebug('Resolver.__init__ called')
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self._lock = Lock()
+        self._entries = {}      # Cache entries by host name.
+        self.counts = dict.fromkeys(RESOLVE_RESULTS, 0)
+        self.lookup_time = Histogram()  # Lookup duration (ms).
+
+    @staticmethod
+    def _is_address(host):
+        parts = host.split('.')
+        return (len(parts) == 4
+                and all(part.isdigit() and int(part) < 256 for part in parts))
+
+    def _lookup(self, host):
+        start_time = monotonic()
+        address = None
+        error = None
+        try:
+            address = gethostbyname(host)
+        except (gaierror, herror) as err:
+            error = err.args[:2] if len(err.args) > 1 else (EAI_FAIL, str(err))
+        except Exception as err:  # Catch-all needed for Python 2.7.
+            error = (EAI_FAIL, str(err))
+        duration = 1000.0 * (monotonic() - start_time)
+        self.lookup_time.add(duration)
+        with self._lock:
+            entry = self._entries[host]
+            if address:
+                entry.update(address=address, last_good=address, error=None,
+                             expires=monotonic() + self.ttl)
+            else:
+                self.counts['failure'] += 1
+                entry.update(address=None, error=error,
+                             expires=monotonic() + self.negative_ttl)
+            event, entry['pending'] = entry['pending'], None
+        event.set()
+        LOG.debug('resolve: "%s" %s in %.1f ms', host,
+                  address or 'failed %s %s' % error, duration)
+
+    def _result(self, entry):
+        if entry['address']:
+            return entry['address']
+        if entry['last_good']:
+            self.counts['stale'] += 1
+            return entry['last_good']
+        raise gaierror(*(entry['error']
+                         or (EAI_AGAIN, 'address lookup timed out')))
+
+    # Public methods:
+
+    def resolve(self, host, timeout=None):
+        """
+        Return the IPv4 address of host (or host itself if it is already an
+        IPv4 address).  Raise gaierror if the host cannot be resolved and no
+        previous address is known.
+        """
+        if self._is_address(host):
+            return host
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is None:
+                entry = self._entries[host] = {
+                    'address': None, 'last_good': None, 'error': None,
+                    'expires': 0.0, 'pending': None}
+            if monotonic() < entry['expires']:
+                self.counts['hit'] += 1
+                return self._result(entry)
+            self.counts['miss'] += 1
+            event = entry['pending']
+            if event is None:
+                event = entry['pending'] = Event()
+                lookup = Thread(name='resolve %s' % host, target=self._lookup,
+                                args=(host,))
+                lookup.daemon = True
+                lookup.start()
+        if not event.wait(self.timeout if timeout is None else timeout):
+            with self._lock:
+                self.counts['timeout'] += 1
+                if entry['last_good']:
+                    self.counts['stale'] += 1
+                    return entry['last_good']
+            raise gaierror(EAI_AGAIN, 'address lookup timed out')
+        with self._lock:
+            return self._result(entry)
+
+    def stats(self):
+        """
+        Return a copy of the lookup result counts.
+        """
+        with self._lock:
+            return dict(self.counts)
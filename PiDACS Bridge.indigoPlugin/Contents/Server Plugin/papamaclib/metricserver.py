@@ -0,0 +1,191 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  metricserver.py
+   TITLE:  Prometheus text format metrics endpoint (metricserver)
+FUNCTION:  Provides a small HTTP server that publishes counters, gauges, and
+           histograms in the Prometheus text exposition format.
+   USAGE:  metricserver is imported and used within main programs.  It is
+           compatible with Python 2.7.16 and all versions of Python 3.x.
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2018-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+A MetricServer thread listens on a local TCP port and answers GET /metrics
+requests by calling a collect function supplied by the using module.  collect
+returns a list of metric families built with the counter, gauge, and
+histogram functions.  Each request is served on its own daemon thread, so a
+slow or stalled scraper never delays the threads that update the statistics.
+collect should only take snapshots of the statistics (no blocking I/O).
+
+DEPENDENCIES/LIMITATIONS:
+
+Histogram metric families require messagesocket.Histogram objects.
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+from threading import Thread
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2.7.
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from .colortext import getLogger
+
+# Global constants:
+
+LOG = getLogger('Plugin')               # Color logger.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# metricserver module functions:
+
+def set_logger(logger):                 # Allow using modules to change the
+    #                                     metricserver logger.
+    global LOG
+    LOG = logger
+    LOG.threaddebug('metricserver.set_logger called')
+
+
+def counter(name, help_, samples):
+    """
+    Return a counter metric family.  samples is a list of (labels, value)
+    tuples where labels is a dictionary of label names and values.
+    """
+    return name, 'counter', help_, samples
+
+
+def gauge(name, help_, samples):
+    return name, 'gauge', help_, samples
+
+
+def histogram(name, help_, samples):
+    """
+    Return a histogram metric family.  samples is a list of (labels,
+    Histogram) tuples.
+    """
+    return name, 'histogram', help_, samples
+
+
+def _labels(labels, extra=None):
+    items = sorted(labels.items())
+    if extra:
+        items.append(extra)
+    if not items:
+        return ''
+    pairs = ('%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                          .replace('"', '\\"').replace('\n', '\\n'))
+             for key, value in items)
+    return '{%s}' % ','.join(pairs)
+
+
+def format_metrics(families):
+    """
+    Render a list of metric families in the Prometheus text format.
+    """
+    lines = []
+    for name, type_, help_, samples in families:
+        lines.append('# HELP %s %s' % (name, help_))
+        lines.append('# TYPE %s %s' % (name, type_))
+        for labels, value in samples:
+            if type_ == 'histogram':
+                counts, count, sum_, min_, max_ = value.snapshot()
+                cumulative = 0
+                for bound, bucket_count in zip(value.bounds, counts):
+                    cumulative += bucket_count
+                    lines.append('%s_bucket%s %i' % (
+                        name, _labels(labels, ('le', repr(float(bound)))),
+                        cumulative))
+                lines.append('%s_bucket%s %i' % (
+                    name, _labels(labels, ('le', '+Inf')), count))
+                lines.append('%s_sum%s %r' % (name, _labels(labels),
+                                              float(sum_)))
+                lines.append('%s_count%s %i' % (name, _labels(labels),
+                                                count))
+            else:
+                lines.append('%s%s %r' % (name, _labels(labels),
+                                          float(value)))
+    return '\n'.join(lines) + '\n'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _MetricHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        try:
+            body = format_metrics(self.server.collect()).encode('utf-8')
+        except Exception as err:  # Never let a collect error kill the server.
+            LOG.error('MetricServer: collect exception %s', err)
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format_, *args):
+        LOG.threaddebug('MetricServer: ' + format_, *args)
+
+
+class MetricServer(Thread):
+    """
+    Serve the metric families returned by collect at http://address:port/
+    metrics until stop is called.
+    """
+
+    def __init__(self, port_number, collect, address='127.0.0.1'):
+        LOG.threaddebug('MetricServer.__init__ called')
+        Thread.__init__(self, name='MetricServer')
+        self.daemon = True
+        self._httpd = _ThreadingHTTPServer((address, port_number),
+                                           _MetricHandler)
+        self._httpd.collect = collect
+        self.name = 'MetricServer[%s:%s]' % self._httpd.server_address[:2]
+
+    def run(self):
+        LOG.info('serving metrics "%s"', self.name)
+        self._httpd.serve_forever(poll_interval=1.0)
+
+    def stop(self):
+        LOG.threaddebug('MetricServer.stop called')
+        self._httpd.shutdown()
+        self._httpd.server_close()
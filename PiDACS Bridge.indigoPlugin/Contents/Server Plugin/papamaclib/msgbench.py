@@ -0,0 +1,210 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  msgbench.py
+   TITLE:  MessageServer connection and fan-out benchmark (msgbench)
+FUNCTION:  Measures the client connection setup rate and the steady-state
+           fan-out throughput of the threaded MessageServer and the
+           SelectorMessageServer with many simultaneous clients.
+   USAGE:  python -m papamaclib.msgbench [-c clients] [-m messages]
+                  [-s {threaded,selector,both}] [-d handshake_delay]
+                  [-q silent_clients] [-b backlog]
+
+           msgbench requires Python 3.
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2018-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+The benchmark starts a server on the loopback interface and simulates a
+reconnect storm: all clients begin connecting at once and each sends its
+hostname frame after an optional handshake delay.  Optional silent clients
+connect first but never send a hostname; they stall a server that performs
+handshakes one at a time.  The connection setup rate is the number of clients
+divided by the time until the server reports all of them connected.  The
+server then publishes a burst of messages and the fan-out throughput is the
+number of frames delivered to all clients per second.  The simulated clients
+are driven by a single selector thread so that the benchmark itself does not
+need a thread per client.
+
+DEPENDENCIES/LIMITATIONS:
+
+Each client uses two file descriptors (client and server ends).  Raise the
+open file limit (ulimit -n) for more than about 500 clients.
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+import logging
+import selectors
+from argparse import ArgumentParser
+from socket import socket, AF_INET, SOCK_STREAM
+from threading import Thread
+from time import sleep
+
+from .messagesocket import MessageServer, SelectorMessageServer, MSG_LEN, \
+    BACKLOG, encode_message, monotonic
+
+# Global constants:
+
+PORT_NUMBER = 50999                     # Benchmark server port number.
+TIMEOUT = 60.0                          # Limit for each measurement (sec).
+
+
+class BenchmarkClients(Thread):
+    """
+    Connect, handshake, and count received frames for many clients on one
+    selector thread.
+    """
+
+    def __init__(self, count, port_number, handshake_delay=0.0, silent=0):
+        Thread.__init__(self, name='BenchmarkClients')
+        self.daemon = True
+        self._selector = selectors.DefaultSelector()
+        self._handshake_delay = handshake_delay
+        self._pending = []
+        self.received = 0
+        self.running = True
+        self._silent = []
+        for index in range(silent):
+            client = socket(AF_INET, SOCK_STREAM)
+            client.connect(('127.0.0.1', port_number))
+            self._silent.append(client)
+        for index in range(count):
+            client = socket(AF_INET, SOCK_STREAM)
+            client.setblocking(False)
+            client.connect_ex(('127.0.0.1', port_number))
+            self._selector.register(client, selectors.EVENT_WRITE,
+                                    'bench%03i' % index)
+
+    def run(self):
+        partial = {}
+        while self.running:
+            now = monotonic()
+            while self._pending and self._pending[0][0] <= now:
+                when, client, hostname = self._pending.pop(0)
+                client.send(encode_message(hostname, 0))
+                self._selector.register(client, selectors.EVENT_READ)
+            for key, events in self._selector.select(0.01):
+                if events & selectors.EVENT_WRITE:  # Connected.
+                    self._selector.unregister(key.fileobj)
+                    self._pending.append((now + self._handshake_delay,
+                                          key.fileobj, key.data))
+                else:
+                    try:
+                        data = key.fileobj.recv(65536)
+                    except OSError:  # Connection reset by the server.
+                        data = b''
+                    if not data:
+                        self._selector.unregister(key.fileobj)
+                        continue
+                    total = partial.get(key.fileobj, 0) + len(data)
+                    self.received += total // MSG_LEN
+                    partial[key.fileobj] = total % MSG_LEN
+
+    def stop(self):
+        self.running = False
+        self.join()
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        for when, client, hostname in self._pending:
+            client.close()
+        for client in self._silent:
+            client.close()
+        self._selector.close()
+
+
+def wait_for(condition, timeout=TIMEOUT):
+    end = monotonic() + timeout
+    while not condition() and monotonic() < end:
+        sleep(0.001)
+    return condition()
+
+
+def benchmark(server_class, clients, messages, handshake_delay, silent,
+              backlog):
+    server = server_class(PORT_NUMBER, queue_len=messages + 1,
+                          backlog=backlog)
+    server.start()
+    start = monotonic()
+    bench = BenchmarkClients(clients, PORT_NUMBER, handshake_delay, silent)
+    bench.start()
+    connected = wait_for(lambda: len(server.clients) >= clients)
+    setup = monotonic() - start
+    count = len(server.clients)
+
+    start = monotonic()
+    for index in range(messages):
+        server.publish('15 bench%04i %i' % (index % 64, index))
+    publish = monotonic() - start
+    wait_for(lambda: bench.received
+             + sum(client.dropped for client in server.clients)
+             >= count * messages)
+    fan_out = monotonic() - start
+    dropped = sum(client.dropped for client in server.clients)
+    print('%-10s %4i/%i clients connected in %6.3f sec (%7.1f/sec)%s'
+          % (server_class.__name__.replace('MessageServer', '') or 'Threaded',
+             count, clients, setup,
+             count / setup, '' if connected else ' TIMEOUT'))
+    print('%-10s %i messages published in %.3f sec; %i frames delivered in '
+          '%.3f sec (%.0f frames/sec, %i dropped)'
+          % ('', messages, publish, bench.received, fan_out,
+             bench.received / fan_out, dropped))
+    bench.stop()
+    server.stop()
+    sleep(0.5)
+
+
+def main():
+    parser = ArgumentParser(description='MessageServer benchmark')
+    parser.add_argument('-c', '--clients', type=int, default=500,
+                        help='number of clients (default 500)')
+    parser.add_argument('-m', '--messages', type=int, default=200,
+                        help='messages published (default 200)')
+    parser.add_argument('-s', '--server', default='both',
+                        choices=('threaded', 'selector', 'both'))
+    parser.add_argument('-d', '--handshake_delay', type=float, default=0.0,
+                        help='client delay before sending hostname (sec)')
+    parser.add_argument('-q', '--silent', type=int, default=0,
+                        help='clients that never send a hostname')
+    parser.add_argument('-b', '--backlog', type=int, default=BACKLOG,
+                        help='server listen backlog (default %i)' % BACKLOG)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)  # Ignore disconnect errors.
+    classes = {'threaded': [MessageServer],
+               'selector': [SelectorMessageServer],
+               'both': [MessageServer, SelectorMessageServer]}[args.server]
+    for server_class in classes:
+        benchmark(server_class, args.clients, args.messages,
+                  args.handshake_delay, args.silent, args.backlog)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  msgcapture.py
+   TITLE:  record and replay raw messagesocket frames (msgcapture)
+FUNCTION:  Provides a low-overhead, append-only, memory-mapped capture file
+           for the raw fixed-length frames received and sent by a
+           MessageSocket, and tools to replay a capture through a
+           MessageSocket or to a connected client.
+   USAGE:  msgcapture is imported by messagesocket and by main programs.  The
+           replay tool is run from the command line:
+
+           python -m papamaclib.msgcapture info capture.pdcap
+           python -m papamaclib.msgcapture replay capture.pdcap [-p port]
+                  [-s speed]
+
+           It is compatible with Python 2.7.16 and all versions of Python 3.x.
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2018-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+A capture file starts with a 16-byte header (8-byte magic string and the
+wall-clock time the file was created) followed by fixed-length records.  Each
+record contains a monotonic timestamp (double), a direction byte (R =
+received, S = sent), and the raw MSG_LEN byte frame exactly as it appeared on
+the socket.  The file is extended in CHUNK_SIZE steps and written through a
+memory map, so appending a record is a struct pack and a slice assignment.
+Each extension is allocated on disk before it is mapped; a write through the
+map to a sparse extension would raise SIGBUS if the disk were full.  Unused
+space at the end of the file is zero-filled; a zero direction byte marks the
+end of the records.  close truncates the file to its used length.  When a
+file reaches its maximum size it is renamed with a .1 suffix and a new file
+is started.  A file error while appending is logged and ends the capture;
+it is never raised to the socket thread.
+
+Replay reads the received (R) frames and sends them at the original speed, at
+a multiple of the original speed, or as fast as possible (speed 0).  Frames
+are normally restamped with new sequence numbers, datetimes, and CRCs so that
+MessageStatus latency and sequence checks reflect the replay rather than the
+original capture.
+
+DEPENDENCIES/LIMITATIONS:
+
+The capture format depends on the messagesocket MSG_LEN.  Gaps in a capture
+(between plugin sessions, for example) are limited to max_gap seconds during
+replay.
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+from argparse import ArgumentParser
+from errno import EINVAL, EOPNOTSUPP
+from mmap import mmap
+from os import rename
+from os.path import exists, getsize
+try:
+    from os import posix_fallocate
+except ImportError:  # Python 2.7 and macOS.
+    posix_fallocate = None
+from socket import socket, socketpair, AF_INET, SOCK_STREAM, SOL_SOCKET, \
+    SO_REUSEADDR, SHUT_WR
+from struct import Struct
+from threading import Lock
+from time import sleep, time
+
+from .colortext import getLogger
+from . import messagesocket
+from .messagesocket import MSG_LEN, HDR_LEN, monotonic, encode_message
+
+# Global constants:
+
+LOG = getLogger('Plugin')               # Color logger.
+MAGIC = b'PDCAP01\0'                    # Capture file magic string.
+FILE_HEADER = Struct('<8sd')            # Magic and creation time.
+RECORD_HEADER = Struct('<dc')           # Monotonic time and direction.
+RECORD_LEN = RECORD_HEADER.size + MSG_LEN
+CHUNK_SIZE = 1 << 20                    # File extension size (bytes).
+MAX_SIZE = 64 << 20                     # Default maximum file size (bytes).
+RECEIVED = b'R'
+SENT = b'S'
+
+
+# msgcapture module functions:
+
+def set_logger(logger):                 # Allow using modules to change the
+    #                                     msgcapture logger.
+    global LOG
+    LOG = logger
+    LOG.threaddebug('msgcapture.set_logger called')
+
+
+def read_capture(path):
+    """
+    Generate (timestamp, direction, frame) tuples for the records in a
+    capture file.
+    """
+    with open(path, 'rb') as capture:
+        magic, created = FILE_HEADER.unpack(capture.read(FILE_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('not a capture file "%s"' % path)
+        while True:
+            record = capture.read(RECORD_LEN)
+            if len(record) < RECORD_LEN:
+                return
+            timestamp, direction = RECORD_HEADER.unpack_from(record)
+            if direction == b'\0':
+                return
+            yield timestamp, direction, record[RECORD_HEADER.size:]
+
+
+def restamp(frame, seq):
+    """
+    Return the frame with a new sequence number, the current datetime, and a
+    new CRC.
+    """
+    return encode_message(frame[HDR_LEN:].decode(), seq)
+
+
+def replay(path, send_frame, speed=1.0, direction=RECEIVED, restamped=True,
+           max_gap=10.0, running=lambda: True):
+    """
+    Call send_frame for each frame in the capture with the given direction,
+    pacing the calls to match the captured timestamps divided by speed.  A
+    speed of 0 replays as fast as possible.  Return the number of frames
+    replayed.
+    """
+    LOG.threaddebug('msgcapture.replay called "%s"', path)
+    count = 0
+    seq = 0
+    previous = None
+    next_time = monotonic()
+    for timestamp, direction_, frame in read_capture(path):
+        if direction_ != direction:
+            continue
+        if not running():
+            break
+        if speed and previous is not None:
+            gap = min(max(timestamp - previous, 0.0), max_gap)
+            next_time += gap / speed
+            delay = next_time - monotonic()
+            if delay > 0:
+                sleep(delay)
+        previous = timestamp
+        if send_frame(restamp(frame, seq) if restamped else frame) is None:
+            break
+        seq = messagesocket.next_seq(seq)
+        count += 1
+    return count
+
+
+def replay_to_process(path, process_message, speed=0.0, name='replay'):
+    """
+    Feed the received frames in a capture through a MessageSocket (header
+    validation and MessageStatus accounting) and call process_message(name,
+    message) for each valid message, as PluginServer does.  Return the
+    MessageStatus counters for the replay.
+    """
+    LOG.threaddebug('msgcapture.replay_to_process called "%s"', path)
+    send_socket, recv_socket = socketpair()
+    receiver = messagesocket.MessageSocket(name,
+                                           process_message=process_message)
+    receiver.connect_to_client(recv_socket, ('replay', 0),
+                               hostname=name)
+    receiver.start()
+    try:
+        replay(path, lambda frame: send_socket.sendall(frame) or True, speed)
+    finally:
+        receiver.expect_disconnect()
+        send_socket.shutdown(SHUT_WR)
+        receiver.join()
+        send_socket.close()
+    return receiver.status.counters()
+
+
+class CaptureWriter:
+    """
+    Append raw frames with monotonic timestamps to a memory-mapped capture
+    file.  append may be called from the recv and send threads of a
+    MessageSocket concurrently.
+    """
+
+    # Private methods:
+
+    def __init__(self, path, max_size=MAX_SIZE):
+        LOG.threaddebug('CaptureWriter.__init__ called "%s"', path)
+        self.path = path
+        self._max_size = max_size
+        self._lock = Lock()
+        self._file = None
+        self._map = None
+        self._offset = 0
+        self._open()
+
+    def _open(self):
+        """
+        Open the capture file for appending and map it into memory.  Existing
+        records are preserved; the append offset is set after the last one.
+        """
+        if exists(self.path) and getsize(self.path) >= FILE_HEADER.size:
+            self._file = open(self.path, 'r+b')
+            if self._file.read(len(MAGIC)) != MAGIC:
+                self._file.close()
+                rename(self.path, self.path + '.bad')
+                self._open()
+                return
+            self._offset = FILE_HEADER.size
+            for record in read_capture(self.path):
+                self._offset += RECORD_LEN
+        else:
+            self._file = open(self.path, 'w+b')
+            self._file.write(FILE_HEADER.pack(MAGIC, time()))
+            self._offset = FILE_HEADER.size
+        self._map_file(self._offset + RECORD_LEN)
+
+    def _allocate(self, size):
+        """
+        Extend the file to size bytes with allocated, zero-filled blocks, so
+        that a full disk raises an error here instead of a SIGBUS when the
+        memory map is written.
+        """
+        self._file.seek(0, 2)
+        length = self._file.tell()
+        if length >= size:
+            return
+        if posix_fallocate:
+            try:
+                posix_fallocate(self._file.fileno(), length, size - length)
+                return
+            except OSError as err:
+                if err.errno not in (EINVAL, EOPNOTSUPP):
+                    raise
+        self._file.write(b'\0' * (size - length))
+        self._file.flush()
+
+    def _map_file(self, min_size):
+        size = (min_size // CHUNK_SIZE + 1) * CHUNK_SIZE
+        self._allocate(size)
+        self._map = mmap(self._file.fileno(), size)
+
+    def _unmap_file(self):
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        self._file.truncate(self._offset)
+        self._file.close()
+        self._file = None
+
+    def _disable(self, err):
+        """
+        End the capture after a file error.  The error is logged once;
+        subsequent appends are ignored.
+        """
+        LOG.error('CaptureWriter: capture ended "%s": %s', self.path, err)
+        for resource in (self._map, self._file):
+            if resource is not None:
+                try:
+                    resource.close()
+                except (EnvironmentError, ValueError):
+                    pass
+        self._map = None
+        self._file = None
+
+    # Public methods:
+
+    def append(self, direction, frame):
+        with self._lock:
+            if self._map is None:
+                return
+            end = self._offset + RECORD_LEN
+            if end > len(self._map):
+                try:
+                    if end > self._max_size:  # Rotate the capture file.
+                        self._unmap_file()
+                        rename(self.path, self.path + '.1')
+                        self._open()
+                    else:
+                        self._map.close()
+                        self._map_file(end)
+                except (EnvironmentError, ValueError) as err:
+                    # EnvironmentError includes IOError, OSError, and (in
+                    # Python 2.7) mmap.error.
+                    self._disable(err)
+                    return
+                end = self._offset + RECORD_LEN
+            RECORD_HEADER.pack_into(self._map, self._offset, monotonic(),
+                                    direction)
+            self._map[self._offset + RECORD_HEADER.size:end] = frame
+            self._offset = end
+
+    def close(self):
+        LOG.threaddebug('CaptureWriter.close called "%s"', self.path)
+        with self._lock:
+            if self._map is not None:
+                self._unmap_file()
+
+
+# msgcapture command line interface:
+
+def _info(args):
+    counts = {RECEIVED: 0, SENT: 0}
+    first = last = None
+    for timestamp, direction, frame in read_capture(args.capture):
+        counts[direction] = counts.get(direction, 0) + 1
+        first = timestamp if first is None else first
+        last = timestamp
+    duration = (last - first) if first is not None else 0.0
+    total = counts[RECEIVED] + counts[SENT]
+    print('%s: %i frames (%i received, %i sent) over %.1f sec (%.1f/sec)'
+          % (args.capture, total, counts[RECEIVED], counts[SENT], duration,
+             total / duration if duration else 0.0))
+
+
+def _serve(args):
+    """
+    Act as a stand-in PiDACS server: accept one client connection, read its
+    hostname frame, and replay the captured received frames to it.  Requests
+    sent by the client are read and discarded.
+    """
+    listener = socket(AF_INET, SOCK_STREAM)
+    listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    listener.bind(('', args.port))
+    listener.listen(1)
+    print('waiting for a client on port %i' % args.port)
+    client_socket, client_address_tuple = listener.accept()
+    listener.close()
+    client = messagesocket.MessageSocket('replay')
+    client.connect_to_client(client_socket, client_address_tuple)
+    client.start()  # Drain client requests.
+    start = monotonic()
+    count = replay(args.capture, lambda frame: client.send_frame(frame),
+                   args.speed, restamped=not args.raw, max_gap=args.max_gap,
+                   running=lambda: client.connected)
+    elapsed = monotonic() - start
+    print('replayed %i frames in %.2f sec (%.1f/sec)'
+          % (count, elapsed, count / elapsed if elapsed else 0.0))
+    client.stop()
+
+
+def main():
+    parser = ArgumentParser(description='PiDACS message capture tools')
+    subparsers = parser.add_subparsers(dest='command')
+    info = subparsers.add_parser('info', help='summarize a capture file')
+    info.add_argument('capture')
+    serve = subparsers.add_parser('replay',
+                                  help='replay received frames to a client')
+    serve.add_argument('capture')
+    serve.add_argument('-p', '--port', type=int, default=50000,
+                       help='listening port number (default 50000)')
+    serve.add_argument('-s', '--speed', type=float, default=1.0,
+                       help='replay speed multiple; 0 = as fast as possible')
+    serve.add_argument('-g', '--max_gap', type=float, default=10.0,
+                       help='maximum gap between frames (sec)')
+    serve.add_argument('-r', '--raw', action='store_true',
+                       help='send frames without restamping headers')
+    args = parser.parse_args()
+    if args.command == 'info':
+        _info(args)
+    elif args.command == 'replay':
+        _serve(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
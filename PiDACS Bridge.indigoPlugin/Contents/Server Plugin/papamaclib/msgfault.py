@@ -0,0 +1,584 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  msgfault.py
+   TITLE:  MessageSocket network fault-injection harness (msgfault)
+FUNCTION:  Runs scripted network fault scenarios through a local TCP proxy
+           between a MessageSocket client and a stand-in MessageServer, and
+           measures fault detection time, reconnect time, frames lost, and
+           the MessageStatus error classification for each scenario.
+   USAGE:  python -m papamaclib.msgfault [-s scenario [scenario ...]]
+                  [-r rate] [-t recv_timeout] [-d reconnect_delay]
+                  [-n count] [--sessions] [-v]
+
+           msgfault exits with status 1 if any scenario fails its expected
+           result, so that it can be run as a regression suite.  msgfault
+           requires Python 3.
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2018-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+The harness starts a MessageServer on the loopback interface that publishes
+numbered DATA messages at a fixed rate, and a FaultProxy that forwards
+client connections to it.  For each scenario, a FaultClient connects a
+MessageSocket through the proxy with the PluginServer reconnect behavior: a
+new MessageSocket is connected reconnect_delay seconds after a disconnect,
+resuming its session if --sessions is given.  When the client is receiving,
+the fault is injected and the harness waits for recovery.
+
+The proxy runs all connections on one selector thread.  Frames from the
+server are reassembled and passed through the injected fault, and the
+resulting segments are scheduled for sending to the client.  Faults:
+
+split      send each frame in SPLIT_LEN byte segments SPLIT_DELAY apart
+stall      hold all frames for the fault duration, then release them
+duplicate  send a frame twice
+drop       discard a frame
+corrupt    change a data byte so that the CRC check fails
+datetime   replace the datetime and recompute the CRC
+short      replace a frame with blanks
+reset      close the client connection with a TCP reset
+silence    stop forwarding in both directions, leaving the connection open
+
+Frame faults are applied to count frames, every FAULT_SPACING frames, so
+that each faulted frame is classified separately.  For each scenario, the
+harness reports the result (ok or FAIL), the detection time (fault injection
+to the first MessageStatus error count or disconnect), the reconnect time
+(disconnect to the first valid frame on the new connection), the published
+frames lost and duplicated, and the MessageStatus error counts (shorts,
+crc_errs, dt_errs, seq_errs).  A scenario fails if the error counts, the
+frames lost, or the disconnect behavior differ from its expected result.
+
+DEPENDENCIES/LIMITATIONS:
+
+A silent peer is detected by the MessageSocket recv timeout, which is only
+checked when a socket recv times out (SOCKET_TIMEOUT), so silence detection
+takes between recv_timeout and recv_timeout + SOCKET_TIMEOUT seconds.
+Frames lost after a reset are not checked unless --sessions is given.
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+import logging
+import selectors
+import sys
+from argparse import ArgumentParser
+from collections import deque
+from socket import socket, create_connection, AF_INET, SOCK_STREAM, \
+    SOL_SOCKET, SO_REUSEADDR, SO_LINGER
+from struct import pack
+from threading import Lock, Thread, Timer
+from time import sleep
+from zlib import crc32
+
+from .colortext import DATA
+from .messagesocket import MessageServer, MessageSocket, COUNTER_NAMES, \
+    CRC_LEN, HEX_LEN, DT_LEN, HDR_LEN, MSG_LEN, NEW_SESSION, SOCKET_TIMEOUT, \
+    monotonic
+
+# Global constants:
+
+PORT_NUMBER = 50998                     # Stand-in server port number.
+PROXY_PORT = 50997                      # Fault proxy port number.
+SPLIT_LEN = 7                           # Split fault segment length (bytes).
+SPLIT_DELAY = 0.002                     # Split fault segment delay (sec).
+FAULT_SPACING = 10                      # Frames between faulted frames.
+WARM_UP = 50                            # Frames received before a fault.
+SETTLE_TIME = 0.5                       # Wait after a fault (sec).
+ERROR_NAMES = COUNTER_NAMES[:4]         # MessageStatus error counters.
+SCENARIOS = (                           # Scenario name (and fault), count,
+    ('split', 100, 0.0),                # and duration (sec).
+    ('stall', 1, 3.0),
+    ('duplicate', 5, 0.0),
+    ('drop', 5, 0.0),
+    ('corrupt', 5, 0.0),
+    ('datetime', 5, 0.0),
+    ('short', 5, 0.0),
+    ('reset', 1, 0.0),
+    ('silence', 1, 0.0))
+SCENARIO_NAMES = [scenario[0] for scenario in SCENARIOS]
+
+
+def expected_result(fault, count, sessions):
+    """
+    Return the expected (error counts, frames lost, disconnect) for a
+    scenario.  Frames lost is None if it is not checked.  A frame rejected
+    by a header check is followed by a sequence error for the next frame.
+    """
+    errors = dict.fromkeys(ERROR_NAMES, 0)
+    lost = 0
+    disconnect = False
+    if fault in ('duplicate', 'drop'):
+        errors['seq_errs'] = count
+        lost = count if fault == 'drop' else 0
+    elif fault in ('corrupt', 'datetime', 'short'):
+        errors[{'corrupt': 'crc_errs', 'datetime': 'dt_errs',
+                'short': 'shorts'}[fault]] = count
+        errors['seq_errs'] = count
+        lost = count
+    elif fault in ('reset', 'silence'):
+        disconnect = True
+        lost = 0 if sessions and fault == 'reset' else None
+    return errors, lost, disconnect
+
+
+class FaultConnection:
+    """
+    One proxied client connection: the client and upstream server sockets,
+    the partial frame received from the server, and the scheduled segments
+    for the client.
+    """
+
+    def __init__(self, client, upstream):
+        self.client = client
+        self.upstream = upstream
+        self.buffer = b''
+        self.pending = deque()  # (due time, segment) for the client.
+        self.last_due = 0.0
+        self.silent = False
+
+    def schedule(self, segment, due):
+        due = max(due, self.last_due)
+        self.pending.append((due, segment))
+        self.last_due = due
+
+
+class FaultProxy(Thread):
+    """
+    Forward client connections to a MessageServer on a single selector
+    thread and apply an injected fault to the frames sent by the server.
+    """
+
+    # Private methods:
+
+    def __init__(self, port_number, server_port):
+        Thread.__init__(self, name='FaultProxy')
+        self.daemon = True
+        self._server_port = server_port
+        self._listener = socket(AF_INET, SOCK_STREAM)
+        self._listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self._listener.bind(('127.0.0.1', port_number))
+        self._listener.listen(16)
+        self._listener.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._lock = Lock()
+        self._fault = None      # [name, remaining count, duration].
+        self._frames = 0        # Frames since the fault was injected.
+        self.injected = None    # monotonic time the fault was first applied.
+        self.completed = None   # monotonic time the fault was last applied.
+        self.running = True
+
+    def _accept(self):
+        client, address = self._listener.accept()
+        try:
+            upstream = create_connection(('127.0.0.1', self._server_port))
+        except OSError:
+            client.close()
+            return
+        connection = FaultConnection(client, upstream)
+        self._selector.register(client, selectors.EVENT_READ, connection)
+        self._selector.register(upstream, selectors.EVENT_READ, connection)
+
+    def _close(self, connection, reset=False):
+        for sock in (connection.client, connection.upstream):
+            try:
+                self._selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+        if reset:
+            connection.client.setsockopt(SOL_SOCKET, SO_LINGER,
+                                         pack('ii', 1, 0))
+        connection.client.close()
+        connection.upstream.close()
+
+    def _take(self):
+        """
+        Return the fault to apply to the next frame from the server and its
+        duration, or (None, 0.0).
+        """
+        with self._lock:
+            if self._fault is None:
+                return None, 0.0
+            name, remaining, duration = self._fault
+            self._frames += 1
+            if name not in ('reset', 'silence', 'stall') and (
+                    self._frames - 1) % FAULT_SPACING:
+                return None, 0.0
+            now = monotonic()
+            if self.injected is None:
+                self.injected = now
+            self.completed = now
+            self._fault[1] -= 1
+            if not self._fault[1]:
+                self._fault = None
+            return name, duration
+
+    def _from_server(self, connection, data):
+        connection.buffer += data
+        while len(connection.buffer) >= MSG_LEN:
+            frame = connection.buffer[:MSG_LEN]
+            connection.buffer = connection.buffer[MSG_LEN:]
+            if connection.silent:
+                continue
+            fault, duration = self._take()
+            now = monotonic()
+            if fault == 'reset':
+                self._close(connection, reset=True)
+                return
+            if fault == 'silence':
+                connection.silent = True
+                continue
+            if fault == 'stall':
+                connection.last_due = max(connection.last_due,
+                                          now + duration)
+            elif fault == 'drop':
+                continue
+            elif fault == 'corrupt':
+                index = HDR_LEN + 1
+                byte = b'X' if frame[index:index + 1] != b'X' else b'Y'
+                frame = frame[:index] + byte + frame[index + 1:]
+            elif fault == 'datetime':
+                text = frame.decode()
+                body = (text[CRC_LEN:HEX_LEN] + 'x' * DT_LEN
+                        + text[HDR_LEN:])
+                crc = crc32(body.rstrip().encode()) & 0xffffffff
+                frame = ('%08x%s' % (crc, body)).encode()
+            elif fault == 'short':
+                frame = b' ' * MSG_LEN
+            if fault == 'split':
+                for index in range(0, MSG_LEN, SPLIT_LEN):
+                    connection.schedule(frame[index:index + SPLIT_LEN],
+                                        now + SPLIT_DELAY * (index
+                                                             // SPLIT_LEN))
+            else:
+                connection.schedule(frame, now)
+                if fault == 'duplicate':
+                    connection.schedule(frame, now)
+        self._send_due(connection)
+
+    def _send_due(self, connection):
+        now = monotonic()
+        while connection.pending and connection.pending[0][0] <= now:
+            due, segment = connection.pending.popleft()
+            try:
+                connection.client.sendall(segment)
+            except OSError:
+                self._close(connection)
+                return
+
+    def _connections(self):
+        return set(key.data for key in self._selector.get_map().values()
+                   if key.data)
+
+    # Public methods:
+
+    def inject(self, fault, count=1, duration=0.0):
+        with self._lock:
+            self._fault = [fault, count, duration]
+            self._frames = 0
+            self.injected = self.completed = None
+
+    @property
+    def pending(self):
+        with self._lock:
+            return self._fault is not None
+
+    def run(self):
+        while self.running:
+            connections = self._connections()
+            dues = [connection.pending[0][0] for connection in connections
+                    if connection.pending]
+            wait = 0.01
+            if dues:
+                wait = max(0.0, min(min(dues) - monotonic(), wait))
+            for key, events in self._selector.select(wait):
+                connection = key.data
+                if connection is None:
+                    self._accept()
+                    continue
+                try:
+                    data = key.fileobj.recv(65536)
+                except OSError:
+                    data = b''
+                if not data:
+                    self._close(connection)
+                elif key.fileobj is connection.upstream:
+                    self._from_server(connection, data)
+                elif not connection.silent:
+                    try:
+                        connection.upstream.sendall(data)
+                    except OSError:
+                        self._close(connection)
+            for connection in self._connections():
+                if connection.pending:
+                    self._send_due(connection)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        for connection in self._connections():
+            self._close(connection)
+        self._selector.close()
+        self._listener.close()
+
+
+class Publisher(Thread):
+    """
+    Publish numbered DATA messages from a MessageServer at a fixed rate.
+    """
+
+    def __init__(self, server, rate):
+        Thread.__init__(self, name='Publisher')
+        self.daemon = True
+        self._server = server
+        self._period = 1.0 / rate
+        self.value = 0          # Number of the last published message.
+        self.running = True
+
+    def run(self):
+        next_time = monotonic()
+        while self.running:
+            self.value += 1
+            self._server.publish('%2i fault00 %i' % (DATA, self.value))
+            next_time += self._period
+            sleep(max(0.0, next_time - monotonic()))
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+
+class FaultClient:
+    """
+    Connect MessageSockets through the proxy and reconnect after disconnects
+    like PluginServer.  Record the message numbers received, the disconnect
+    times, and the time of the first valid frame on each connection.
+    """
+
+    # Private methods:
+
+    def __init__(self, port_number, recv_timeout, reconnect_delay, sessions):
+        self._port_number = port_number
+        self._recv_timeout = recv_timeout
+        self._reconnect_delay = reconnect_delay
+        self._session = (NEW_SESSION, 0) if sessions else None
+        self._lock = Lock()
+        self._closing = False
+        self._first = True
+        self.sockets = []
+        self.counts = {}        # Times received by message number.
+        self.received = 0
+        self.disconnects = []   # monotonic disconnect times.
+        self.connects = []      # monotonic times of the first valid frame.
+
+    def _disconnected(self, reference_name):
+        now = monotonic()
+        with self._lock:
+            self.disconnects.append(now)
+            if self._session:
+                self._session = self.sockets[-1].resume_point or self._session
+        if not self._closing:
+            Timer(self._reconnect_delay, self.connect).start()
+
+    def _process(self, reference_name, message):
+        split = message.split()
+        if len(split) < 3 or split[1] != 'fault00':
+            return
+        with self._lock:
+            if self._first:
+                self._first = False
+                self.connects.append(monotonic())
+            value = int(split[2])
+            self.counts[value] = self.counts.get(value, 0) + 1
+            self.received += 1
+
+    # Public methods:
+
+    def connect(self):
+        while not self._closing:
+            sock = MessageSocket('fault', disconnected=self._disconnected,
+                                 process_message=self._process,
+                                 recv_timeout=self._recv_timeout)
+            sock.connect_to_server('127.0.0.1', self._port_number,
+                                   self._session)
+            if sock.connected:
+                with self._lock:
+                    self._first = True
+                    self.sockets.append(sock)
+                sock.start()
+                return
+            sleep(self._reconnect_delay)
+
+    def errors(self):
+        totals = dict.fromkeys(ERROR_NAMES, 0)
+        for sock in list(self.sockets):
+            counters = sock.status.counters()
+            for name in ERROR_NAMES:
+                totals[name] += counters[name]
+        return totals
+
+    def close(self):
+        self._closing = True
+        for sock in list(self.sockets):
+            sock.stop(1.0)
+
+
+def wait_for(condition, timeout):
+    end = monotonic() + timeout
+    while not condition() and monotonic() < end:
+        sleep(0.001)
+    return condition()
+
+
+def run_scenario(fault, count, duration, publisher, args):
+    """
+    Run one fault scenario and return a result dictionary.
+    """
+    proxy = FaultProxy(PROXY_PORT, PORT_NUMBER)
+    proxy.start()
+    client = FaultClient(PROXY_PORT, args.recv_timeout,
+                         args.reconnect_delay, args.sessions)
+    client.connect()
+    wait_for(lambda: client.received >= WARM_UP, 10.0)
+    errors_before = client.errors()
+    start_value = publisher.value
+    expected_errors, expected_lost, disconnect = expected_result(
+        fault, count, args.sessions)
+    proxy.inject(fault, count, duration)
+
+    # Wait for detection and recovery.
+
+    if disconnect:
+        timeout = (args.recv_timeout + SOCKET_TIMEOUT + args.reconnect_delay
+                   + 10.0)
+    else:
+        timeout = (duration + 2.0 * count * FAULT_SPACING / args.rate
+                   + 10.0)
+    end = monotonic() + timeout
+    detected = None
+    while monotonic() < end:
+        now = monotonic()
+        if detected is None and (client.disconnects
+                                 or client.errors() != errors_before):
+            detected = now
+        if disconnect:
+            if client.disconnects and len(client.connects) > 1:
+                break
+        elif not proxy.pending and now > proxy.completed + SETTLE_TIME:
+            break
+        sleep(0.001)
+    sleep(max(duration, SETTLE_TIME))
+    end_value = publisher.value
+    sleep(SETTLE_TIME)  # Let frames in flight arrive.
+    client.close()
+    proxy.stop()
+
+    # Compile the results.
+
+    errors_after = client.errors()
+    errors = dict((name, errors_after[name] - errors_before[name])
+                  for name in ERROR_NAMES)
+    values = range(start_value + 1, end_value + 1)
+    lost = sum(1 for value in values if value not in client.counts)
+    duplicated = sum(client.counts.get(value, 1) - 1 for value in values)
+    injected = proxy.injected
+    detect = reconnect = None
+    if client.disconnects and injected is not None:
+        detected = client.disconnects[0]
+        if len(client.connects) > 1:
+            reconnect = 1000.0 * (client.connects[1] - detected)
+    if detected is not None and injected is not None:
+        detect = 1000.0 * max(detected - injected, 0.0)
+    ok = (injected is not None and errors == expected_errors
+          and bool(client.disconnects) == disconnect
+          and (not disconnect or reconnect is not None)
+          and (expected_lost is None or lost == expected_lost))
+    return {'scenario': fault, 'ok': ok, 'detect': detect,
+            'reconnect': reconnect, 'lost': lost, 'duplicated': duplicated,
+            'errors': errors}
+
+
+def print_result(result):
+    def ms(value):
+        return '%10s' % ('-' if value is None else '%.1f' % value)
+    errors = result['errors']
+    print('%-10s %-4s %s %s %6i %6i   %s' % (
+        result['scenario'], 'ok' if result['ok'] else 'FAIL',
+        ms(result['detect']), ms(result['reconnect']), result['lost'],
+        result['duplicated'],
+        ' '.join('%i' % errors[name] for name in ERROR_NAMES)))
+
+
+def main():
+    parser = ArgumentParser(description='MessageSocket fault-injection '
+                                        'harness')
+    parser.add_argument('-s', '--scenarios', nargs='+',
+                        choices=SCENARIO_NAMES, default=SCENARIO_NAMES,
+                        help='scenarios to run (default all)')
+    parser.add_argument('-r', '--rate', type=float, default=200.0,
+                        help='messages published per second (default 200)')
+    parser.add_argument('-t', '--recv_timeout', type=float, default=5.0,
+                        help='client recv timeout (default 5 sec)')
+    parser.add_argument('-d', '--reconnect_delay', type=float, default=2.0,
+                        help='delay before reconnecting (default 2 sec)')
+    parser.add_argument('-n', '--count', type=int,
+                        help='frames faulted (default per scenario)')
+    parser.add_argument('--sessions', action='store_true',
+                        help='resume sessions after reconnecting')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log messagesocket errors and warnings')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING if args.verbose
+                        else logging.CRITICAL)
+    server = MessageServer(PORT_NUMBER)
+    server.start()
+    publisher = Publisher(server, args.rate)
+    publisher.start()
+    print('%-10s %-4s %10s %10s %6s %6s   %s' % (
+        'scenario', '', 'detect ms', 'reconn ms', 'lost', 'dup',
+        'shorts crc dt seq'))
+    failures = 0
+    for fault, count, duration in SCENARIOS:
+        if fault not in args.scenarios:
+            continue
+        if args.count and fault not in ('reset', 'silence', 'stall'):
+            count = args.count
+        result = run_scenario(fault, count, duration, publisher, args)
+        print_result(result)
+        failures += not result['ok']
+    publisher.stop()
+    server.stop()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  msghistory.py
+   TITLE:  bounded multi-resolution value history (msghistory)
+FUNCTION:  Provides fixed-size ring buffers of timestamped values with
+           incrementally computed min/max/mean rollups at several time
+           resolutions.
+   USAGE:  msghistory is imported by main programs that keep a short history
+           of measured values.  It is compatible with Python 2.7.16 and all
+           versions of Python 3.x.
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2018-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+A ChannelHistory keeps the most recent raw (time, value) samples in a Ring of
+RAW_LEN entries and one rollup Ring for each (resolution, length) level in
+LEVELS.  Each rollup entry holds the bucket start time and the min, max, sum,
+and count of the values in the bucket.  Buckets are aligned to multiples of
+the resolution in wall-clock time.
+
+Rollups are computed incrementally.  When a sample arrives after the end of
+the open bucket of a level, the bucket is closed by reducing the entries of
+the next finer level (the raw samples for the first level) that fall in the
+bucket: min of the mins, max of the maxes, and sums of the sums and counts.
+Buckets that have ended are also closed when series or summary is called, so
+that the rollups of a quiet channel are current.  The reductions operate on
+contiguous column slices of the finer ring, using NumPy array methods when
+NumPy is available and the built-in min, max, and sum on array module slices
+otherwise.  Levels are closed from finest to coarsest so that each reduction
+sees the just-closed finer buckets.  Buckets with no samples are not stored.
+
+Memory is fixed when a ChannelHistory is created: 8 bytes per column per ring
+entry, about 90 KB per channel with the default sizes (see nbytes).
+
+DEPENDENCIES/LIMITATIONS:
+
+NumPy is optional.  The first rollup level is reduced from the raw ring, so
+samples are aggregated completely only if no more than RAW_LEN samples arrive
+in one first-level bucket (1000 samples/sec by default).  The open bucket of
+each level is not included in the rollups until it is closed.
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+from array import array
+from threading import Lock
+from time import time
+try:
+    import numpy
+except ImportError:  # NumPy is optional; use array module storage.
+    numpy = None
+    reduce_min, reduce_max, reduce_sum = min, max, sum
+else:
+    reduce_min, reduce_max, reduce_sum = numpy.min, numpy.max, numpy.sum
+
+from .colortext import getLogger
+
+# Global constants:
+
+LOG = getLogger('Plugin')               # Color logger.
+RAW_LEN = 1000                          # Raw samples retained.
+LEVELS = ((1, 300),                     # Rollup (resolution, length) levels:
+          (60, 1440),                   # 5 minutes of 1 sec buckets, 1 day
+          (3600, 168))                  # of 1 min buckets, and 1 week of 1
+#                                         hour buckets.
+TIME, MIN, MAX, SUM, COUNT = range(5)   # Rollup ring columns.
+VALUE = 1                               # Raw ring value column.
+
+
+# msghistory module functions:
+
+def set_logger(logger):                 # Allow using modules to change the
+    #                                     msghistory logger.
+    global LOG
+    LOG = logger
+    LOG.threaddebug('msghistory.set_logger called')
+
+
+class Ring:
+    """
+    Fixed-capacity ring buffer of float columns.  Entries are appended in
+    time order (column TIME); the oldest entry is overwritten when the ring
+    is full.
+    """
+
+    # Private methods:
+
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.size = 0
+        self._next = 0          # Index of the next entry to be written.
+        if numpy is not None:
+            self._columns = [numpy.zeros(capacity) for _ in range(columns)]
+        else:
+            self._columns = [array('d', [0.0]) * capacity
+                             for _ in range(columns)]
+
+    def _time(self, index):
+        """
+        Return the time of an entry by its age order (0 = oldest).
+        """
+        return self._columns[TIME][(self._next - self.size + index)
+                                   % self.capacity]
+
+    # Public methods:
+
+    @property
+    def nbytes(self):
+        return 8 * self.capacity * len(self._columns)
+
+    def append(self, *values):
+        for column, value in zip(self._columns, values):
+            column[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def count_since(self, start):
+        """
+        Return the number of the newest entries with time >= start.
+        """
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self._time(middle) < start:
+                low = middle + 1
+            else:
+                high = middle
+        return self.size - low
+
+    def column(self, index, count):
+        """
+        Return the newest count values of a column in time order as a NumPy
+        array or an array module array.
+        """
+        data = self._columns[index]
+        start = self._next - count
+        if start >= 0:
+            return data[start:self._next]
+        if numpy is not None:
+            return numpy.concatenate((data[start:], data[:self._next]))
+        return data[start:] + data[:self._next]
+
+
+class ChannelHistory:
+    """
+    Bounded raw and rolled-up history of the values of one channel.
+    """
+
+    # Private methods:
+
+    def __init__(self, raw_len=RAW_LEN, levels=LEVELS):
+        LOG.threaddebug('ChannelHistory.__init__ called')
+        self._lock = Lock()
+        self._raw = Ring(raw_len, 2)
+        self._levels = [(resolution, Ring(length, 5))
+                        for resolution, length in levels]
+        self._open = [None] * len(levels)  # Open bucket start times.
+
+    def _close(self, index):
+        """
+        Reduce the finer entries in the open bucket of a level and append the
+        result to the level's ring.
+        """
+        start = self._open[index]
+        if index:
+            finer = self._levels[index - 1][1]
+            count = finer.count_since(start)
+            if not count:
+                return
+            minimum = reduce_min(finer.column(MIN, count))
+            maximum = reduce_max(finer.column(MAX, count))
+            total = reduce_sum(finer.column(SUM, count))
+            samples = reduce_sum(finer.column(COUNT, count))
+        else:
+            count = self._raw.count_since(start)
+            if not count:
+                return
+            values = self._raw.column(VALUE, count)
+            minimum = reduce_min(values)
+            maximum = reduce_max(values)
+            total = reduce_sum(values)
+            samples = count
+        if numpy is not None:
+            minimum, maximum, total, samples = (
+                float(value) for value in (minimum, maximum, total, samples))
+        self._levels[index][1].append(start, minimum, maximum, total, samples)
+
+    def _expire(self, now):
+        """
+        Close the open buckets that ended before now.
+        """
+        for index, (resolution, ring) in enumerate(self._levels):
+            start = self._open[index]
+            if start is not None and now >= start + resolution:
+                self._close(index)
+                self._open[index] = None
+
+    def _ring(self, resolution):
+        if not resolution:
+            return self._raw
+        for resolution_, ring in self._levels:
+            if resolution_ == resolution:
+                return ring
+        raise ValueError('unsupported history resolution %s' % resolution)
+
+    # Public methods:
+
+    @property
+    def nbytes(self):
+        """
+        Return the fixed memory size of the history buffers (bytes).
+        """
+        return self._raw.nbytes + sum(ring.nbytes
+                                      for resolution, ring in self._levels)
+
+    @property
+    def resolutions(self):
+        return [0] + [resolution for resolution, ring in self._levels]
+
+    def add(self, value, timestamp=None):
+        if timestamp is None:
+            timestamp = time()
+        with self._lock:
+            for index, (resolution, ring) in enumerate(self._levels):
+                start = timestamp - timestamp % resolution
+                if self._open[index] != start:
+                    if self._open[index] is not None:
+                        self._close(index)
+                    self._open[index] = start
+            self._raw.append(timestamp, value)
+
+    def series(self, resolution=0, duration=None, now=None):
+        """
+        Return the history entries for the last duration seconds (all
+        entries if duration is None) at a resolution in resolutions: a list
+        of (time, value) tuples for resolution 0 and (start time, min, max,
+        mean) tuples for the rollup levels.  Raise ValueError for an
+        unsupported resolution.
+        """
+        if now is None:
+            now = time()
+        with self._lock:
+            self._expire(now)
+            ring = self._ring(resolution)
+            count = (ring.size if duration is None
+                     else ring.count_since(now - duration))
+            if not resolution:
+                return list(zip(*(ring.column(index, count).tolist()
+                                  for index in (TIME, VALUE))))
+            columns = [ring.column(index, count).tolist()
+                       for index in (TIME, MIN, MAX, SUM, COUNT)]
+            return [(start, minimum, maximum, total / samples)
+                    for start, minimum, maximum, total, samples
+                    in zip(*columns)]
+
+    def summary(self, resolution, duration, now=None):
+        """
+        Return the (min, max, mean, count) of the values in the closed
+        buckets of a rollup level that started in the last duration seconds,
+        or None if there are none.
+        """
+        if now is None:
+            now = time()
+        with self._lock:
+            self._expire(now)
+            ring = self._ring(resolution)
+            count = ring.count_since(now - duration)
+            if not count:
+                return None
+            samples = reduce_sum(ring.column(COUNT, count))
+            return (float(reduce_min(ring.column(MIN, count))),
+                    float(reduce_max(ring.column(MAX, count))),
+                    float(reduce_sum(ring.column(SUM, count)) / samples),
+                    int(samples))
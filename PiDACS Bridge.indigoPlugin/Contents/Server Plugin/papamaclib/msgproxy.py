@@ -0,0 +1,158 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  msgproxy.py
+   TITLE:  caching fan-out proxy for messagesocket clients (msgproxy)
+FUNCTION:  Re-publishes the messages received on one upstream messagesocket
+           connection to any number of local clients and keeps a last-value
+           cache of DATA messages for new clients.
+   USAGE:  msgproxy is imported and used within main programs.  It is
+           compatible with Python 2.7.16 and all versions of Python 3.x.
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2018-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+A MessageProxy owns a local MessageServer.  The using module calls forward for
+every message it receives from the upstream server, and the proxy publishes
+it to all local clients.  The upstream server sees a single connection no
+matter how many local clients there are.  The last DATA message for each
+channel (keyed by channel name, so alias changes do not duplicate entries) is
+kept in a cache, and a new client receives the cached messages, in channel
+name order, before any live messages.  Messages are re-framed for each local
+client with its own sequence numbers and send datetimes.
+
+The proxy is read-only: requests from local clients are logged and discarded,
+except for channel subscription requests, which are handled by the
+MessageServer (see messagesocket.ChannelFilter).
+
+DEPENDENCIES/LIMITATIONS:
+
+The snapshot is queued like any other message, so a cache with more channels
+than the client queue length is truncated by the lagging client policy.
+SelectorMessageServer is used when the selectors module is available (Python
+3); MessageServer is used otherwise.
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+from threading import Lock
+
+from .colortext import getLogger
+from . import messagesocket
+from .messagesocket import MessageServer, SelectorMessageServer, data_channels
+
+# Global constants:
+
+LOG = getLogger('Plugin')               # Color logger.
+
+
+# msgproxy module functions:
+
+def set_logger(logger):                 # Allow using modules to change the
+    #                                     msgproxy logger.
+    global LOG
+    LOG = logger
+    LOG.threaddebug('msgproxy.set_logger called')
+
+
+class MessageProxy:
+    """
+    Publish forwarded upstream messages to local clients on port_number and
+    send new clients a snapshot of the last DATA message for each channel.
+    """
+
+    # Private methods:
+
+    def __init__(self, port_number, name='proxy', server_class=None,
+                 **kwargs):
+        LOG.threaddebug('MessageProxy.__init__ called "%s"', name)
+        if server_class is None:
+            server_class = (SelectorMessageServer if messagesocket.selectors
+                            else MessageServer)
+        self.name = name
+        self._cache = {}
+        self._lock = Lock()
+        self._server = server_class(port_number,
+                                    process_request=self._request,
+                                    snapshot=self.snapshot, **kwargs)
+
+    def _request(self, reference_name, message):
+        LOG.debug('MessageProxy: "%s" ignored read-only request [%s]',
+                  self.name, message)
+
+    def _update(self, message):
+        channels = data_channels(message)
+        if channels:
+            with self._lock:
+                self._cache[channels[-1]] = message
+
+    def _fan_out(self, message):
+        """
+        Update the cache and fan out a message on the SelectorMessageServer
+        I/O thread.  New clients take their snapshots on the same thread, so
+        a snapshot includes exactly the messages that the client will not
+        receive live.
+        """
+        self._update(message)
+        self._server._fan_out(message)
+
+    # Public methods:
+
+    @property
+    def clients(self):
+        return self._server.clients
+
+    def start(self):
+        LOG.threaddebug('MessageProxy.start called "%s"', self.name)
+        self._server.start()
+
+    def stop(self):
+        LOG.threaddebug('MessageProxy.stop called "%s"', self.name)
+        self._server.stop()
+
+    def forward(self, message):
+        """
+        Update the last-value cache and publish an upstream message to all
+        local clients.  Called on the upstream receive thread.
+        """
+        if isinstance(self._server, SelectorMessageServer):
+            self._server.wake(lambda: self._fan_out(message))
+        else:
+            self._update(message)
+            self._server.publish(message)
+
+    def snapshot(self):
+        with self._lock:
+            return [self._cache[name] for name in sorted(self._cache)]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
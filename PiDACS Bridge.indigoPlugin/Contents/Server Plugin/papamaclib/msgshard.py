@@ -0,0 +1,491 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  msgshard.py
+   TITLE:  messagesocket client in a child process (msgshard)
+FUNCTION:  Runs a messagesocket client connection in its own process and
+           passes compact decoded records to the parent process through a
+           shared-memory ring buffer.
+   USAGE:  msgshard is imported and used within main programs.  It requires
+           Python 3.8 or later (multiprocessing.shared_memory).
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2018-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+A ShardClient starts a child process that connects a MessageSocket to a
+server and does all of the per-frame work there: socket reads, header
+validation (CRC, datetime, and sequence checks in MessageStatus), and DATA
+message parsing.  Each shard has its own interpreter and GIL, so the total
+receive throughput of several servers scales with the number of cores.
+
+The child passes fixed-length records to the parent through a single-producer,
+single-consumer ShardRing in shared memory.  Each record has a kind, a logging
+level, the frame send time (seconds since the epoch), and a payload:
+
+DATA_RECORD     channel id, value, and units separated by NUL characters.
+MESSAGE_RECORD  a complete non-DATA message.
+LOG_RECORD      a log message from the child's messagesocket logger.
+STATUS_RECORD   message and error count deltas (COUNTER_NAMES order).
+CONNECTED       the child's socket name after it connects.
+DISCONNECTED    the reason the connection ended.
+
+Requests are sent from the parent to the child over a multiprocessing pipe and
+are written to the socket by a sender thread in the child.  ShardClient
+provides shutdown and close methods so that it can stand in for the socket of
+a MessageSocket subclass in the parent.
+
+DEPENDENCIES/LIMITATIONS:
+
+The child process is started with the multiprocessing spawn method, so the
+parent's sys.path must make papamaclib importable.  The child runs the
+interpreter returned by interpreter(): sys.executable if it is Python, or the
+python binary in sys.exec_prefix when the parent is an embedding host whose
+sys.executable is not Python.  ShardClient.start raises RuntimeError if there
+is no such interpreter or the child process fails to start.  Session resume
+and frame capture are not available in the child.  DATA messages with fewer
+than two fields (channel id and value) are logged and dropped.  When the
+ring is full, the child waits for the parent, and the server connection is
+flow controlled by TCP.
+Payloads longer than PAYLOAD_LEN bytes are truncated.  available is False
+when shared memory is not supported (Python 2.7 and Python 3 before 3.8).
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+import logging
+import sys
+from os.path import basename, isfile, join
+from struct import Struct
+from threading import Lock, Thread
+from time import mktime, sleep
+try:
+    from multiprocessing import get_context
+    from multiprocessing.shared_memory import SharedMemory
+    from subprocess import check_output, SubprocessError
+except ImportError:  # Python 2.7 or Python 3 before 3.8.
+    SharedMemory = None
+
+from .colortext import getLogger, DATA, THREADDEBUG
+from . import messagesocket
+from .messagesocket import COUNTER_NAMES, MessageSocket, monotonic
+from .messagesocket import SOCKET_TIMEOUT
+
+# Global constants:
+
+LOG = getLogger('Plugin')               # Color logger.
+available = SharedMemory is not None    # True if shards can be started.
+
+PAYLOAD_LEN = 120                       # Record payload length (bytes).
+RECORD = Struct('<IBBd%is' % PAYLOAD_LEN)
+#                                         Slot stamp, kind, level, frame
+#                                         send time, payload.
+COUNT = Struct('<Q')                    # Ring header counts: records
+WRITTEN = 0                             # written and records read (header
+READ = COUNT.size                       # offsets).
+HEADER_LEN = 2 * COUNT.size
+RING_LEN = 4096                         # Default ring capacity (records).
+READ_WAIT = 0.05                        # Maximum wait when the ring is empty
+#                                         (sec).
+STATUS_WAIT = 1.0                       # Interval between status records
+#                                         (sec).
+
+DATA_RECORD = 0                         # Record kinds.
+MESSAGE_RECORD = 1
+LOG_RECORD = 2
+STATUS_RECORD = 3
+CONNECTED = 4
+DISCONNECTED = 5
+
+VERSION = '%i.%i' % sys.version_info[:2]
+_interpreter = None                     # Verified interpreter path ('' if
+#                                         none was found).
+
+
+# msgshard module functions:
+
+def set_logger(logger):                 # Allow using modules to change the
+    #                                     msgshard logger.
+    global LOG
+    LOG = logger
+    LOG.threaddebug('msgshard.set_logger called')
+
+
+def interpreter():
+    """
+    Return the path of a Python interpreter with the parent's version for
+    the child processes, or None if there is none.  Candidates are verified
+    by running them; the result is cached.
+    """
+    global _interpreter
+    if _interpreter is None:
+        _interpreter = ''
+        for path in (sys.executable, getattr(sys, '_base_executable', None),
+                     join(sys.exec_prefix, 'bin', 'python' + VERSION),
+                     join(sys.exec_prefix, 'bin', 'python3')):
+            if not (path and basename(path).lower().startswith('python')
+                    and isfile(path)):
+                continue
+            try:
+                version = check_output(
+                    [path, '-c', 'import sys; print("%i.%i" % '
+                                 'sys.version_info[:2])'],
+                    timeout=SOCKET_TIMEOUT).decode().strip()
+            except (OSError, SubprocessError) as err:
+                LOG.debug('msgshard.interpreter: "%s" failed %s', path, err)
+                continue
+            if version == VERSION:
+                _interpreter = path
+                break
+    return _interpreter or None
+
+
+def shard_main(name, server, port_number, recv_timeout, ring_name,
+               requests, level):
+    """
+    Child process entry point: connect to the server and write records to
+    the ring until the connection ends.
+    """
+    ring = ShardRing(ring_name)
+    logger = logging.getLogger('Plugin')
+    logger.handlers = [RingHandler(ring)]
+    logger.propagate = False
+    logger.setLevel(level)
+    messagesocket.set_logger(ShardLogger(logger))
+    set_logger(ShardLogger(logger))
+    sock = MessageSocket(name, recv_timeout=recv_timeout)
+    sock.connect_to_server(server, port_number)
+    if not sock.connected:
+        ring.put(DISCONNECTED, 0, 0.0, 'connection failed')
+        ring.close()
+        return
+    ring.put(CONNECTED, 0, 0.0, sock.name)
+    sender = Thread(name='msgshard sender', target=_send_requests,
+                    args=(sock, requests))
+    sender.daemon = True
+    sender.start()
+    reason = 'disconnected "%s"' % sock.name
+    counts = dict.fromkeys(COUNTER_NAMES, 0)
+    status_time = monotonic()
+    while True:
+        message = sock.recv()
+        if message is None:
+            break
+        status = sock.status
+        if message:
+            msg_dt = status.last_dt
+            timestamp = mktime(msg_dt.timetuple()) + msg_dt.microsecond / 1e6
+            _put_message(ring, message, timestamp)
+        now = monotonic()
+        if now - status_time >= STATUS_WAIT:
+            status_time = now
+            counts = _put_status(ring, status, counts)
+    _put_status(ring, sock.status, counts)
+    ring.put(DISCONNECTED, 0, 0.0, reason)
+    ring.close()
+
+
+def _put_message(ring, message, timestamp):
+    split = message.split()
+    level = int(split[0])
+    if level != DATA:
+        ring.put(MESSAGE_RECORD, level, timestamp, message)
+    elif len(split) < 3:
+        LOG.error('msgshard: invalid DATA message "%s"', message)
+    else:
+        ring.put(DATA_RECORD, level, timestamp, '\0'.join(split[1:4]))
+
+
+def _put_status(ring, status, previous):
+    counts = status.counters()
+    deltas = [counts[key] - previous[key] for key in COUNTER_NAMES]
+    if any(deltas):
+        ring.put(STATUS_RECORD, 0, 0.0, ' '.join(str(delta)
+                                                 for delta in deltas))
+    return counts
+
+
+def _send_requests(sock, requests):
+    """
+    Send each batch of requests received from the parent until the parent
+    closes the pipe or sends None, then stop the socket.
+    """
+    while True:
+        try:
+            messages = requests.recv()
+        except (EOFError, OSError):
+            messages = None
+        if messages is None:
+            break
+        if sock.connected:
+            sock.send_batch(messages)
+    sock.stop(SOCKET_TIMEOUT)
+
+
+class ShardLogger(logging.LoggerAdapter):
+    """
+    Logger for the child process that provides the threaddebug method used
+    by the papamaclib modules.
+    """
+
+    def __init__(self, logger):
+        logging.LoggerAdapter.__init__(self, logger, {})
+
+    def threaddebug(self, message, *args, **kwargs):
+        self.log(THREADDEBUG, message, *args, **kwargs)
+
+
+class RingHandler(logging.Handler):
+    """
+    Logging handler that passes log messages to the parent as LOG_RECORDs.
+    """
+
+    def __init__(self, ring):
+        logging.Handler.__init__(self)
+        self._ring = ring
+
+    def emit(self, record):
+        try:
+            self._ring.put(LOG_RECORD, record.levelno, record.created,
+                           record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+
+class ShardRing:
+    """
+    Fixed-length records in a shared-memory ring buffer with one producer
+    process and one consumer process.  The header holds the total number of
+    records written and read.  Each slot is stamped with the low 32 bits of
+    its record number, so the consumer never reads a slot that is still
+    being written.  put is thread-safe within the producer process.
+    """
+
+    # Private methods:
+
+    def __init__(self, name=None, capacity=RING_LEN):
+        LOG.threaddebug('ShardRing.__init__ called "%s"', name)
+        if name is None:
+            self._shm = SharedMemory(create=True, size=HEADER_LEN
+                                     + capacity * RECORD.size)
+            COUNT.pack_into(self._shm.buf, WRITTEN, 0)
+            COUNT.pack_into(self._shm.buf, READ, 0)
+        else:
+            self._shm = SharedMemory(name=name)
+        self.capacity = (self._shm.size - HEADER_LEN) // RECORD.size
+        self._lock = Lock()
+        self.closed = False
+
+    def _offset(self, number):
+        return HEADER_LEN + (number % self.capacity) * RECORD.size
+
+    # Public methods:
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def put(self, kind, level, timestamp, payload):
+        """
+        Write a record, waiting while the ring is full.
+        """
+        payload = payload.encode('utf-8')[:PAYLOAD_LEN]
+        with self._lock:
+            if self.closed:
+                return
+            buf = self._shm.buf
+            written, = COUNT.unpack_from(buf, WRITTEN)
+            wait = 0.001
+            while written - COUNT.unpack_from(buf, READ)[0] >= self.capacity:
+                sleep(wait)
+                wait = min(2 * wait, READ_WAIT)
+            RECORD.pack_into(buf, self._offset(written),
+                             written & 0xffffffff, kind, level, timestamp,
+                             payload)
+            COUNT.pack_into(buf, WRITTEN, written + 1)
+
+    def get(self):
+        """
+        Return a list of all available records as (kind, level, timestamp,
+        payload) tuples.
+        """
+        buf = self._shm.buf
+        written, = COUNT.unpack_from(buf, WRITTEN)
+        read, = COUNT.unpack_from(buf, READ)
+        records = []
+        while read < written:
+            stamp, kind, level, timestamp, payload = RECORD.unpack_from(
+                buf, self._offset(read))
+            if stamp != read & 0xffffffff:
+                break  # Slot not yet complete.
+            records.append((kind, level, timestamp, payload.rstrip(
+                b'\0').decode('utf-8', 'replace')))
+            read += 1
+        COUNT.pack_into(buf, READ, read)
+        return records
+
+    def close(self, unlink=False):
+        with self._lock:
+            self.closed = True
+            self._shm.close()
+            if unlink:
+                self._shm.unlink()
+
+
+class ShardClient:
+    """
+    Parent side of a shard: start the child process, read its records, and
+    send it requests.
+    """
+
+    # Private methods:
+
+    def __init__(self, name, server, port_number, recv_timeout=None,
+                 capacity=RING_LEN):
+        LOG.threaddebug('ShardClient.__init__ called "%s"', name)
+        self.name = name
+        self._server = server
+        self._port_number = port_number
+        self._recv_timeout = recv_timeout
+        self._capacity = capacity
+        self._ring = None
+        self._process = None
+        self._requests = None
+        self._requests_lock = Lock()
+        self._close_lock = Lock()
+        self._wait = 0.001
+
+    # Public methods:
+
+    def start(self):
+        """
+        Start the child process and wait for it to connect.  Return the
+        child's socket name, or None if it did not connect.  Raise
+        RuntimeError if the child process cannot be started.
+        """
+        LOG.threaddebug('ShardClient.start called "%s"', self.name)
+        path = interpreter()
+        if path is None:
+            raise RuntimeError('no Python %s interpreter for the shard '
+                               'process' % VERSION)
+        context = get_context('spawn')
+        context.set_executable(path)
+        self._ring = ShardRing(capacity=self._capacity)
+        receiver, self._requests = context.Pipe(duplex=False)
+        self._process = context.Process(
+            name='msgshard %s' % self.name, target=shard_main,
+            args=(self.name, self._server, self._port_number,
+                  self._recv_timeout, self._ring.name, receiver,
+                  LOG.getEffectiveLevel()))
+        self._process.daemon = True
+        self._process.start()
+        receiver.close()
+        end_time = monotonic() + 2 * SOCKET_TIMEOUT
+        started = False
+        while monotonic() < end_time:
+            for record in self._ring.get():
+                started = True
+                kind, level, timestamp, payload = record
+                if kind == CONNECTED:
+                    return payload
+                if kind == DISCONNECTED:
+                    self.close()
+                    return None
+                if kind == LOG_RECORD:
+                    LOG.log(level, payload)
+            if not self._process.is_alive():
+                break
+            sleep(READ_WAIT)
+        exitcode = self._process.exitcode
+        self.close()
+        if not started and exitcode is not None:
+            raise RuntimeError('shard process failed to start (exit code %s)'
+                               % exitcode)
+        return None
+
+    def alive(self):
+        process = self._process
+        return process is not None and process.is_alive()
+
+    def read(self):
+        """
+        Return the available records, waiting with an increasing delay (up
+        to READ_WAIT) if there are none.
+        """
+        records = self._ring.get()
+        if records:
+            self._wait = 0.001
+        else:
+            sleep(self._wait)
+            self._wait = min(2 * self._wait, READ_WAIT)
+        return records
+
+    def send(self, messages):
+        """
+        Pass a list of requests to the child's sender thread.  Return False if
+        the child has closed the pipe.
+        """
+        with self._requests_lock:
+            try:
+                self._requests.send(list(messages))
+            except (OSError, ValueError):
+                return False
+        return True
+
+    def shutdown(self, how=None):
+        """
+        Ask the child to stop its socket.  how is accepted for compatibility
+        with socket.shutdown.
+        """
+        LOG.threaddebug('ShardClient.shutdown called "%s"', self.name)
+        with self._requests_lock:
+            try:
+                self._requests.send(None)
+            except (OSError, ValueError):
+                pass
+
+    def close(self):
+        """
+        Stop the child process (terminating it if it does not end within
+        SOCKET_TIMEOUT) and release the ring.  Only the first of concurrent
+        calls does the work.
+        """
+        LOG.threaddebug('ShardClient.close called "%s"', self.name)
+        with self._close_lock:
+            process, self._process = self._process, None
+        if process is None:
+            return
+        self.shutdown()
+        process.join(SOCKET_TIMEOUT)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+        self._requests.close()
+        self._ring.close(unlink=True)
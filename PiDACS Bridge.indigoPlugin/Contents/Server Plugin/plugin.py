@@ -8,8 +8,8 @@ FUNCTION:  plugin is a PiDACS client that can connect to multiple PiDACS
            device objects.
    USAGE:  plugin.py is included in a standard indigo plugin bundle.
   AUTHOR:  papamac
- VERSION:  1.6.3
-    DATE:  August 1, 2021
+ VERSION:  1.7.20
+    DATE:  October 19, 2026
 
 
 MIT LICENSE:
@@ -53,20 +53,106 @@ CHANGE LOG:
                     with indigo conventions.
 1.6.3     8/1/2021  Correct errors in generating server requests for universal
                     actions (turnOn, turnOff, toggle).
+1.7.0   10/19/2026  Track control requests until confirmed by a DATA message;
+                    record action-to-confirmation latency histograms per device
+                    type and server and log unconfirmed requests.
+1.7.1   10/19/2026  Add an optional Prometheus metrics endpoint for socket,
+                    dispatch, reconnect, state write, and control latency
+                    statistics.
+1.7.2   10/19/2026  Publish link-health states (message rates, header errors,
+                    latency percentiles, last frame age, and reconnect count)
+                    on server devices.
+1.7.3   10/19/2026  Add opt-in receive and dispatch stage timing histograms and
+                    an on-demand cProfile capture of a server thread.
+1.7.4   10/19/2026  Add optional raw frame capture to memory-mapped files and a
+                    capture replay tool (papamaclib/msgcapture.py).
+1.7.5   10/19/2026  Update papamaclib messagesocket: MessageServer clients have
+                    bounded outbound queues with a lagging client policy.
+1.7.6   10/19/2026  Update papamaclib messagesocket: add SelectorMessageServer
+                    and a configurable listen backlog; add the msgbench
+                    MessageServer benchmark.
+1.7.7   10/19/2026  Optionally subscribe to the channels of running devices so
+                    that servers send DATA messages only for device channels;
+                    update papamaclib messagesocket with MessageServer channel
+                    subscriptions.
+1.7.8   10/19/2026  Add an optional local fan-out proxy per server device
+                    (papamaclib/msgproxy.py) that re-publishes server messages
+                    to local clients with a last-value snapshot; update
+                    papamaclib messagesocket with MessageServer snapshots.
+1.7.9   10/19/2026  Add server group devices for redundant PiDACS servers with
+                    heartbeat probes and latency-aware automatic failover.
+1.7.10  10/19/2026  Stop servers cooperatively with batched channel resets,
+                    parallel shutdown with an overall deadline, and per-server
+                    stop times; update papamaclib messagesocket with a bounded
+                    stop and send_batch.
+1.7.11  10/19/2026  Add a Bank Write Outputs action that sends each server's
+                    output requests in a single batch and logs first-to-last
+                    channel confirmation skew.
+1.7.12  10/19/2026  Add resumable server sessions with a replay buffer.
+1.7.13  10/19/2026  Add adaptive throttling of busy analog input channels.
+1.7.14  10/19/2026  Add an optional sharded mode that runs each server
+                    connection in its own process (papamaclib/msgshard.py) and
+                    passes decoded records through a shared-memory ring buffer;
+                    update papamaclib messagesocket with MessageStatus merge.
+1.7.15  10/19/2026  Resolve server addresses through a shared cache with TTL,
+                    negative caching, off-thread lookups with a timeout, and
+                    last-known-good fallback; export resolver metrics; update
+                    papamaclib messagesocket with Resolver.
+1.7.16  10/19/2026  Add a Provision Channel Devices action that creates or
+                    updates channel devices from a .csv or .json specification,
+                    validated against in-memory device indexes and sent to each
+                    server in one batch of requests.
+1.7.17  10/19/2026  Add per-channel DATA traffic accounting with a Log Channel
+                    Traffic menu item and an optional periodic top-N report.
+1.7.18  10/19/2026  Add optional in-memory value history for analog input
+                    devices with 1 sec, 1 min, and 1 hour rollups
+                    (papamaclib/msghistory.py), published as device states and
+                    returned by a hidden Get Value History action.
+1.7.19  10/19/2026  Add interlock rules evaluated on the DATA message path that
+                    switch outputs directly through their servers, with
+                    trigger-to-send latency metrics and a Reload Interlock
+                    Rules menu item.
+1.7.20  10/19/2026  Add the msgfault network fault-injection harness
+                    (papamaclib/msgfault.py) that measures MessageSocket fault
+                    detection, reconnect time, frames lost, and error
+                    classification.
 """
 
 __author__ = u'papamac'
-__version__ = u'1.6.3'
-__date__ = u'August 1, 2021'
-
-from logging import addLevelName, getLogger, NOTSET
+__version__ = u'1.7.20'
+__date__ = u'October 19, 2026'
+
+from array import array
+from cProfile import Profile
+from csv import DictReader
+from datetime import datetime
+from json import load
+from logging import addLevelName, getLogger, DEBUG, ERROR, WARNING, NOTSET
+from operator import eq, ge, gt, le, lt, ne
+from os.path import isfile, join
+from pstats import Stats
 from random import choice
-from socket import gaierror, gethostbyname
-from time import sleep
+from re import compile as re_compile, IGNORECASE
+from socket import gaierror
+from threading import Lock, Thread, Timer
+from time import sleep, time
 
 import indigo
 from papamaclib.colortext import DATA
 from papamaclib.messagesocket import set_logger, MessageSocket, STATUS_INTERVAL
+from papamaclib.messagesocket import Histogram, monotonic, STAGE_NAMES
+from papamaclib.messagesocket import bucket_percentile
+from papamaclib.messagesocket import SUBSCRIBE, UNSUBSCRIBE, ALL_CHANNELS
+from papamaclib.messagesocket import NEW_SESSION, MessageStatus, MSG_LEN
+from papamaclib.messagesocket import COUNTER_NAMES, get_resolver
+from papamaclib import messagesocket, metricserver, msgcapture, msgproxy
+from papamaclib import msghistory, msgshard
+from papamaclib.metricserver import MetricServer, counter, gauge, histogram
+from papamaclib.msgcapture import CaptureWriter
+from papamaclib.msghistory import ChannelHistory
+from papamaclib.msgproxy import MessageProxy
+from papamaclib.msgshard import ShardClient, DATA_RECORD, MESSAGE_RECORD
+from papamaclib.msgshard import LOG_RECORD, STATUS_RECORD, DISCONNECTED
 
 
 # Globals:
@@ -74,7 +160,11 @@ from papamaclib.messagesocket import set_logger, MessageSocket, STATUS_INTERVAL
 PLUGIN = None                             # Plugin instance object.
 LOG = getLogger(u'Plugin')                # Standard logger (no color).
 set_logger(LOG)                           # Override color logger in
-#                                           messagesocket.
+metricserver.set_logger(LOG)              # messagesocket, metricserver,
+msgcapture.set_logger(LOG)                # msgcapture, msghistory,
+msghistory.set_logger(LOG)                # msgproxy, and msgshard.
+msgproxy.set_logger(LOG)
+msgshard.set_logger(LOG)
 
 VALID_PORTS = range(50000, 60000, 1000)   # Enumeration of valid PiDACS ports.
 SERVER_TIMEOUT = STATUS_INTERVAL + 10.0   # Timeout must be longer than the
@@ -84,6 +174,61 @@ PORT_TYPES = (u'ab', u'ga', u'gb', u'gp')
 CONFIG_REQUESTS = (u'change',    u'dutycycle',  u'frequency',  u'gain',
                    u'interval',  u'polarity',   u'pullup',     u'resolution',
                    u'scaling',   u'units')
+CONFIRM_TIMEOUT = 5.0                     # Time limit for a DATA message to
+#                                           confirm a control request (sec).
+HEARTBEAT_INTERVAL = 5.0                  # Default server group heartbeat
+#                                           interval (sec).
+RTT_WEIGHT = 0.3                          # Smoothing weight for the newest
+#                                           probe round trip time.
+ERROR_PENALTY = 100.0                     # Health score penalty for each
+#                                           header error (ms).
+SWITCH_MARGIN = 50.0                      # Score improvement needed to
+#                                           replace a healthy active member
+#                                           (ms).
+STOP_TIMEOUT = 5.0                        # Time limit to stop one server
+#                                           (sec).
+SHUTDOWN_TIMEOUT = 10.0                   # Time limit to stop all servers at
+#                                           plugin shutdown (sec).
+SUBSCRIBE_BATCH = 16                      # Channel names per subscribe
+#                                           request (fits in DATA_LEN).
+THROTTLE_INTERVAL = 10.0                  # Throttle controller measurement
+#                                           interval (sec).
+THROTTLE_STEPS = 4                        # Throttle levels from configured
+#                                           to maximum change and interval.
+THROTTLE_LAG = 500.0                      # Dispatch lag that raises the
+#                                           throttle level (ms).
+THROTTLE_WRITE = 100.0                    # 90th percentile indigo write
+#                                           time that raises the throttle
+#                                           level (ms).
+THROTTLE_RATE = 1.0                       # Minimum DATA message rate for a
+#                                           channel to be throttled (msg/sec).
+CHANNEL_DEFAULTS = {                      # Channel device types and their
+    u'analogInput':   {u'SupportsOnState': False,  # default properties
+                       u'SupportsSensorValue': True,  # (from Devices.xml).
+                       u'resolution': u'12', u'gain': u'1',
+                       u'scaling': u'2.47058824', u'units': u' ',
+                       u'change': u'0', u'interval': u'0',
+                       u'throttleChange': u'', u'throttleInterval': u'',
+                       u'history': False},
+    u'digitalInput':  {u'polarity': u'normal', u'pullup': u'off',
+                       u'change': False, u'interval': u'0'},
+    u'digitalOutput': {u'momentary': False, u'turnOffDelay': u'0',
+                       u'change': False, u'interval': u'0'},
+    u'pwmOutput':     {u'frequency': u'1', u'dutycycle': u'50'}}
+INTERLOCK_RULE = re_compile(              # Interlock rule syntax: if
+    r'^if\s+(\S+)\s*(>=|<=|==|!=|>|<)\s*(\S+)'  # <source> <op> <value>
+    r'(?:\s+for\s+(\d+(?:\.\d*)?)\s*ms)?'      # [for <hold> ms] then
+    r'\s+then\s+(\S+)\s+(on|off)$',           # <target> on|off.
+    IGNORECASE)
+INTERLOCK_OPS = {u'>': gt, u'>=': ge,     # Interlock rule operators.
+                 u'<': lt, u'<=': le,
+                 u'==': eq, u'!=': ne}
+HISTORY_INTERVAL = 60.0                   # Analog history states update
+#                                           interval (sec).
+HISTORY_STATES = (                        # Analog history states:
+    ((u'mean1m',), 1, 60),                # (state keys for min, max, mean),
+    ((u'min1h', u'max1h', u'mean1h'), 60, 3600),  # rollup resolution (sec),
+    ((u'min24h', u'max24h', u'mean24h'), 3600, 86400))  # and window (sec).
 
 
 class PluginServer(MessageSocket):
@@ -91,7 +236,7 @@ class PluginServer(MessageSocket):
     **************************** needs work ***********************************
     """
 
-    # Private method:
+    # Private methods:
 
     def __init__(self, dev, *args, **kwargs):
         LOG.threaddebug(u'PluginServer.__init__ called "%s"', dev.name)
@@ -99,9 +244,25 @@ class PluginServer(MessageSocket):
         self._dev = dev
         self._server = dev.pluginProps[u'serverAddress']
         self._portNumber = int(dev.pluginProps[u'portNumber'])
+        self.dispatchTime = Histogram()  # processMessage duration (ms).
+        self._linkStates = {}            # Last published link-health states.
+        self._profileRequest = None      # (duration, fileName) if requested.
+        self.subscribed = False          # DATA limited to device channels.
+        self.proxy = Plugin._proxies.get(dev.name)  # Local fan-out proxy.
+        self.writeTime = Histogram()     # Indigo state write duration (ms).
+        self.throttle = Plugin._throttles.get(dev.name)  # Adaptive throttling
+        if self.throttle:                                # is kept across
+            self.throttle.attach(self)                   # reconnects.
+        else:
+            self.throttle = Throttle(self, dev.name)
+            Plugin._throttles[dev.name] = self.throttle
 
     # Public methods:
 
+    def profile(self, duration, fileName):
+        LOG.threaddebug(u'PluginServer.profile called "%s"', self._dev.name)
+        self._profileRequest = (duration, fileName)
+
     def run(self):
         LOG.threaddebug(u'PluginServer.run called "%s"', self._dev.name)
         self.running = True
@@ -110,14 +271,18 @@ class PluginServer(MessageSocket):
 
         sleep(2)
         connectionErrors = 0
+        session = None
+        if PLUGIN.pluginPrefs.get(u'resumeSessions'):
+            session = Plugin._sessions.get(self._dev.name, (NEW_SESSION, 0))
         while self.running:
-            self.connect_to_server(self._server, self._portNumber)
+            self.connect_to_server(self._server, self._portNumber, session)
             if self.connected:
                 break
 
             # Not connected; sleep for a while and try again.
 
             connectionErrors += 1
+            Plugin.count(Plugin._connectErrors, self._dev.name)
             if connectionErrors <= 5:
                 sleepTime = 10
                 messageTime = u'10 seconds'
@@ -135,33 +300,116 @@ class PluginServer(MessageSocket):
                 sleep(1)
         else:
             return
+        if not self.running:  # Stopped while connecting.
+            self._shutdown(u'PluginServer.run: stopped while connecting "%s"'
+                           % self._dev.name)
+            return
 
-        # Connected; update indigo server states.
+        # Connected; start frame capture if enabled, clear the channel
+        # subscriptions if DATA messages are limited to device channels, and
+        # update indigo server states.
 
+        Plugin.setCapture(self, PLUGIN.pluginPrefs)
+        self.subscribed = bool(PLUGIN.pluginPrefs.get(u'subscribeChannels'))
+        if self.subscribed and not self.resumed:
+            self.sendRequest(UNSUBSCRIBE, ALL_CHANNELS)
         self._dev.setErrorStateOnServer(None)
         self._dev.updateStateOnServer(key=u'status', value=u'running')
         self._dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)
         LOG.debug(u'started "%s" using socket "%s"', self._dev.name, self.name)
 
-        # Start all PiDACS devices connected to server.
-
-        for dev in indigo.devices.iter(u'self'):
-            if (dev.pluginProps.get(u'serverName') == self._dev.name
-                    and dev.enabled
-                    and u' ' not in dev.name):
-                Plugin.startDevice(dev)
+        # Start all PiDACS devices connected to server directly or through a
+        # server group (and subscribe to their channels).  A resumed session
+        # has replayed the messages missed while disconnected and kept its
+        # channel configuration, so only the device error states are
+        # cleared.  The proxy cache was cleared on disconnect and needs the
+        # full start to refill it.
+
+        if self.resumed and not self.proxy:
+            for dev in Plugin.serverDevices(self._dev.name):
+                if dev.pluginProps[u'serverName'] == self._dev.name:
+                    dev.setErrorStateOnServer(None)
+        else:
+            for dev in Plugin.serverDevices(self._dev.name):
+                Plugin.startDevice(dev, [self])
 
         # Start message processing run loop.
 
         LOG.threaddebug(u'PluginServer.run: starting run loop "%s"',
                         self._dev.name)
         while self.running:
-            message = self.recv()
-            if message and self._process_message:
-                self._process_message(self._reference_name, message)
+            if self._profileRequest:
+                self._runProfile()
+            else:
+                self._receiveMessage()
         LOG.threaddebug(u'PluginServer.run: run loop ended "%s"',
                         self._dev.name)
 
+    def _receiveMessage(self):
+        message = self.recv()
+        if message:
+            if self.proxy:
+                self.proxy.forward(message)
+            if self._process_message:
+                dispatchTime = monotonic()
+                self._process_message(self._reference_name, message)
+                self.dispatchTime.add(1000.0 * (monotonic() - dispatchTime))
+
+    def _runProfile(self):
+        """
+        Run the message processing loop under cProfile for the requested
+        duration.  Write the raw profile data to fileName.prof and a summary
+        sorted by cumulative time to fileName.txt.
+        """
+        duration, fileName = self._profileRequest
+        self._profileRequest = None
+        LOG.info(u'profiling "%s" for %s sec', self._dev.name, duration)
+        profile = Profile()
+        endTime = monotonic() + duration
+        profile.enable()
+        try:
+            while self.running and monotonic() < endTime:
+                self._receiveMessage()
+        finally:
+            profile.disable()
+        try:
+            profile.dump_stats(fileName + u'.prof')
+            with open(fileName + u'.txt', u'w') as summary:
+                stats = Stats(profile, stream=summary)
+                stats.sort_stats(u'cumulative').print_stats(40)
+        except (IOError, OSError) as err:
+            LOG.error(u'PluginServer._runProfile: unable to write "%s" %s',
+                      fileName, err)
+        else:
+            LOG.info(u'profile "%s" written to "%s.prof"', self._dev.name,
+                     fileName)
+
+    def publishLinkStates(self, reconnectCount):
+        """
+        Update the server device link-health states from the MessageStatus
+        aggregates for the period since the last update.  Only the states
+        that have changed are sent, in a single updateStatesOnServer call.
+        """
+        LOG.threaddebug(u'PluginServer.publishLinkStates called "%s"',
+                        self._dev.name)
+        if self.status is None:
+            return
+        aggregates = self.status.aggregates()
+        age = aggregates['last_frame_age']
+        states = {u'msgRateIn': round(aggregates['recv_rate'], 2),
+                  u'msgRateOut': round(aggregates['send_rate'], 2),
+                  u'errorCount': aggregates['errors'],
+                  u'latencyP50': round(aggregates['latency_p50'], 1),
+                  u'latencyP99': round(aggregates['latency_p99'], 1),
+                  u'lastFrameAge': -1 if age is None else int(age),
+                  u'reconnectCount': reconnectCount}
+        changes = [{u'key': key, u'value': value}
+                   for key, value in sorted(states.items())
+                   if self._linkStates.get(key) != value]
+        if changes:
+            self._dev.updateStatesOnServer(changes)
+            self._linkStates = states
+
     def sendRequest(self, *args):
         LOG.threaddebug(u'PluginServer.sendRequest called "%s"',
                         self._dev.name)
@@ -169,15 +417,1004 @@ class PluginServer(MessageSocket):
         self.send(request)
         LOG.debug(u'PluginServer.sendRequest: sent [%s]', request)
 
+    def sendRequests(self, requests):
+        """
+        Send a list of requests (each a tuple of request arguments) in a
+        single socket write.
+        """
+        LOG.threaddebug(u'PluginServer.sendRequests called "%s"',
+                        self._dev.name)
+        requests = [u' '.join((str(arg) for arg in args))
+                    for args in requests]
+        if requests:
+            self.send_batch(requests)
+            LOG.debug(u'PluginServer.sendRequests: sent %i requests',
+                      len(requests))
+
+
+class ShardedServer(PluginServer):
+    """
+    A PluginServer whose socket I/O, frame validation, and DATA parsing run
+    in a child process (see msgshard).  The run loop dispatches the decoded
+    records from the child instead of receiving frames, so the plugin process
+    does no per-frame work.  The ShardClient stands in for the socket.  If
+    the shard process cannot be started, the connection falls back to the
+    in-process PluginServer methods (_shard is None).
+    """
+
+    # Private methods:
+
+    def __init__(self, dev, *args, **kwargs):
+        LOG.threaddebug(u'ShardedServer.__init__ called "%s"', dev.name)
+        PluginServer.__init__(self, dev, *args, **kwargs)
+        self._shard = None
+
+    def _receiveMessage(self):
+        shard = self._shard
+        if shard is None:
+            return PluginServer._receiveMessage(self)
+        records = shard.read()
+        if not records and not shard.alive():
+            self._shutdown(u'ShardedServer: shard process ended "%s"'
+                           % self.name)
+            return
+        for kind, level, timestamp, payload in records:
+            if kind == DATA_RECORD:
+                self._status.merge(latency=1000.0 * (time() - timestamp))
+                fields = payload.split(u'\0')
+                message = u' '.join(fields)
+                if self.proxy:
+                    self.proxy.forward(u'%2i %s' % (DATA, message))
+                dispatchTime = monotonic()
+                LOG.log(DATA, u'received "%s" %s', self._dev.name, message)
+                Plugin.processData(self._dev.name, *fields, message=message)
+                self.dispatchTime.add(1000.0 * (monotonic() - dispatchTime))
+            elif kind == MESSAGE_RECORD:
+                self._status.merge(latency=1000.0 * (time() - timestamp))
+                if self.proxy:
+                    self.proxy.forward(payload)
+                dispatchTime = monotonic()
+                Plugin.processMessage(self._dev.name, payload)
+                self.dispatchTime.add(1000.0 * (monotonic() - dispatchTime))
+            elif kind == LOG_RECORD:
+                LOG.log(level, payload)
+            elif kind == STATUS_RECORD:
+                self._status.merge(counts=dict(zip(
+                    COUNTER_NAMES, (int(count) for count in payload.split()))))
+            elif kind == DISCONNECTED:
+                self._shutdown(u'ShardedServer: %s' % payload)
+                return
+
+    # Public methods:
+
+    def connect_to_server(self, server, port_number, session=None):
+        """
+        Start a shard process that connects to the server.  Sessions are not
+        resumed in sharded mode.
+        """
+        LOG.threaddebug(u'ShardedServer.connect_to_server called "%s"',
+                        self._dev.name)
+        shard = ShardClient(self._dev.name, server, port_number,
+                            self._recv_timeout)
+        try:
+            name = shard.start()
+        except RuntimeError as err:
+            LOG.warning(u'ShardedServer.connect_to_server: %s; "%s" not '
+                        u'sharded', err, self._dev.name)
+            PluginServer.connect_to_server(self, server, port_number, session)
+            return
+        if name:
+            self._shard = self._socket = shard
+            self.name = name
+            self._status = MessageStatus(name)
+            self.connected = True
+
+    def set_capture(self, capture):
+        if self._shard is None:
+            PluginServer.set_capture(self, capture)
+        elif capture:
+            capture.close()
+            LOG.warning(u'ShardedServer.set_capture: frame capture is not '
+                        u'available in sharded mode "%s"', self._dev.name)
+
+    def send(self, message):
+        if self._shard is None:
+            return PluginServer.send(self, message)
+        return MSG_LEN if self._shard.send([message]) else None
+
+    def send_batch(self, messages):
+        if self._shard is None:
+            return PluginServer.send_batch(self, messages)
+        return MSG_LEN * len(messages) if self._shard.send(messages) else None
+
+
+class ControlTracker:
+    """
+    Track the control requests (write, momentary, and pwm) sent to PiDACS
+    servers and match each one to the first DATA message that is subsequently
+    received for the same device.  The action-to-confirmation latency is
+    recorded in a histogram for each device type and server.  Requests that
+    are not confirmed within CONFIRM_TIMEOUT are logged and counted.  For a
+    bank write, the skew between the first and last channel confirmations is
+    logged and recorded in the bankSkew histogram.
+    """
+
+    # Private method:
+
+    def __init__(self):
+        self._lock = Lock()
+        self._pending = {}      # Outstanding requests indexed by device name.
+        self._latency = {}      # Histograms indexed by (typeId, serverName).
+        self._unconfirmed = {}  # Timeout counts indexed by (typeId,
+        #                         serverName).
+        self._banks = []        # Outstanding bank writes: [actionTime,
+        #                         unconfirmed device names, count, first
+        #                         confirmation time].
+        self.bankSkew = Histogram()  # Bank write confirmation skew (ms).
+        self._reportTime = monotonic()
+
+    # Public methods:
+
+    def sent(self, dev, serverName, request, actionTime):
+        LOG.threaddebug(u'ControlTracker.sent called "%s"', dev.name)
+        with self._lock:
+            self._pending.setdefault(dev.name, []).append(
+                (actionTime, serverName, dev.deviceTypeId, request))
+
+    def sentBank(self, devNames, actionTime):
+        LOG.threaddebug(u'ControlTracker.sentBank called')
+        with self._lock:
+            self._banks.append([actionTime, set(devNames), len(devNames),
+                                None])
+
+    def _confirmedBank(self, devName, now):
+        for bank in list(self._banks):
+            actionTime, devNames, count, firstTime = bank
+            if devName not in devNames:
+                continue
+            devNames.discard(devName)
+            if firstTime is None:
+                bank[3] = firstTime = now
+            if not devNames:
+                self._banks.remove(bank)
+                skew = 1000.0 * (now - firstTime)
+                self.bankSkew.add(skew)
+                LOG.info(u'bank write of %i channels confirmed in %.1f ms; '
+                         u'first to last channel skew %.1f ms', count,
+                         1000.0 * (now - actionTime), skew)
+
+    def confirmed(self, devName):
+        """
+        Match a DATA message for devName to its oldest outstanding request.
+        Return the action-to-confirmation latency (ms), or None if there is
+        no outstanding request for the device.
+        """
+        if devName not in self._pending:  # Fast path for most DATA messages.
+            return None
+        with self._lock:
+            pending = self._pending.get(devName)
+            if not pending:
+                return None
+            actionTime, serverName, typeId, request = pending.pop(0)
+            if not pending:
+                del self._pending[devName]
+            key = (typeId, serverName)
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram()
+            now = monotonic()
+            if self._banks:
+                self._confirmedBank(devName, now)
+        latency = 1000.0 * (now - actionTime)
+        histogram.add(latency)
+        LOG.debug(u'confirmed "%s" %s in %.1f ms', devName, request, latency)
+        return latency
+
+    def expire(self):
+        """
+        Discard and log requests that have not been confirmed within
+        CONFIRM_TIMEOUT.
+        """
+        now = monotonic()
+        expired = []
+        with self._lock:
+            for devName in list(self._pending):
+                pending = self._pending[devName]
+                while pending and now - pending[0][0] >= CONFIRM_TIMEOUT:
+                    actionTime, serverName, typeId, request = pending.pop(0)
+                    key = (typeId, serverName)
+                    self._unconfirmed[key] = self._unconfirmed.get(key, 0) + 1
+                    expired.append((devName, request, serverName))
+                if not pending:
+                    del self._pending[devName]
+            banks = [bank for bank in self._banks
+                     if now - bank[0] >= CONFIRM_TIMEOUT]
+            for bank in banks:
+                self._banks.remove(bank)
+        for actionTime, devNames, count, firstTime in banks:
+            LOG.warning(u'ControlTracker.expire: bank write of %i channels; '
+                        u'%i not confirmed within %.0f sec', count,
+                        len(devNames), CONFIRM_TIMEOUT)
+        for devName, request, serverName in expired:
+            LOG.warning(u'ControlTracker.expire: "%s" %s request not '
+                        u'confirmed by "%s" within %.0f sec', devName, request,
+                        serverName, CONFIRM_TIMEOUT)
+
+    def metrics(self):
+        """
+        Return labeled latency histograms and timeout counts for the metrics
+        server.
+        """
+        with self._lock:
+            latency = [({u'server': key[1], u'type': key[0]}, histogram)
+                       for key, histogram in self._latency.items()]
+            unconfirmed = [({u'server': key[1], u'type': key[0]}, count)
+                           for key, count in self._unconfirmed.items()]
+        return latency, unconfirmed
+
+    def report(self):
+        """
+        Log latency percentiles and timeout counts for each device type and
+        server if the status interval has expired.
+        """
+        if monotonic() - self._reportTime < STATUS_INTERVAL:
+            return
+        self._reportTime = monotonic()
+        with self._lock:
+            keys = set(self._latency) | set(self._unconfirmed)
+        for key in sorted(keys):
+            histogram = self._latency.get(key) or Histogram()
+            unconfirmed = self._unconfirmed.get(key, 0)
+            level = ERROR if unconfirmed else DEBUG
+            LOG.log(level, u'control "%s" %s latency[%i %i|%i %i %i %i]',
+                    key[1], key[0], histogram.count, unconfirmed,
+                    histogram.min or 0, histogram.percentile(50),
+                    histogram.percentile(99), histogram.max or 0)
+
+
+class ChannelTraffic:
+    """
+    Per-channel DATA message accounting for finding the channels that load
+    the server links and the indigo server.  Channels are identified by
+    (server name, device name) and assigned a slot in parallel arrays of
+    counters and inter-arrival statistics, so that thousands of channels
+    cost a few tens of bytes each.  For each channel: frames received, state
+    writes issued, frames suppressed (no state write because the device is
+    unknown, disabled, a standby group member, or the value is invalid), the
+    time of the last frame, and the minimum, mean, and variance of the
+    inter-arrival time (Welford's method).  Rates are computed over the
+    period since the previous report.
+    """
+
+    # Private methods:
+
+    def __init__(self):
+        LOG.threaddebug(u'ChannelTraffic.__init__ called')
+        self._lock = Lock()
+        self._slots = {}             # Slot indexes by (serverName, devName).
+        self._frames = array('L')    # Frames received.
+        self._writes = array('L')    # State writes issued.
+        self._marks = array('L')     # Frames received at the last report.
+        self._last = array('d')      # Monotonic time of the last frame.
+        self._minGap = array('d')    # Minimum inter-arrival time (sec).
+        self._meanGap = array('d')   # Mean inter-arrival time (sec).
+        self._m2Gap = array('d')     # Sum of squared deviations (sec**2).
+        self._time = monotonic()     # Time of the last report.
+
+    # Public methods:
+
+    def record(self, serverName, devName, written):
+        now = monotonic()
+        with self._lock:
+            key = (serverName, devName)
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = len(self._frames)
+                for counts in (self._frames, self._writes, self._marks):
+                    counts.append(0)
+                for stats in (self._last, self._meanGap, self._m2Gap):
+                    stats.append(0.0)
+                self._minGap.append(float('inf'))
+            else:
+                gap = now - self._last[slot]
+                gaps = self._frames[slot]  # Number of gaps including this.
+                delta = gap - self._meanGap[slot]
+                self._meanGap[slot] += delta / gaps
+                self._m2Gap[slot] += delta * (gap - self._meanGap[slot])
+                if gap < self._minGap[slot]:
+                    self._minGap[slot] = gap
+            self._frames[slot] += 1
+            if written:
+                self._writes[slot] += 1
+            self._last[slot] = now
+
+    def report(self, top):
+        """
+        Return a list of per-channel statistics dictionaries for the top
+        channels by frame rate since the previous report, highest rate first,
+        and the report period (sec).  Start a new report period.
+        """
+        now = monotonic()
+        with self._lock:
+            period = max(now - self._time, 1e-3)
+            self._time = now
+            rows = []
+            for (serverName, devName), slot in self._slots.items():
+                frames = self._frames[slot]
+                gaps = frames - 1
+                rows.append({
+                    'server': serverName, 'device': devName,
+                    'rate': (frames - self._marks[slot]) / period,
+                    'frames': frames, 'writes': self._writes[slot],
+                    'suppressed': frames - self._writes[slot],
+                    'age': now - self._last[slot],
+                    'min': self._minGap[slot] if gaps else None,
+                    'mean': self._meanGap[slot] if gaps else None,
+                    'stdev': ((self._m2Gap[slot] / gaps) ** 0.5
+                              if gaps > 1 else None)})
+                self._marks[slot] = frames
+        rows.sort(key=lambda row: (-row['rate'], -row['frames']))
+        return rows[:top], period
+
+
+class InterlockRule:
+    """
+    A compiled interlock rule: a predicate on the value of a source channel
+    device, an optional hold time, and an output request for a target
+    device.  The target's server name and request are resolved when the
+    rule is compiled so that firing does not access indigo.
+    """
+
+    # Private methods:
+
+    def __init__(self, number, text):
+        match = INTERLOCK_RULE.match(text)
+        if not match:
+            raise ValueError(u'line %i: invalid rule "%s"' % (number, text))
+        source, op, threshold, hold, target, state = match.groups()
+        self.number = number
+        self.text = text
+        for devName in (source, target):
+            dev = indigo.devices.get(devName)
+            if (dev is None or dev.pluginId != PLUGIN.pluginId
+                    or dev.deviceTypeId not in CHANNEL_DEFAULTS):
+                raise ValueError(u'line %i: "%s" is not a channel device'
+                                 % (number, devName))
+        self.source = source
+        self.sourceServerName = indigo.devices[source].pluginProps.get(
+            u'serverName')
+        self.test = INTERLOCK_OPS[op]
+        try:
+            self.threshold = float({u'on': 1, u'off': 0}.get(
+                threshold.lower(), threshold))
+        except ValueError:
+            raise ValueError(u'line %i: invalid value "%s"'
+                             % (number, threshold))
+        self.hold = float(hold or 0) / 1000.0
+        dev = indigo.devices[target]
+        self.target = dev
+        self.serverName = dev.pluginProps[u'serverName']
+        self.requestId, self.value = Plugin.outputRequest(
+            dev, state.lower() == u'on')
+        if not self.requestId:
+            raise ValueError(u'line %i: "%s" is not an output device'
+                             % (number, target))
+        self.armed = None       # Time the predicate became true (monotonic).
+        self.fired = False      # Fired since the predicate became true.
+        self.timer = None       # Hold timer.
+        self.count = 0          # Times fired.
+
+
+class Interlocks:
+    """
+    Interlock rule engine evaluated on the DATA message path, so that an
+    output is switched within milliseconds of the input condition without a
+    round trip through the indigo trigger engine.
+
+    Rules are read from a text file, one per line (# starts a comment):
+
+        if <source device> <op> <value> [for <hold> ms] then <target> on|off
+
+    where op is one of > >= < <= == != and value is a number or on/off.
+    Rules are compiled into a table of rules by source device name.  A rule
+    fires when its predicate is true for a DATA message (or, with a hold
+    time, has remained true for the hold time) and is re-armed when the
+    predicate becomes false.  Firing sends the output request directly to
+    the target's server and records the trigger-to-send latency.  Rules are
+    fired under the rule lock, but their requests are sent after it is
+    released, so that a slow send does not block other evaluations.  For a
+    source channel bound to a server group, DATA messages from standby
+    members are ignored.
+    """
+
+    # Private methods:
+
+    def __init__(self, rules):
+        LOG.threaddebug(u'Interlocks.__init__ called')
+        self._lock = Lock()
+        self.rules = rules
+        self._table = {}        # Rules by source device name.
+        for rule in rules:
+            self._table.setdefault(rule.source, []).append(rule)
+        self.latency = Histogram()  # Trigger-to-send latency (ms).
+
+    def _expire(self, rule, armTime):
+        with self._lock:
+            if rule.armed != armTime or rule.fired:
+                return
+            self._fire(rule)
+        self._send(rule, armTime + rule.hold)
+
+    @staticmethod
+    def _fire(rule):
+        rule.fired = True
+        rule.armed = None
+        rule.timer = None
+
+    def _send(self, rule, triggerTime):
+        server = Plugin.getServer(rule.serverName)
+        if not (server and server.connected and server.running):
+            LOG.error(u'Interlocks: rule %i "%s" tripped; server "%s" not '
+                      u'running', rule.number, rule.text, rule.serverName)
+            return
+        server.sendRequest(rule.target.name, rule.requestId, rule.value)
+        sendTime = monotonic()
+        latency = 1000.0 * (sendTime - triggerTime)
+        self.latency.add(latency)
+        rule.count += 1
+        Plugin._controls.sent(rule.target, server.reference_name,
+                              rule.requestId, sendTime)
+        LOG.warning(u'interlock rule %i "%s" tripped; sent "%s" %s %s in '
+                    u'%.2f ms', rule.number, rule.text, rule.target.name,
+                    rule.requestId, rule.value, latency)
+
+    # Public methods:
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read and compile an interlock rule file.  Raise IOError, OSError, or
+        ValueError with the line number of an invalid rule.
+        """
+        LOG.threaddebug(u'Interlocks.load called "%s"', path)
+        rules = []
+        with open(path) as f:
+            for number, line in enumerate(f, 1):
+                text = line.split(u'#', 1)[0].strip()
+                if text:
+                    rules.append(InterlockRule(number, u' '.join(
+                        text.split())))
+        return cls(rules)
+
+    def evaluate(self, serverName, devName, value, receiveTime):
+        rules = self._table.get(devName)
+        if not rules:
+            return
+        group = Plugin._groups.get(rules[0].sourceServerName)
+        if group and serverName != group.active:
+            return  # Ignore standby members.
+        try:
+            number = float(value)
+        except ValueError:
+            return
+        fired = []
+        with self._lock:
+            for rule in rules:
+                if rule.test(number, rule.threshold):
+                    if rule.fired or rule.armed is not None:
+                        continue
+                    if rule.hold:
+                        rule.armed = receiveTime
+                        rule.timer = Timer(rule.hold, self._expire,
+                                           (rule, receiveTime))
+                        rule.timer.daemon = True
+                        rule.timer.start()
+                    else:
+                        self._fire(rule)
+                        fired.append(rule)
+                else:
+                    rule.armed = None
+                    rule.fired = False
+                    if rule.timer:
+                        rule.timer.cancel()
+                        rule.timer = None
+        for rule in fired:
+            self._send(rule, receiveTime)
+
+    def close(self):
+        with self._lock:
+            for rule in self.rules:
+                if rule.timer:
+                    rule.timer.cancel()
+                    rule.timer = None
+
+
+class ServerGroup:
+    """
+    A group of redundant PiDACS servers wired to the same I/O.  Channel
+    devices bound to the group are configured on every connected member (so
+    standby members are always ready) and are controlled and updated through
+    the active member only.  DATA messages from standby members are ignored.
+
+    Every heartbeat interval, each connected member is sent a read request
+    for the group's probe channel (the first channel device in the group).
+    The time to the matching DATA message is the probe round trip time.  A
+    probe that is not answered within the heartbeat interval is considered
+    lost and is replaced by a new one.  A member is healthy if it is
+    connected, has no probe outstanding for longer than half the heartbeat
+    interval, and has answered a probe since its last lost one.  The health
+    score of a healthy member (ms; lower is better) is the sum of:
+
+    - its smoothed probe round trip time,
+    - its dispatch lag: the median MessageStatus latency of the messages
+      received during the last heartbeat, above the lowest such median
+      observed for the member (this cancels any clock offset between the
+      hosts, as in Throttle), and
+    - a penalty for message header errors during the last heartbeat.
+
+    The active member is replaced immediately when it becomes unhealthy or
+    disconnects, or when another member scores better by more than
+    SWITCH_MARGIN.
+    """
+
+    # Private methods:
+
+    def __init__(self, dev):
+        LOG.threaddebug(u'ServerGroup.__init__ called "%s"', dev.name)
+        self._dev = dev
+        self.name = dev.name
+        self.members = list(dev.pluginProps.get(u'members', []))
+        self.interval = float(dev.pluginProps.get(u'heartbeatInterval')
+                              or HEARTBEAT_INTERVAL)
+        self.active = None
+        self._lock = Lock()
+        self._heartbeatTime = 0.0
+        self._probeDevName = None
+        self._probes = {}       # Outstanding probe times by member name.
+        self._lost = set()      # Members with a lost probe.
+        self._rtt = {}          # Smoothed probe round trip times (ms).
+        self._windows = {}      # (MessageStatus, latency buckets, header
+        #                         errors) at the last heartbeat by member.
+        self._baseline = {}     # Lowest median latency by member (ms).
+        self._lag = {}          # Dispatch lag for the last heartbeat (ms).
+        self._penalty = {}      # Error penalties for the last heartbeat.
+
+    def _servers(self):
+        servers = {}
+        for serverName in self.members:
+            server = Plugin._servers.get(serverName)
+            if server and server.connected and server.running:
+                servers[serverName] = server
+        return servers
+
+    def _score(self, serverName, server, now):
+        """
+        Return the health score of a connected member, or None if it is
+        unhealthy.
+        """
+        probeTime = self._probes.get(serverName)
+        if serverName in self._lost or (probeTime is not None and now
+                                        - probeTime > self.interval / 2):
+            return None
+        return (self._rtt.get(serverName, 0.0)
+                + self._lag.get(serverName, 0.0)
+                + self._penalty.get(serverName, 0.0))
+
+    def _measure(self, serverName, status):
+        """
+        Update the dispatch lag and error penalty of a member from the
+        messages received since the previous heartbeat.  The windows start
+        over when the member reconnects with a new MessageStatus.
+        """
+        previous, buckets, errors = self._windows.get(serverName,
+                                                      (None, None, 0))
+        if status is not previous:
+            buckets, errors = None, 0
+        buckets, recvd, latency = Throttle._window(status.latency, buckets,
+                                                   50)
+        total = sum(status.counters()[errorType] for errorType
+                    in (u'shorts', u'crc_errs', u'dt_errs', u'seq_errs'))
+        self._windows[serverName] = (status, buckets, total)
+        self._penalty[serverName] = ERROR_PENALTY * (total - errors)
+        if recvd:
+            baseline = self._baseline.get(serverName)
+            if baseline is None or latency < baseline:
+                baseline = self._baseline[serverName] = latency
+            self._lag[serverName] = latency - baseline
+
+    def _heartbeat(self, servers, now):
+        if self._probeDevName is None:
+            for dev in indigo.devices.iter(u'self'):
+                if (dev.pluginProps.get(u'serverName') == self.name
+                        and dev.enabled and u' ' not in dev.name):
+                    self._probeDevName = dev.name
+                    break
+        for serverName, server in servers.items():
+            if server.status:
+                self._measure(serverName, server.status)
+            probeTime = self._probes.get(serverName)
+            if probeTime is not None and now - probeTime >= self.interval:
+                self._lost.add(serverName)  # Replace the lost probe.
+                probeTime = None
+            if self._probeDevName and probeTime is None:
+                self._probes[serverName] = now
+                server.sendRequest(self._probeDevName, u'read')
+
+    def _activate(self, serverName):
+        """
+        Make serverName the active member.  After a failover, request the
+        current value of each input channel and restore each output to its
+        indigo state through the new active member.
+        """
+        previous, self.active = self.active, serverName
+        server = Plugin._servers.get(serverName) if serverName else None
+        if serverName:
+            LOG.log(WARNING if previous else DEBUG,
+                    u'server group "%s" active member changed from "%s" to '
+                    u'"%s"', self.name, previous, serverName)
+        else:
+            LOG.error(u'server group "%s" has no healthy members', self.name)
+        self._dev.updateStatesOnServer([
+            {u'key': u'activeServer', u'value': serverName or u''},
+            {u'key': u'status',
+             u'value': u'active %s' % serverName if serverName
+             else u'no server'}])
+        for dev in indigo.devices.iter(u'self'):
+            if (dev.pluginProps.get(u'serverName') != self.name
+                    or not dev.enabled or u' ' in dev.name):
+                continue
+            if not server:
+                dev.setErrorStateOnServer(u'server')
+                continue
+            if previous:
+                if (dev.deviceTypeId == u'digitalOutput'
+                        and not dev.pluginProps[u'momentary']):
+                    server.sendRequest(dev.name, u'write',
+                                       u'on' if dev.onState else u'off')
+                else:
+                    server.sendRequest(dev.name, u'read')
+            dev.setErrorStateOnServer(None)
+
+    # Public methods:
+
+    def answered(self, serverName, devName):
+        """
+        Record the round trip time if a DATA message for devName answers an
+        outstanding probe of serverName.  Return True if it does.
+        """
+        if devName != self._probeDevName:
+            return False
+        with self._lock:
+            probeTime = self._probes.pop(serverName, None)
+            if probeTime is None:
+                return False
+            self._lost.discard(serverName)
+            rtt = 1000.0 * (monotonic() - probeTime)
+            previous = self._rtt.get(serverName)
+            self._rtt[serverName] = (rtt if previous is None
+                                     else RTT_WEIGHT * rtt
+                                     + (1.0 - RTT_WEIGHT) * previous)
+        return True
+
+    def check(self):
+        """
+        Send heartbeat probes if the interval has expired and select the
+        active member.  Called every second from runConcurrentThread and
+        immediately when a member disconnects.
+        """
+        with self._lock:
+            now = monotonic()
+            servers = self._servers()
+            for serverName in self.members:
+                if serverName not in servers:  # Disconnected.
+                    self._probes.pop(serverName, None)
+                    self._rtt.pop(serverName, None)
+                    self._lost.discard(serverName)
+                    self._lag.pop(serverName, None)
+                    self._penalty.pop(serverName, None)
+            if now - self._heartbeatTime >= self.interval:
+                self._heartbeatTime = now
+                self._heartbeat(servers, now)
+            scores = {}
+            for serverName, server in servers.items():
+                score = self._score(serverName, server, now)
+                if score is not None:
+                    scores[serverName] = score
+            best = (min(scores, key=lambda name: (scores[name],
+                                                  self.members.index(name)))
+                    if scores else None)
+            if self.active in scores and best is not None:
+                if scores[self.active] - scores[best] <= SWITCH_MARGIN:
+                    best = self.active
+            if best != self.active:
+                self._activate(best)
+
+    def reset(self):
+        """
+        Forget the probe channel after group devices are added or removed.
+        """
+        with self._lock:
+            self._probeDevName = None
+            self._probes.clear()
+            self._lost.clear()
+
+
+class Throttle:
+    """
+    Feedback controller that reduces the DATA message rate of a server's
+    high-rate analog input channels when the plugin falls behind, and
+    restores it when the backlog clears.
+
+    Every THROTTLE_INTERVAL, the controller measures the server's dispatch
+    lag (the median message latency above the lowest median observed, which
+    cancels any clock offset between the hosts) and the 90th percentile
+    indigo state write time.  If either exceeds its threshold (THROTTLE_LAG,
+    THROTTLE_WRITE) the throttle level is raised one step; when both are
+    below half of their thresholds it is lowered one step.  At each level,
+    the change and interval of the throttled channels are set part way from
+    their configured values to the per-device maximums (throttleChange and
+    throttleInterval).  A channel is throttled if it has a maximum and its
+    message rate exceeds THROTTLE_RATE when throttling starts.  Configured
+    values of 0 (update disabled) are never changed.  Every adjustment is
+    logged.  A server's Throttle is kept across reconnects, so that the
+    channels of a resumed session (which are not reconfigured by
+    startDevice) are restored when the backlog clears.
+    """
+
+    # Private methods:
+
+    def __init__(self, server, name):
+        LOG.threaddebug(u'Throttle.__init__ called "%s"', name)
+        self._server = server
+        self._name = name
+        self.level = 0
+        self._lock = Lock()
+        self._time = monotonic()
+        self._counts = {}        # DATA messages by device name.
+        self._throttled = {}     # Applied (change, interval) by device name.
+        self._baseline = None    # Lowest median latency (ms).
+        self._latency = None     # Previous latency histogram buckets.
+        self._writes = None      # Previous write time histogram buckets.
+
+    @staticmethod
+    def _window(histogram, previous, pct):
+        """
+        Return the histogram bucket counts, the number of values added since
+        the previous bucket counts, and their pct percentile.
+        """
+        buckets, count, sum_, min_, max_ = histogram.snapshot()
+        if previous is None:
+            previous = [0] * len(buckets)
+        deltas = [bucket - prev for bucket, prev in zip(buckets, previous)]
+        return buckets, sum(deltas), bucket_percentile(
+            histogram.bounds, deltas, pct, min_ or 0, max_ or 0)
+
+    @staticmethod
+    def _bounds(dev):
+        """
+        Return ((change, maxChange), (interval, maxInterval)) for a device,
+        with None for a setting that cannot be throttled.
+        """
+        bounds = []
+        for prop in (u'change', u'interval'):
+            try:
+                value = float(dev.pluginProps.get(prop) or 0)
+                maximum = float(dev.pluginProps.get(
+                    u'throttle' + prop.capitalize()) or 0)
+            except ValueError:
+                value = maximum = 0.0
+            bounds.append((value, maximum) if 0 < value < maximum else None)
+        return bounds
+
+    def _apply(self, dev, lag, writeTime):
+        """
+        Send the change and interval for the current level to the server.
+        Return False if the device cannot be throttled.
+        """
+        bounds = self._bounds(dev)
+        if not any(bounds):
+            return False
+        values = []
+        for bound in bounds:
+            if bound:
+                value, maximum = bound
+                values.append(value + (maximum - value) * self.level
+                              / float(THROTTLE_STEPS))
+            else:
+                values.append(None)
+        values = tuple(values)
+        if self._throttled.get(dev.name) == values:
+            return True
+        channelName = dev.pluginProps[u'channelName']
+        for prop, value in zip((u'change', u'interval'), values):
+            if value is not None:
+                self._server.sendRequest(channelName, prop, u'%g' % value)
+        self._throttled[dev.name] = values
+        LOG.info(u'throttle "%s" level %i/%i (lag %.0f ms, write %.0f ms): '
+                 u'"%s" change %s interval %s', self._name, self.level,
+                 THROTTLE_STEPS, lag, writeTime, dev.name,
+                 u'-' if values[0] is None else u'%g' % values[0],
+                 u'-' if values[1] is None else u'%g' % values[1])
+        return True
+
+    def _setLevel(self, level, candidates, lag, writeTime):
+        """
+        Change the throttle level and apply it to the throttled channels and
+        (when throttling) the candidate high-rate channels.
+        """
+        self.level = level
+        devNames = set(self._throttled)
+        if level:
+            devNames.update(candidates)
+        for devName in devNames:
+            dev = indigo.devices.get(devName)
+            if (dev is None or dev.deviceTypeId != u'analogInput'
+                    or not self._apply(dev, lag, writeTime)):
+                self._throttled.pop(devName, None)
+        if not level:
+            self._throttled.clear()
+            LOG.info(u'throttle "%s" released (lag %.0f ms, write %.0f ms)',
+                     self._name, lag, writeTime)
+
+    # Public methods:
+
+    def attach(self, server):
+        """
+        Measure a new connection to the server.  The level and the throttled
+        channels are kept; the measurement windows start over.
+        """
+        with self._lock:
+            self._server = server
+            self._time = monotonic()
+            self._counts = {}
+            self._latency = None
+            self._writes = None
+
+    def count(self, devName):
+        with self._lock:
+            self._counts[devName] = self._counts.get(devName, 0) + 1
+
+    def reset(self, devName):
+        """
+        Forget a device whose configured values were just sent by
+        startDevice.
+        """
+        with self._lock:
+            self._throttled.pop(devName, None)
+
+    def check(self):
+        """
+        Measure the backlog and adjust the throttle level if the measurement
+        interval has expired.  Called every second from runConcurrentThread.
+        """
+        now = monotonic()
+        if now - self._time < THROTTLE_INTERVAL:
+            return
+        server = self._server
+        with self._lock:
+            period = now - self._time
+            self._time = now
+            counts, self._counts = self._counts, {}
+            if server.status is None:
+                return
+            self._latency, recvd, latency = self._window(
+                server.status.latency, self._latency, 50)
+            self._writes, _, writeTime = self._window(
+                server.writeTime, self._writes, 90)
+            if not recvd:
+                return
+            if self._baseline is None or latency < self._baseline:
+                self._baseline = latency
+            lag = latency - self._baseline
+            level = self.level
+            if lag > THROTTLE_LAG or writeTime > THROTTLE_WRITE:
+                level = min(level + 1, THROTTLE_STEPS)
+            elif lag < THROTTLE_LAG / 2 and writeTime < THROTTLE_WRITE / 2:
+                level = max(level - 1, 0)
+            if level != self.level:
+                self._setLevel(level, [devName for devName, count
+                                       in counts.items()
+                                       if count / period > THROTTLE_RATE],
+                               lag, writeTime)
+
+    def release(self):
+        """
+        Restore the configured values of all throttled channels.  Called when
+        adaptive throttling is disabled.
+        """
+        with self._lock:
+            if self.level:
+                self._setLevel(0, [], 0.0, 0.0)
+
+
+class ChannelIndex:
+    """
+    In-memory indexes of the plugin's devices built with a single scan of
+    indigo.devices, so that one device or hundreds of devices can be
+    validated without rescanning for each check.  Server and server group
+    devices are indexed by name and by server id; channel devices are indexed
+    by name and by (server name, channel name) for every member of a server
+    group, so that a channel assigned through a group conflicts with the
+    same channel on any of its member servers.
+    """
+
+    # Private methods:
+
+    def __init__(self):
+        LOG.threaddebug(u'ChannelIndex.__init__ called')
+        self.servers = {}       # Server and server group devices by name.
+        self.serverIds = {}     # Server and server group device ids by id.
+        self.devices = {}       # Channel devices by name.
+        self._channels = {}     # Channel device names by (server, channel).
+        self._keys = {}         # Channel index keys by device name.
+        for dev in indigo.devices.iter(u'self'):
+            if dev.deviceTypeId in (u'server', u'serverGroup'):
+                self.servers[dev.name] = dev
+                serverId = dev.pluginProps.get(u'serverId')
+                if serverId:
+                    self.serverIds[serverId] = dev.id
+            else:
+                self.devices[dev.name] = dev
+        for dev in self.devices.values():
+            serverName = dev.pluginProps.get(u'serverName')
+            channelName = dev.pluginProps.get(u'channelName')
+            if serverName and channelName:
+                self.add(dev.name, serverName, channelName)
+
+    # Public methods:
+
+    def members(self, serverName):
+        dev = self.servers.get(serverName)
+        if dev and dev.deviceTypeId == u'serverGroup':
+            return set(dev.pluginProps.get(u'members', []))
+        return set([serverName])
+
+    def owner(self, serverName, channelName, devName):
+        """
+        Return the name of another device that uses the channel on the
+        server (or on a member of the server group), or None.
+        """
+        for member in self.members(serverName):
+            owner = self._channels.get((member, channelName))
+            if owner and owner != devName:
+                return owner
+        return None
+
+    def add(self, devName, serverName, channelName):
+        self.remove(devName)
+        keys = [(member, channelName) for member in self.members(serverName)]
+        for key in keys:
+            self._channels.setdefault(key, devName)
+        self._keys[devName] = keys
+
+    def remove(self, devName):
+        for key in self._keys.pop(devName, []):
+            if self._channels.get(key) == devName:
+                del self._channels[key]
+
 
 class Plugin(indigo.PluginBase):
     """
     **************************** needs work ***********************************
     """
 
-    # Class attribute:
+    # Class attributes:
 
     _servers = {}
+    _groups = {}              # Server groups by server group name.
+    _proxies = {}             # Local fan-out proxies by server name.
+    _sessions = {}            # Session resume points by server name.
+    _throttles = {}           # Adaptive throttles by server name.
+    _provisioned = set()      # Provisioned channel devices awaiting
+    #                           deviceStartComm.
+    _controls = ControlTracker()
+    _connectErrors = {}       # Failed connection attempts by server name.
+    _reconnects = {}          # Reconnections after disconnect by server name.
+    _stateWrites = {}         # updateStateOnServer calls by server name.
+    _traffic = ChannelTraffic()
+    _histories = {}           # Analog value histories by device name.
+    _interlocks = None        # Interlock rule engine.
+    _metricServer = None
 
     # Private methods:
 
@@ -187,6 +1424,9 @@ class Plugin(indigo.PluginBase):
                                      pluginVersion, pluginPrefs)
         global PLUGIN
         PLUGIN = self
+        self._linkStatesTime = monotonic()
+        self._trafficTime = monotonic()
+        self._historyTime = monotonic()
 
     def __del__(self):
         LOG.threaddebug(u'Plugin.__del__ called')
@@ -195,37 +1435,243 @@ class Plugin(indigo.PluginBase):
     # Public class methods that are accessible from instances of both the
     # PluginServer class and this Plugin class:
 
+    @staticmethod
+    def count(counts, serverName, increment=1):
+        counts[serverName] = counts.get(serverName, 0) + increment
+
     @classmethod
     def startServer(cls, dev):
         LOG.threaddebug(u'Plugin.startServer called "%s"', dev.name)
-        server = PluginServer(dev, disconnected=cls.disconnected,
-                              process_message=cls.processMessage,
-                              recv_timeout=SERVER_TIMEOUT)
+        serverClass = PluginServer
+        if PLUGIN.pluginPrefs.get(u'shardedServers'):
+            if not msgshard.available:
+                LOG.warning(u'Plugin.startServer: sharded mode requires '
+                            u'Python 3.8 or later; "%s" not sharded',
+                            dev.name)
+            elif not msgshard.interpreter():
+                LOG.warning(u'Plugin.startServer: no Python interpreter for '
+                            u'shard processes; "%s" not sharded', dev.name)
+            else:
+                serverClass = ShardedServer
+        server = serverClass(dev, disconnected=cls.disconnected,
+                             process_message=cls.processMessage,
+                             recv_timeout=SERVER_TIMEOUT)
         cls._servers[dev.name] = server
         server.start()
 
     @classmethod
-    def startDevice(cls, dev):
-        LOG.threaddebug(u'Plugin.startDevice called "%s"', dev.name)
+    def startProxy(cls, dev):
+        """
+        Start a local fan-out proxy for a server device if a proxy port is
+        configured.  The proxy persists across server reconnections.
+        """
+        LOG.threaddebug(u'Plugin.startProxy called "%s"', dev.name)
+        portNumber = dev.pluginProps.get(u'proxyPort')
+        if not portNumber:
+            return
+        try:
+            proxy = MessageProxy(int(portNumber), name=dev.name)
+        except Exception as err:
+            LOG.error(u'Plugin.startProxy: unable to listen on port %s for '
+                      u'"%s" %s', portNumber, dev.name, err)
+        else:
+            proxy.start()
+            cls._proxies[dev.name] = proxy
+
+    @classmethod
+    def stopServer(cls, serverName, server, deadline):
+        """
+        Reset the server's channels with one batch of requests and stop the
+        server by the deadline (monotonic time).  Log the time taken.
+        """
+        LOG.threaddebug(u'Plugin.stopServer called "%s"', serverName)
+        startTime = monotonic()
+        cls._sessions.pop(serverName, None)  # Channels are reset.
+        cls._throttles.pop(serverName, None)
+        devs = cls.serverDevices(serverName)
+        if server.connected and server.running:
+            server.sendRequests([(dev.pluginProps[u'channelName'], u'reset')
+                                 for dev in devs])
+        stopped = server.stop(max(deadline - monotonic(), 0.0))
+        for dev in devs:
+            if dev.pluginProps[u'serverName'] == serverName:
+                dev.setErrorStateOnServer(u'server')
+        dev = indigo.devices.get(serverName)
+        if dev:
+            dev.updateStateOnServer(key=u'status', value=u'stopped')
+            dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
+        if stopped:
+            LOG.debug(u'stopped "%s" in %.3f sec', serverName,
+                      monotonic() - startTime)
+        else:
+            LOG.warning(u'Plugin.stopServer: "%s" not stopped within %.1f '
+                        u'sec', serverName, monotonic() - startTime)
+        return stopped
+
+    @classmethod
+    def stopServers(cls, timeout=SHUTDOWN_TIMEOUT):
+        """
+        Stop all servers in parallel, each on its own thread, with an overall
+        deadline.
+        """
+        LOG.threaddebug(u'Plugin.stopServers called')
+        startTime = monotonic()
+        deadline = startTime + timeout
+        servers = list(cls._servers.items())
+        cls._servers.clear()
+        threads = []
+        for serverName, server in servers:
+            thread = Thread(name=u'stop %s' % serverName,
+                            target=cls.stopServer,
+                            args=(serverName, server, deadline))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join(max(deadline - monotonic(), 0.0))
+        running = [thread.name for thread in threads if thread.is_alive()]
+        if running:
+            LOG.warning(u'Plugin.stopServers: shutdown deadline exceeded; '
+                        u'still running: %s', u', '.join(running))
+        LOG.info(u'stopped %i servers in %.3f sec', len(servers),
+                 monotonic() - startTime)
+
+    @classmethod
+    def stopProxy(cls, serverName):
+        LOG.threaddebug(u'Plugin.stopProxy called "%s"', serverName)
+        proxy = cls._proxies.pop(serverName, None)
+        if proxy:
+            proxy.stop()
+
+    @classmethod
+    def setCapture(cls, server, prefs):
+        """
+        Start or stop capturing the raw frames for a connected server to
+        capture-<server name>.pdcap in the plugin's log folder.
+        """
+        LOG.threaddebug(u'Plugin.setCapture called "%s"', server.name)
+        capture = None
+        if prefs.get(u'captureFrames'):
+            folder = indigo.server.getLogsFolderPath(pluginId=PLUGIN.pluginId)
+            path = join(folder, u'capture-%s.pdcap' % server.reference_name)
+            try:
+                capture = CaptureWriter(path)
+            except (IOError, OSError, ValueError) as err:
+                LOG.error(u'Plugin.setCapture: unable to open "%s" %s', path,
+                          err)
+        server.set_capture(capture)
+
+    @classmethod
+    def setSubscriptions(cls, server, prefs):
+        """
+        Limit the DATA messages sent by a connected server to the channels of
+        its running devices, or restore delivery of all DATA messages,
+        depending on the subscribeChannels preference.
+        """
+        LOG.threaddebug(u'Plugin.setSubscriptions called "%s"',
+                        server.reference_name)
+        subscribed = bool(prefs.get(u'subscribeChannels'))
+        if subscribed == server.subscribed:
+            return
+        server.subscribed = subscribed
+        if subscribed:
+            channelNames = [dev.pluginProps[u'channelName'] for dev
+                            in cls.serverDevices(server.reference_name)]
+            server.sendRequest(UNSUBSCRIBE, ALL_CHANNELS)
+            for index in range(0, len(channelNames), SUBSCRIBE_BATCH):
+                server.sendRequest(SUBSCRIBE, *channelNames[
+                    index:index + SUBSCRIBE_BATCH])
+        else:
+            server.sendRequest(SUBSCRIBE, ALL_CHANNELS)
+
+    @classmethod
+    def serverDevices(cls, serverName):
+        """
+        Return the enabled channel devices served by a server directly or as
+        a member of a running server group.
+        """
+        names = set([serverName])
+        names.update(group.name for group in list(cls._groups.values())
+                     if serverName in group.members)
+        return [dev for dev in indigo.devices.iter(u'self')
+                if (dev.pluginProps.get(u'serverName') in names
+                    and dev.enabled and u' ' not in dev.name)]
+
+    @classmethod
+    def deviceServers(cls, dev):
+        """
+        Return the running servers for a channel device: its server, or all
+        connected members of its server group.
+        """
         serverName = dev.pluginProps[u'serverName']
-        server = cls._servers.get(serverName)
-        if server and server.connected and server.running:
+        group = cls._groups.get(serverName)
+        servers = (cls._servers.get(name)
+                   for name in (group.members if group else [serverName]))
+        return [server for server in servers
+                if server and server.connected and server.running]
+
+    @classmethod
+    def getServer(cls, serverName):
+        """
+        Return the server for a server name, or the active member for a
+        server group name.
+        """
+        group = cls._groups.get(serverName)
+        if group:
+            serverName = group.active
+        return cls._servers.get(serverName)
+
+    @classmethod
+    def startGroup(cls, dev):
+        LOG.threaddebug(u'Plugin.startGroup called "%s"', dev.name)
+        group = ServerGroup(dev)
+        cls._groups[dev.name] = group
+        dev.updateStateOnServer(key=u'status', value=u'no server')
+        for dev_ in indigo.devices.iter(u'self'):  # Members already running.
+            if (dev_.pluginProps.get(u'serverName') == dev.name
+                    and dev_.enabled and u' ' not in dev_.name):
+                cls.startDevice(dev_)
+        group.check()
+
+    @classmethod
+    def startDevice(cls, dev, servers=None, batches=None):
+        """
+        Configure a channel device on its server, on all connected members of
+        its server group, or on the given servers.  The requests for each
+        server are sent in one batch, or are added to batches (a dictionary
+        of request lists by server) if it is given.
+        """
+        LOG.threaddebug(u'Plugin.startDevice called "%s"', dev.name)
+        if servers is None:
+            servers = cls.deviceServers(dev)
+        for server in servers:
             channelName = dev.pluginProps[u'channelName']
-            server.sendRequest(channelName, u'alias', dev.name)
+            server.throttle.reset(dev.name)
+            requests = []
+            if server.subscribed:
+                requests.append((SUBSCRIBE, channelName))
+            requests.append((channelName, u'alias', dev.name))
             if dev.deviceTypeId == u'digitalInput':
-                server.sendRequest(channelName, u'direction', u'input')
+                requests.append((channelName, u'direction', u'input'))
             elif dev.deviceTypeId in (u'digitalOutput', u'pwmOutput'):
-                server.sendRequest(channelName, u'direction', u'output')
+                requests.append((channelName, u'direction', u'output'))
             for prop in dev.pluginProps:
                 if prop in CONFIG_REQUESTS:
                     value = dev.pluginProps[prop]
-                    server.sendRequest(channelName, prop, value)
+                    requests.append((channelName, prop, value))
             if (dev.deviceTypeId == u'digitalOutput'
                     and PLUGIN.pluginPrefs[u'restartClear']):
-                server.sendRequest(channelName, u'write')
+                requests.append((channelName, u'write'))
             else:
-                server.sendRequest(channelName, u'read')
-            dev.setErrorStateOnServer(None)
+                requests.append((channelName, u'read'))
+            if batches is None:
+                server.sendRequests(requests)
+            else:
+                batches.setdefault(server, []).extend(requests)
+        if servers:
+            group = cls._groups.get(dev.pluginProps[u'serverName'])
+            if group is None or group.active:
+                dev.setErrorStateOnServer(None)
             LOG.debug(u'started "%s"', dev.name)
         else:
             LOG.debug(u'not started "%s" no server', dev.name)
@@ -239,56 +1685,341 @@ class Plugin(indigo.PluginBase):
             if dev_.pluginProps.get(u'serverName') == dev.name:
                 dev_.setErrorStateOnServer(u'server')
         LOG.debug(u'stopped "%s"', serverName)
+        server = cls._servers.get(serverName)
+        if server and server.session:
+            cls._sessions[serverName] = server.resume_point
+        proxy = cls._proxies.get(serverName)
+        if proxy:  # Cached values are stale until the server reconnects.
+            proxy.clear()
+        for group in list(cls._groups.values()):  # Immediate failover.
+            if serverName in group.members:
+                group.check()
+        cls.count(cls._reconnects, serverName)
         cls.startServer(dev)
 
     @classmethod
     def processMessage(cls, serverName, message):
         LOG.threaddebug(u'Plugin.processMessage called')
+        stages = messagesocket.STAGES
+        if stages is not None:
+            startTime = monotonic()
         messageSplit = message.split()
         level = int(messageSplit[0])
         LOG.log(level, u'received "%s" %s', serverName, message[3:])
         if level == DATA:
-            channelId = messageSplit[1]
-            devName = channelId.split(u'[')[0]
+            units = messageSplit[3] if len(messageSplit) > 3 else u''
+            if stages is not None:
+                dataTime = monotonic()
+                stages['parse'].add(1000.0 * (dataTime - startTime))
+            cls.processData(serverName, messageSplit[1], messageSplit[2],
+                            units, message[3:])
+            if stages is not None:
+                stages['indigo'].add(1000.0 * (monotonic() - dataTime))
+
+    @classmethod
+    def processData(cls, serverName, channelId, value, units=u'',
+                    message=u''):
+        """
+        Update the indigo device for a parsed DATA message and account for
+        the message in the channel traffic statistics.  message is the
+        message text (without the level) for logging.
+        """
+        LOG.threaddebug(u'Plugin.processData called')
+        devName = channelId.split(u'[')[0]
+        interlocks = cls._interlocks
+        if interlocks is not None:
+            interlocks.evaluate(serverName, devName, value, monotonic())
+        written = cls.updateDevice(serverName, devName, channelId, value,
+                                   units, message)
+        cls._traffic.record(serverName, devName, written)
+
+    @classmethod
+    def updateDevice(cls, serverName, devName, channelId, value, units,
+                     message):
+        """
+        Update the state of the indigo device for a DATA message.  Return
+        True if a state write was issued.
+        """
+        dev = indigo.devices.get(devName)
+        if dev:
+            probe = False
+            if cls._groups:
+                group = cls._groups.get(dev.pluginProps.get(u'serverName'))
+                if group:
+                    probe = group.answered(serverName, devName)
+                    if serverName != group.active:
+                        return False  # Ignore standby members.
+            cls._controls.confirmed(devName)
+            if value == u'!ERROR':
+                dev.setErrorStateOnServer(u'error')
+                return False
+            if not dev.enabled:
+                return False
+            if dev.deviceTypeId == u'analogInput':
+                try:
+                    sensorValue = float(value)
+                except ValueError:
+                    LOG.error(u'Plugin.updateDevice: invalid analog value %s '
+                              u'for channel %s', value, channelId)
+                    return False
+                history = cls._histories.get(devName)
+                if history:
+                    history.add(sensorValue)
+                fmt = u'%.2f %s'
+                if units and units[0] in (u'm', u'µ', u'°'):
+                    fmt = u'%i %s'
+                uiValue = fmt % (sensorValue, units)
+                writeTime = monotonic()
+                dev.updateStateOnServer(u'sensorValue', sensorValue,
+                                        uiValue=uiValue)
+                server = cls._servers.get(serverName)
+                if server:
+                    server.writeTime.add(1000.0 * (monotonic() - writeTime))
+                    server.throttle.count(devName)
+                cls.count(cls._stateWrites, serverName)
+                dev.updateStateImageOnServer(indigo.
+                                             kStateImageSel.EnergyMeterOff)
+                (LOG.debug if probe else LOG.info)(
+                    u'received "%s" update to %s', dev.name, uiValue)
+                return True
+            else:
+                if value not in (u'0', u'1'):
+                    LOG.error(u'Plugin.updateDevice: invalid bit value %s for '
+                              u'channel %s', value, channelId)
+                    return False
+                state = u'on' if value == u'1' else u'off'
+                writeTime = monotonic()
+                dev.updateStateOnServer(u'onOffState', state)
+                server = cls._servers.get(serverName)
+                if server:
+                    server.writeTime.add(1000.0 * (monotonic() - writeTime))
+                cls.count(cls._stateWrites, serverName)
+                (LOG.debug if probe else LOG.info)(
+                    u'received "%s" update to %s', dev.name, state)
+                return True
+        else:
+            if PLUGIN.pluginPrefs[u'logUnexpectedData']:
+                LOG.warning(u'received "%s" unexpected DATA message %s ',
+                            serverName, message)
+            return False
+
+    @classmethod
+    def collectMetrics(cls):
+        """
+        Return snapshots of the socket, dispatch, and control statistics as
+        metric families for the metrics server.  Called on a metric server
+        request thread.
+        """
+        servers = list(cls._servers.items())
+        connected = []
+        recvd = []
+        sent = []
+        errors = []
+        latency = []
+        dispatch = []
+        writes = []
+        throttles = []
+        for serverName, server in servers:
+            labels = {u'server': serverName}
+            connected.append((labels, int(server.connected)))
+            dispatch.append((labels, server.dispatchTime))
+            writes.append((labels, server.writeTime))
+            throttles.append((labels, server.throttle.level))
+            status = server.status
+            if status is None:
+                continue
+            counts = status.counters()
+            recvd.append((labels, counts['recvd']))
+            sent.append((labels, counts['sent']))
+            for errorType in (u'shorts', u'crc_errs', u'dt_errs',
+                              u'seq_errs'):
+                errors.append(({u'server': serverName, u'type': errorType},
+                               counts[errorType]))
+            latency.append((labels, status.latency))
+        proxies = [({u'server': serverName}, len(proxy.clients))
+                   for serverName, proxy in list(cls._proxies.items())]
+        controls, unconfirmed = cls._controls.metrics()
+        resolver = get_resolver()
+        interlocks = cls._interlocks
+        stages = messagesocket.STAGES
+        return [
+            gauge(u'pidacs_server_connected',
+                  u'Server socket connection state (1 = connected).',
+                  connected),
+            counter(u'pidacs_socket_received_total',
+                    u'Valid messages received on the server socket.', recvd),
+            counter(u'pidacs_socket_sent_total',
+                    u'Messages sent on the server socket.', sent),
+            counter(u'pidacs_socket_errors_total',
+                    u'Received message header errors by type.', errors),
+            histogram(u'pidacs_socket_latency_ms',
+                      u'Message latency from server send to receive (ms).',
+                      latency),
+            histogram(u'pidacs_dispatch_ms',
+                      u'processMessage dispatch duration (ms).', dispatch),
+            counter(u'pidacs_reconnects_total',
+                    u'Server reconnections after a disconnect.',
+                    cls._labeled(cls._reconnects)),
+            counter(u'pidacs_connect_errors_total',
+                    u'Failed server connection attempts.',
+                    cls._labeled(cls._connectErrors)),
+            gauge(u'pidacs_proxy_clients',
+                  u'Local clients connected to a server fan-out proxy.',
+                  proxies),
+            counter(u'pidacs_state_writes_total',
+                    u'Indigo device state updates from DATA messages.',
+                    cls._labeled(cls._stateWrites)),
+            histogram(u'pidacs_state_write_ms',
+                      u'Indigo device state update duration (ms).', writes),
+            gauge(u'pidacs_throttle_level',
+                  u'Adaptive throttle level (0 = configured values).',
+                  throttles),
+            counter(u'pidacs_dns_lookups_total',
+                    u'Server address resolutions by result.',
+                    [({u'result': result}, count)
+                     for result, count in sorted(resolver.stats().items())]),
+            histogram(u'pidacs_dns_lookup_ms',
+                      u'Server address lookup duration (ms).',
+                      [({}, resolver.lookup_time)]),
+            counter(u'pidacs_interlock_trips_total',
+                    u'Interlock rule trips by rule line number.',
+                    [({u'rule': str(rule.number)}, rule.count)
+                     for rule in (interlocks.rules if interlocks else [])]),
+            histogram(u'pidacs_interlock_latency_ms',
+                      u'Interlock trigger to request send latency (ms).',
+                      [({}, interlocks.latency)] if interlocks else []),
+            histogram(u'pidacs_bank_skew_ms',
+                      u'Bank write first to last channel confirmation skew '
+                      u'(ms).', [({}, cls._controls.bankSkew)]),
+            histogram(u'pidacs_control_latency_ms',
+                      u'Control action to DATA confirmation latency (ms).',
+                      controls),
+            counter(u'pidacs_control_unconfirmed_total',
+                    u'Control requests not confirmed within the timeout.',
+                    unconfirmed),
+            histogram(u'pidacs_stage_ms',
+                      u'Receive and dispatch stage durations (ms); '
+                      u'instrumentation mode only.',
+                      [({u'stage': stage}, stages[stage])
+                       for stage in STAGE_NAMES] if stages else [])]
+
+    @staticmethod
+    def _labeled(counts):
+        return [({u'server': serverName}, value)
+                for serverName, value in list(counts.items())]
+
+    def publishLinkStates(self):
+        """
+        Publish link-health states for all servers if the link states
+        interval has expired.  An interval of 0 disables publishing.
+        """
+        interval = float(self.pluginPrefs.get(u'linkStatesInterval', 0) or 0)
+        if not interval or monotonic() - self._linkStatesTime < interval:
+            return
+        self._linkStatesTime = monotonic()
+        for serverName, server in list(self._servers.items()):
+            server.publishLinkStates(self._reconnects.get(serverName, 0))
+
+    def publishHistory(self):
+        """
+        Update the history states of analog input devices with history
+        enabled from the rollups of their value histories once per
+        HISTORY_INTERVAL.  Only changed states are sent.
+        """
+        if monotonic() - self._historyTime < HISTORY_INTERVAL:
+            return
+        self._historyTime = monotonic()
+        for devName, history in list(self._histories.items()):
             dev = indigo.devices.get(devName)
-            if dev:
-                value = messageSplit[2]
-                if value == u'!ERROR':
-                    dev.setErrorStateOnServer(u'error')
-                    return
-                if not dev.enabled:
-                    return
-                if dev.deviceTypeId == u'analogInput':
-                    try:
-                        sensorValue = float(value)
-                    except ValueError:
-                        LOG.error(u'Plugin.processMessage: invalid analog '
-                                  u'value %s for channel %s', value, channelId)
-                        return
-                    units = u''
-                    fmt = u'%.2f %s'
-                    if len(messageSplit) > 3:
-                        units = messageSplit[3]
-                        if units[0] in (u'm', u'µ', u'°'):
-                            fmt = u'%i %s'
-                    uiValue = fmt % (sensorValue, units)
-                    dev.updateStateOnServer(u'sensorValue', sensorValue,
-                                            uiValue=uiValue)
-                    dev.updateStateImageOnServer(indigo.
-                                                 kStateImageSel.EnergyMeterOff)
-                    LOG.info(u'received "%s" update to %s', dev.name, uiValue)
-                else:
-                    if value not in (u'0', u'1'):
-                        LOG.error(u'Plugin.processMessage: invalid bit value '
-                                  u'%s for channel %s', value, channelId)
-                        return
-                    state = u'on' if value == u'1' else u'off'
-                    dev.updateStateOnServer(u'onOffState', state)
-                    LOG.info(u'received "%s" update to %s', dev.name, state)
+            if not dev:
+                continue
+            changes = []
+            for keys, resolution, window in HISTORY_STATES:
+                summary = history.summary(resolution, window)
+                if summary is None:
+                    continue
+                minimum, maximum, mean, count = summary
+                values = (mean,) if len(keys) == 1 else (minimum, maximum,
+                                                         mean)
+                for key, value in zip(keys, values):
+                    value = round(value, 2)
+                    if dev.states.get(key) != value:
+                        changes.append({u'key': key, u'value': value})
+            if changes:
+                dev.updateStatesOnServer(changes)
+
+    @classmethod
+    def history(cls, devName, resolution=0, duration=None):
+        """
+        Return the value history of an analog input device at a resolution
+        (0 for raw values or a rollup resolution in sec) for the last
+        duration seconds (all retained values if None).  Raise KeyError if
+        the device has no history and ValueError for an unsupported
+        resolution.
+        """
+        return cls._histories[devName].series(resolution, duration)
+
+    def reportTraffic(self):
+        """
+        Log the channel traffic report if the traffic report interval has
+        expired.  An interval of 0 disables the periodic report.
+        """
+        interval = 60.0 * float(self.pluginPrefs.get(u'trafficInterval', 0)
+                                or 0)
+        if not interval or monotonic() - self._trafficTime < interval:
+            return
+        self.logChannelTraffic()
+
+    @classmethod
+    def loadInterlocks(cls, prefs):
+        """
+        Compile the interlock rule file named in the plugin preferences and
+        replace the running rules.  If the file cannot be compiled, the
+        running rules are kept.
+        """
+        LOG.threaddebug(u'Plugin.loadInterlocks called')
+        interlockFile = prefs.get(u'interlockFile', u'')
+        interlocks = None
+        if interlockFile:
+            try:
+                interlocks = Interlocks.load(interlockFile)
+            except (IOError, OSError, ValueError) as err:
+                LOG.error(u'Plugin.loadInterlocks: "%s" not loaded; %s',
+                          interlockFile, err)
+                return
+            LOG.info(u'loaded %i interlock rules from "%s"',
+                     len(interlocks.rules), interlockFile)
+            for rule in interlocks.rules:
+                LOG.debug(u'interlock rule %i "%s"', rule.number, rule.text)
+        previous, cls._interlocks = cls._interlocks, interlocks
+        if previous:
+            previous.close()
+
+    def reloadInterlocks(self):
+        LOG.threaddebug(u'Plugin.reloadInterlocks called')
+        self.loadInterlocks(self.pluginPrefs)
+
+    def startMetricServer(self, prefs):
+        LOG.threaddebug(u'Plugin.startMetricServer called')
+        self.stopMetricServer()
+        if prefs.get(u'metricsEnabled'):
+            address = prefs.get(u'metricsAddress', u'127.0.0.1')
+            portNumber = int(prefs.get(u'metricsPort', 9464))
+            try:
+                server = MetricServer(portNumber, self.collectMetrics,
+                                      address=address)
+            except Exception as err:
+                LOG.error(u'Plugin.startMetricServer: unable to listen on '
+                          u'%s:%s %s', address, portNumber, err)
             else:
-                if PLUGIN.pluginPrefs[u'logUnexpectedData']:
-                    LOG.warning(u'received "%s" unexpected DATA message %s ',
-                                serverName, message[3:])
+                server.start()
+                Plugin._metricServer = server
+
+    def stopMetricServer(self):
+        LOG.threaddebug(u'Plugin.stopMetricServer called')
+        if self._metricServer:
+            self._metricServer.stop()
+            Plugin._metricServer = None
 
     # Indigo plugin.py standard public instance methods:
 
@@ -299,16 +2030,108 @@ class Plugin(indigo.PluginBase):
         LOG.setLevel(u'THREADDEBUG' if level == u'THREAD' else level)
         LOG.threaddebug(u'Plugin.startup called')
         LOG.debug(self.pluginPrefs)
+        messagesocket.set_instrumentation(
+            self.pluginPrefs.get(u'instrumentation', False))
+        self.startMetricServer(self.pluginPrefs)
+        self.loadInterlocks(self.pluginPrefs)
+
+    def stopConcurrentThread(self):
+        LOG.threaddebug(u'Plugin.stopConcurrentThread called')
+        indigo.PluginBase.stopConcurrentThread(self)
+        self._groups.clear()  # No failover while members are stopping.
+        self.stopServers()
 
     def shutdown(self):
         LOG.threaddebug(u'Plugin.shutdown called')
+        self.stopMetricServer()
+        if self._interlocks:
+            self._interlocks.close()
+
+    @staticmethod
+    def runTask(task):
+        """
+        Run a periodic task from runConcurrentThread.  Log any exception so
+        that one failing task does not stop the others or the thread.
+        """
+        try:
+            task()
+        except Exception as err:  # Catch-all exception; keep running.
+            LOG.exception(u'Plugin.runTask: %s failed %s',
+                          getattr(task, u'__name__', task), err)
+
+    def runConcurrentThread(self):
+        LOG.threaddebug(u'Plugin.runConcurrentThread called')
+        try:
+            while True:
+                self.runTask(self._controls.expire)
+                self.runTask(self._controls.report)
+                for group in list(self._groups.values()):
+                    self.runTask(group.check)
+                if self.pluginPrefs.get(u'adaptiveThrottling'):
+                    for server in list(self._servers.values()):
+                        if server.connected:
+                            self.runTask(server.throttle.check)
+                self.runTask(self.publishLinkStates)
+                self.runTask(self.reportTraffic)
+                self.runTask(self.publishHistory)
+                self.sleep(1)
+        except self.StopThread:
+            pass
 
     def validatePrefsConfigUi(self, valuesDict):
         LOG.threaddebug(u'Plugin.validatePrefsConfigUi called')
+        errors = indigo.Dict()
+        try:
+            interval = float(valuesDict.get(u'linkStatesInterval') or 0)
+        except ValueError:
+            interval = -1
+        if interval < 0:
+            errors[u'linkStatesInterval'] = (u'Update interval must be a '
+                                             u'number >= 0.')
+        try:
+            interval = float(valuesDict.get(u'trafficInterval') or 0)
+        except ValueError:
+            interval = -1
+        if interval < 0:
+            errors[u'trafficInterval'] = (u'Report interval must be a number '
+                                          u'>= 0.')
+        topN = valuesDict.get(u'trafficTopN', u'')
+        if not (topN.isdecimal() and 1 <= int(topN) <= 1000):
+            errors[u'trafficTopN'] = (u'Number of channels must be an integer '
+                                      u'>= 1 and <= 1000.')
+        interlockFile = valuesDict.get(u'interlockFile', u'').strip()
+        if interlockFile:
+            try:
+                Interlocks.load(interlockFile)
+            except (IOError, OSError, ValueError) as err:
+                errors[u'interlockFile'] = u'%s' % err
+        valuesDict[u'interlockFile'] = interlockFile
+        if valuesDict.get(u'metricsEnabled'):
+            portNumber = valuesDict.get(u'metricsPort', u'')
+            if not (portNumber.isdecimal()
+                    and 1024 <= int(portNumber) <= 65535):
+                errors[u'metricsPort'] = (u'Port number must be an integer '
+                                          u'>= 1024 and <= 65535.')
+        if errors:
+            return False, valuesDict, errors
         level = valuesDict[u'loggingLevel']
         LOG.setLevel(u'THREADDEBUG' if level == u'THREAD' else level)
         return True, valuesDict
 
+    def closedPrefsConfigUi(self, valuesDict, userCancelled):
+        LOG.threaddebug(u'Plugin.closedPrefsConfigUi called')
+        if not userCancelled:
+            messagesocket.set_instrumentation(
+                valuesDict.get(u'instrumentation', False))
+            self.startMetricServer(valuesDict)
+            self.loadInterlocks(valuesDict)
+            for server in list(self._servers.values()):
+                if server.connected:
+                    self.setCapture(server, valuesDict)
+                    self.setSubscriptions(server, valuesDict)
+                    if not valuesDict.get(u'adaptiveThrottling'):
+                        server.throttle.release()
+
     def validateDeviceConfigUi(self, valuesDict, typeId, devId):
         dev = indigo.devices[devId]
         LOG.threaddebug(u'Plugin.validateDeviceConfigUi called "%s"; '
@@ -320,9 +2143,9 @@ class Plugin(indigo.PluginBase):
             serverAddress = valuesDict[u'serverAddress']
             if serverAddress:
                 try:
-                    ipv4 = gethostbyname(serverAddress)
+                    ipv4 = get_resolver().resolve(serverAddress)
                 except gaierror as err:
-                    errno, strerr = err
+                    errno, strerr = err.args[:2]
                     errors[u'serverAddress'] = (u'Server address error %s %s'
                                                 % (errno, strerr))
                 else:
@@ -340,6 +2163,21 @@ class Plugin(indigo.PluginBase):
             else:
                 errors[u'serverAddress'] = u'Enter valid server address.'
 
+            index = ChannelIndex()
+            proxyPort = valuesDict.get(u'proxyPort', u'')
+            if proxyPort:
+                if not (proxyPort.isdecimal()
+                        and 1024 <= int(proxyPort) <= 65535):
+                    errors[u'proxyPort'] = (u'Proxy port must be blank or an '
+                                            u'integer >= 1024 and <= 65535.')
+                else:
+                    for dev_ in index.servers.values():
+                        if (dev_.id != devId and dev_.pluginProps.get(
+                                u'proxyPort') == proxyPort):
+                            errors[u'proxyPort'] = (u'Proxy port already in '
+                                                    u'use; choose again.')
+                            break
+
             serverId = valuesDict[u'serverId']
             if not serverId:
                 split1 = serverAddress.split(u'.', 1)
@@ -348,81 +2186,124 @@ class Plugin(indigo.PluginBase):
                     serverId = split2[1]
                 else:
                     serverId = chr(choice(range(97, 123)))
-            for dev_ in indigo.devices.iter(u'self.server'):
-                if (dev_.id != devId
-                        and dev_.pluginProps[u'serverId'] == serverId):
-                    errors[u'serverId'] = (u'Server id already in use; '
-                                           u'choose again')
-                    break
+            if index.serverIds.get(serverId, devId) != devId:
+                errors[u'serverId'] = (u'Server id already in use; choose '
+                                       u'again')
+            values[u'serverId'] = serverId
+            values[u'address'] = serverId
+
+        elif typeId == u'serverGroup':
+            if len(valuesDict.get(u'members', [])) < 2:
+                errors[u'members'] = u'Select two or more servers.'
+            try:
+                interval = float(valuesDict[u'heartbeatInterval'])
+            except ValueError:
+                interval = 0
+            if not 1 <= interval <= 60:
+                errors[u'heartbeatInterval'] = (u'Heartbeat interval must be '
+                                                u'a number >= 1 and <= 60 '
+                                                u'sec.')
+            serverId = valuesDict[u'serverId']
+            if not serverId:
+                serverId = chr(choice(range(97, 123)))
+            if ChannelIndex().serverIds.get(serverId, devId) != devId:
+                errors[u'serverId'] = (u'Server id already in use; choose '
+                                       u'again')
             values[u'serverId'] = serverId
             values[u'address'] = serverId
 
         else:
             serverName = valuesDict.get(u'serverName')
             if serverName:
-                dev_ = indigo.devices[serverName]
-                serverId = dev_.pluginProps[u'serverId']
                 channelName = valuesDict[u'channelName']
-                if (len(channelName) == 4
-                        and channelName[:2] in PORT_TYPES
-                        and channelName[2:].isdecimal()):
-                    for dev_ in indigo.devices.iter(u'self'):
-                        if (dev_.id != devId
-                                and (dev_.pluginProps.get(u'serverName')
-                                     == serverName)
-                                and (dev_.pluginProps.get(u'channelName')
-                                     == channelName)):
-                            errors[u'channelName'] = (u'Channel name already '
-                                                      u'in use; choose again.')
-                            break
+                if self.validChannelName(channelName):
+                    index = ChannelIndex()
+                    serverId = index.servers[serverName].pluginProps[
+                        u'serverId']
+                    if index.owner(serverName, channelName, dev.name):
+                        errors[u'channelName'] = (u'Channel name already in '
+                                                  u'use; choose again.')
                     values[u'address'] = u'%s.%s' % (serverId, channelName)
                 else:
                     errors[u'channelName'] = u'Invalid channel name.'
             else:
                 errors[u'serverName'] = u'Select server name.'
-
-            if typeId == u'digitalOutput':
-                delay = valuesDict[u'turnOffDelay']
-                try:
-                    delay = float(delay)
-                except ValueError:
-                    errors[u'turnOffDelay'] = (u'Turn-off delay is not a '
-                                               u'number.')
-                else:
-                    if not 0 <= delay <= 10:
-                        errors[u'turnOffDelay'] = (u'Turn-off delay must be '
-                                                   u'>= 0 and <= 10 sec')
-
-            elif typeId == u'pwmOutput':
-                frequency = valuesDict[u'frequency']
-                try:
-                    frequency = float(frequency)
-                except ValueError:
-                    errors[u'frequency'] = u'Frequency is not a number.'
-                else:
-                    if not 0 < frequency <= 1000:
-                        errors[u'frequency'] = (u'Frequency must be > 0 and '
-                                                u'<= 100 Hz')
-                dutycycle = valuesDict[u'dutycycle']
-                try:
-                    dutycycle = float(dutycycle)
-                except ValueError:
-                    errors[u'dutycycle'] = u'Duty Cycle is not a number.'
-                else:
-                    if not 0 <= dutycycle <= 100:
-                        errors[u'dutycycle'] = (u'Duty Cycle must be >= 0 and '
-                                                u'<= 100 %')
+            self.validateChannelProps(valuesDict, typeId, errors)
 
         if errors:
             return False, valuesDict, errors
         else:
             return True, values
 
+    @staticmethod
+    def validChannelName(channelName):
+        return (len(channelName) == 4 and channelName[:2] in PORT_TYPES
+                and channelName[2:].isdecimal())
+
+    @staticmethod
+    def validateChannelProps(valuesDict, typeId, errors):
+        """
+        Check the type-specific properties of a channel device and add any
+        errors to the errors dictionary by property name.
+        """
+        if typeId == u'digitalOutput':
+            delay = valuesDict[u'turnOffDelay']
+            try:
+                delay = float(delay)
+            except ValueError:
+                errors[u'turnOffDelay'] = (u'Turn-off delay is not a '
+                                           u'number.')
+            else:
+                if not 0 <= delay <= 10:
+                    errors[u'turnOffDelay'] = (u'Turn-off delay must be '
+                                               u'>= 0 and <= 10 sec')
+
+        elif typeId == u'analogInput':
+            for prop in (u'change', u'interval'):
+                maxProp = u'throttle' + prop.capitalize()
+                maximum = valuesDict.get(maxProp, u'')
+                if not maximum:
+                    continue
+                try:
+                    maximum = float(maximum)
+                    value = float(valuesDict[prop] or 0)
+                except ValueError:
+                    errors[maxProp] = (u'Maximum %s is not a number.'
+                                       % prop)
+                else:
+                    if maximum < value:
+                        errors[maxProp] = (u'Maximum %s must be >= the '
+                                           u'update on %s value.'
+                                           % (prop, prop))
+
+        elif typeId == u'pwmOutput':
+            frequency = valuesDict[u'frequency']
+            try:
+                frequency = float(frequency)
+            except ValueError:
+                errors[u'frequency'] = u'Frequency is not a number.'
+            else:
+                if not 0 < frequency <= 1000:
+                    errors[u'frequency'] = (u'Frequency must be > 0 and '
+                                            u'<= 100 Hz')
+            dutycycle = valuesDict[u'dutycycle']
+            try:
+                dutycycle = float(dutycycle)
+            except ValueError:
+                errors[u'dutycycle'] = u'Duty Cycle is not a number.'
+            else:
+                if not 0 <= dutycycle <= 100:
+                    errors[u'dutycycle'] = (u'Duty Cycle must be >= 0 and '
+                                            u'<= 100 %')
+
     def getServers(self, filter="", valuesDict=None, typeId="", targetId=0):
         LOG.threaddebug(u'Plugin.getServers called')
         servers = []
-        for dev in indigo.devices.iter(u'self.server'):
-            servers.append(dev.name)
+        for dev in indigo.devices.iter(u'self'):
+            if (dev.deviceTypeId == u'server'
+                    or (dev.deviceTypeId == u'serverGroup'
+                        and filter == u'groups')):
+                servers.append(dev.name)
         return sorted(servers)
 
     def didDeviceCommPropertyChange(self, dev, newDev):
@@ -446,36 +2327,79 @@ class Plugin(indigo.PluginBase):
             dev.setErrorStateOnServer(u'name')
         else:
             if dev.deviceTypeId == u'server':
+                self.startProxy(dev)
                 self.startServer(dev)
+            elif dev.deviceTypeId == u'serverGroup':
+                self.startGroup(dev)
             else:
-                self.startDevice(dev)
+                if dev.pluginProps.get(u'history'):
+                    self._histories.setdefault(dev.name, ChannelHistory())
+                if not self.provisioned(dev.name, clear=True):
+                    self.startDevice(dev)
+                group = self._groups.get(dev.pluginProps[u'serverName'])
+                if group:
+                    group.reset()
 
     def deviceStopComm(self, dev):
         LOG.threaddebug(u'Plugin.deviceStopComm called "%s"', dev.name)
         if ' ' not in dev.name:  # Stop device only if it was started.
             if dev.deviceTypeId == u'server':
-                server = self._servers.get(dev.name)
-                if server and server.connected and server.running:
-                    for dev_ in indigo.devices.iter(u'self'):
-                        if dev_.pluginProps.get(u'serverName') == dev.name:
-                            server.sendRequest(
-                                dev_.pluginProps[u'channelName'], u'reset')
-                            dev_.setErrorStateOnServer(u'server')
-                    server.stop()
-                    del self._servers[dev.name]
-                    dev.updateStateOnServer(key=u'status', value=u'stopped')
-                    dev.updateStateImageOnServer(indigo.kStateImageSel.
-                                                 SensorOff)
+                server = self._servers.pop(dev.name, None)
+                if server:  # Not already stopped by stopServers.
+                    self.stopServer(dev.name, server,
+                                    monotonic() + STOP_TIMEOUT)
+                self.stopProxy(dev.name)
+                for group in list(self._groups.values()):
+                    if dev.name in group.members:
+                        group.check()
+            elif dev.deviceTypeId == u'serverGroup':
+                self._groups.pop(dev.name, None)
+                for dev_ in indigo.devices.iter(u'self'):
+                    if dev_.pluginProps.get(u'serverName') == dev.name:
+                        dev_.setErrorStateOnServer(u'server')
+                dev.updateStateOnServer(key=u'status', value=u'stopped')
             else:  # Not a server.
-                serverName = dev.pluginProps[u'serverName']
-                server = self._servers.get(serverName)
-                if server and server.connected and server.running:
-                    server.sendRequest(dev.pluginProps[u'channelName'],
-                                       u'reset')
+                self._histories.pop(dev.name, None)
+                channelName = dev.pluginProps[u'channelName']
+                if not self.provisioned(dev.name):
+                    for server in self.deviceServers(dev):
+                        server.sendRequest(channelName, u'reset')
+                        if server.subscribed:
+                            server.sendRequest(UNSUBSCRIBE, channelName)
+                group = self._groups.get(dev.pluginProps[u'serverName'])
+                if group:
+                    group.reset()
             LOG.debug(u'stopped "%s"', dev.name)
 
+    @classmethod
+    def provisioned(cls, devName, clear=False):
+        """
+        Return True if the device was configured on its servers by
+        provisionChannels and its deviceStartComm has not yet run.  Clear the
+        flag if requested; the first deviceStartComm consumes it.
+        """
+        provisioned = devName in cls._provisioned
+        if clear:
+            cls._provisioned.discard(devName)
+        return provisioned
+
+    @staticmethod
+    def outputRequest(dev, on):
+        """
+        Return the requestId and value that turn an output device on or off,
+        or (None, None) if the device is not an output.
+        """
+        if dev.deviceTypeId == u'digitalOutput':
+            if on and dev.pluginProps[u'momentary']:
+                return u'momentary', dev.pluginProps[u'turnOffDelay']
+            return u'write', u'on' if on else u'off'
+        if dev.deviceTypeId == u'pwmOutput':
+            return u'pwm', u'on' if on else u'off'
+        return None, None
+
     def actionControlDevice(self, action, dev):
         LOG.threaddebug(u'Plugin.actionControlDevice called "%s"', dev.name)
+        actionTime = monotonic()
 
         # Check for valid action/device combinations and define the requestId
         # and value needed to perform the action on the server.  Invalid
@@ -511,8 +2435,10 @@ class Plugin(indigo.PluginBase):
             # Send the request if the server is OK.
 
             serverName = dev.pluginProps[u'serverName']
-            server = self._servers.get(serverName)
+            server = self.getServer(serverName)
             if server and server.connected and server.running:
+                self._controls.sent(dev, server.reference_name, requestId,
+                                    actionTime)
                 server.sendRequest(dev.name, requestId, value)
                 LOG.info(u'sent "%s" %s', dev.name, action.deviceAction)
             else:
@@ -528,7 +2454,7 @@ class Plugin(indigo.PluginBase):
         LOG.threaddebug(u'Plugin.actionControlUniversal called "%s"', dev.name)
         if action.deviceAction == indigo.kUniversalAction.RequestStatus:
             serverName = dev.pluginProps[u'serverName']
-            server = self._servers.get(serverName)
+            server = self.getServer(serverName)
             if server and server.connected and server.running:
                 server.sendRequest(dev.name, u'read')
                 LOG.info(u'sent "%s" status request', dev.name)
@@ -536,3 +2462,344 @@ class Plugin(indigo.PluginBase):
                 LOG.error(u'Plugin.actionControlUniversal: server "%s" not '
                           u'running; "%s" status request ignored', serverName,
                           dev.name)
+
+    # Action callback methods:
+
+    def getOutputDevices(self, filter="", valuesDict=None, typeId="",
+                         targetId=0):
+        LOG.threaddebug(u'Plugin.getOutputDevices called')
+        return sorted(((str(dev.id), dev.name)
+                       for dev in indigo.devices.iter(u'self')
+                       if dev.deviceTypeId in (u'digitalOutput',
+                                               u'pwmOutput')),
+                      key=lambda item: item[1])
+
+    def validateActionConfigUi(self, valuesDict, typeId, devId):
+        LOG.threaddebug(u'Plugin.validateActionConfigUi called')
+        errors = indigo.Dict()
+        if typeId == u'bankWrite':
+            onDevices = set(valuesDict.get(u'onDevices', []))
+            offDevices = set(valuesDict.get(u'offDevices', []))
+            if not (onDevices or offDevices):
+                errors[u'onDevices'] = u'Select one or more devices.'
+            elif onDevices & offDevices:
+                errors[u'offDevices'] = (u'A device cannot be turned both on '
+                                         u'and off.')
+        elif typeId == u'provisionChannels':
+            specFile = valuesDict.get(u'specFile', u'').strip()
+            if not specFile.lower().endswith((u'.csv', u'.json')):
+                errors[u'specFile'] = (u'Specification file must be a .csv or '
+                                       u'.json file.')
+            elif not isfile(specFile):
+                errors[u'specFile'] = u'Specification file not found.'
+            valuesDict[u'specFile'] = specFile
+        if errors:
+            return False, valuesDict, errors
+        return True, valuesDict
+
+    def bankWrite(self, pluginAction):
+        """
+        Turn a bank of output devices on and off with one batch of requests
+        per server, so that the server receives all of its requests in a
+        single socket write.
+        """
+        LOG.threaddebug(u'Plugin.bankWrite called')
+        actionTime = monotonic()
+        batches = {}
+        for key, on in ((u'onDevices', True), (u'offDevices', False)):
+            for devId in pluginAction.props.get(key, []):
+                dev = indigo.devices.get(int(devId))
+                if not (dev and dev.enabled):
+                    LOG.warning(u'Plugin.bankWrite: device %s not found or '
+                                u'not enabled; ignored', devId)
+                    continue
+                requestId, value = self.outputRequest(dev, on)
+                serverName = dev.pluginProps[u'serverName']
+                server = self.getServer(serverName)
+                if (requestId and server and server.connected
+                        and server.running):
+                    batches.setdefault(server, []).append(
+                        (dev, requestId, value))
+                else:
+                    LOG.error(u'Plugin.bankWrite: server "%s" not running; '
+                              u'"%s" request ignored', serverName, dev.name)
+        devNames = [dev.name for requests in batches.values()
+                    for dev, requestId, value in requests]
+        if not devNames:
+            return
+        self._controls.sentBank(devNames, actionTime)
+        for server, requests in batches.items():
+            for dev, requestId, value in requests:
+                self._controls.sent(dev, server.reference_name, requestId,
+                                    actionTime)
+            server.sendRequests([(dev.name, requestId, value)
+                                 for dev, requestId, value in requests])
+        LOG.info(u'sent bank write of %i channels to %i servers in %.1f ms',
+                 len(devNames), len(batches),
+                 1000.0 * (monotonic() - actionTime))
+
+    def getHistory(self, pluginAction):
+        """
+        Return the value history of an analog input device to another plugin
+        or script through executeAction.  The action props are resolution
+        (0, 1, 60, or 3600 sec; default 0) and duration (sec; default all
+        retained values).  The result is a dictionary of columns: times and
+        values for resolution 0 or times, min, max, and mean for the rollup
+        resolutions.  None is returned if the device has no history.
+        """
+        LOG.threaddebug(u'Plugin.getHistory called')
+        dev = indigo.devices.get(pluginAction.deviceId)
+        props = pluginAction.props
+        try:
+            resolution = int(props.get(u'resolution', 0) or 0)
+            duration = props.get(u'duration')
+            duration = float(duration) if duration else None
+            series = self.history(dev.name if dev else None, resolution,
+                                  duration)
+        except KeyError:
+            LOG.error(u'Plugin.getHistory: device %s has no value history',
+                      pluginAction.deviceId)
+            return None
+        except ValueError as err:
+            LOG.error(u'Plugin.getHistory: invalid request %s', err)
+            return None
+        keys = ((u'times', u'values') if not resolution
+                else (u'times', u'min', u'max', u'mean'))
+        columns = list(zip(*series)) or [()] * len(keys)
+        return dict((key, list(column)) for key, column in zip(keys, columns))
+
+    @staticmethod
+    def readChannelSpec(specFile):
+        """
+        Read a channel specification file and return a list of dictionaries,
+        one per channel device.  A .csv file has a header row of column names;
+        a .json file has a list of objects.  Each channel has name,
+        deviceType, serverName, and channelName entries and optional device
+        property entries.  String values are stripped; empty and missing
+        (None) values are omitted so that the property defaults apply.
+        """
+        with open(specFile) as f:
+            if specFile.lower().endswith(u'.json'):
+                rows = load(f)
+                if not (isinstance(rows, list)
+                        and all(isinstance(row, dict) for row in rows)):
+                    raise ValueError(u'JSON specification must be a list of '
+                                     u'objects')
+            else:
+                rows = list(DictReader(f))
+        channels = []
+        for row in rows:
+            channel = {}
+            for key, value in row.items():
+                if hasattr(value, u'strip'):  # str or Python 2.7 unicode.
+                    value = value.strip()
+                if key and value is not None and value != u'':
+                    channel[key.strip()] = value
+            channels.append(channel)
+        return channels
+
+    def provisionChannel(self, row, index):
+        """
+        Validate one channel specification against the device index and
+        return the device type, server name, and complete device properties.
+        Raise ValueError with a description of the first problem found.
+        """
+        name = row.get(u'name') or u''
+        typeId = row.get(u'deviceType')
+        serverName = row.get(u'serverName')
+        channelName = row.get(u'channelName') or u''
+        if not name or u' ' in name:
+            raise ValueError(u'missing name or space(s) in name')
+        if typeId not in CHANNEL_DEFAULTS:
+            raise ValueError(u'invalid device type "%s"' % typeId)
+        dev = index.devices.get(name)
+        if (name in index.servers
+                or (dev and dev.deviceTypeId != typeId)):
+            raise ValueError(u'name in use by a different device type')
+        server = index.servers.get(serverName)
+        if server is None:
+            raise ValueError(u'server "%s" not found' % serverName)
+        if not self.validChannelName(channelName):
+            raise ValueError(u'invalid channel name "%s"' % channelName)
+        owner = index.owner(serverName, channelName, name)
+        if owner:
+            raise ValueError(u'channel %s already in use by "%s"'
+                             % (channelName, owner))
+        defaults = CHANNEL_DEFAULTS[typeId]
+        props = dict(dev.pluginProps) if dev else dict(defaults)
+        for key, value in row.items():
+            if key in (u'name', u'deviceType'):
+                continue
+            if key not in defaults and key not in (u'serverName',
+                                                   u'channelName'):
+                raise ValueError(u'unknown property "%s"' % key)
+            if isinstance(defaults.get(key), bool) and not isinstance(
+                    value, bool):
+                if str(value).lower() not in (u'true', u'false'):
+                    raise ValueError(u'property "%s" must be true or false'
+                                     % key)
+                value = str(value).lower() == u'true'
+            elif not isinstance(value, bool):
+                value = u'%s' % value
+            props[key] = value
+        errors = {}
+        self.validateChannelProps(props, typeId, errors)
+        if errors:
+            raise ValueError(u'; '.join(sorted(errors.values())))
+        props[u'address'] = u'%s.%s' % (server.pluginProps[u'serverId'],
+                                        channelName)
+        return typeId, serverName, props
+
+    def provisionChannels(self, pluginAction):
+        """
+        Create or update channel devices from a specification file.  The
+        specification is validated against in-memory indexes of the existing
+        devices built with one device scan, and the new configuration of all
+        channels is sent to each server in a single batch of requests.
+        deviceStartComm and deviceStopComm skip the per-device requests for
+        the provisioned devices.
+        """
+        LOG.threaddebug(u'Plugin.provisionChannels called')
+        startTime = monotonic()
+        specFile = pluginAction.props[u'specFile']
+        folderName = pluginAction.props.get(u'folderName', u'').strip()
+        try:
+            rows = self.readChannelSpec(specFile)
+        except (IOError, OSError, ValueError) as err:
+            LOG.error(u'Plugin.provisionChannels: unable to read "%s" %s',
+                      specFile, err)
+            return
+        folder = 0
+        if folderName:
+            if folderName not in indigo.devices.folders:
+                indigo.devices.folder.create(folderName)
+            folder = indigo.devices.folders[folderName].id
+        index = ChannelIndex()
+        batches = {}
+        names = set()
+        created = updated = rejected = 0
+        for number, row in enumerate(rows, 1):
+            name = row.get(u'name')
+            try:
+                if name in names:
+                    raise ValueError(u'duplicate name')
+                typeId, serverName, props = self.provisionChannel(row, index)
+            except ValueError as err:
+                LOG.error(u'Plugin.provisionChannels: entry %i "%s" rejected; '
+                          u'%s', number, name, err)
+                rejected += 1
+                continue
+            names.add(name)
+            dev = index.devices.get(name)
+            if dev is None or (dev.enabled
+                               and dict(dev.pluginProps) != props):
+                self._provisioned.add(name)  # deviceStartComm will follow.
+            try:
+                if dev:
+                    if dev.enabled:  # Reset the channel on the old servers.
+                        channelName = dev.pluginProps[u'channelName']
+                        for server in self.deviceServers(dev):
+                            requests = batches.setdefault(server, [])
+                            requests.append((channelName, u'reset'))
+                            if server.subscribed:
+                                requests.append((UNSUBSCRIBE, channelName))
+                    dev.replacePluginPropsOnServer(props)
+                    dev.refreshFromServer()
+                    updated += 1
+                else:
+                    dev = indigo.device.create(
+                        protocol=indigo.kProtocol.Plugin,
+                        address=props[u'address'], name=name,
+                        pluginId=self.pluginId, deviceTypeId=typeId,
+                        props=props, folder=folder)
+                    created += 1
+            except Exception as err:
+                LOG.error(u'Plugin.provisionChannels: entry %i "%s" failed; '
+                          u'%s', number, name, err)
+                self._provisioned.discard(name)
+                rejected += 1
+                continue
+            index.devices[name] = dev
+            index.add(name, serverName, props[u'channelName'])
+            if dev.enabled:
+                self.startDevice(dev, batches=batches)
+            else:
+                self._provisioned.discard(name)
+        for server, requests in batches.items():
+            server.sendRequests(requests)
+        LOG.info(u'provisioned %i channels (%i created, %i updated, %i '
+                 u'rejected) with %i requests to %i servers in %.1f ms',
+                 created + updated, created, updated, rejected,
+                 sum(len(requests) for requests in batches.values()),
+                 len(batches), 1000.0 * (monotonic() - startTime))
+
+    # Menu item callback methods:
+
+    def logStageTiming(self):
+        LOG.threaddebug(u'Plugin.logStageTiming called')
+        stages = messagesocket.STAGES
+        if stages is None:
+            LOG.warning(u'Plugin.logStageTiming: instrumentation is not '
+                        u'enabled; enable it in the plugin configuration')
+            return
+        for stage in STAGE_NAMES:
+            histogram_ = stages[stage]
+            LOG.info(u'stage "%s" [%i|%.3f %.3f %.3f %.3f] ms', stage,
+                     histogram_.count, histogram_.min or 0,
+                     histogram_.percentile(50), histogram_.percentile(99),
+                     histogram_.max or 0)
+        for serverName, server in sorted(self._servers.items()):
+            dispatch = server.dispatchTime
+            LOG.info(u'dispatch "%s" [%i|%.3f %.3f %.3f %.3f] ms', serverName,
+                     dispatch.count, dispatch.min or 0,
+                     dispatch.percentile(50), dispatch.percentile(99),
+                     dispatch.max or 0)
+
+    def logChannelTraffic(self):
+        """
+        Log the channels with the highest DATA message rates since the
+        previous report, with their state writes, suppressed frames, and
+        inter-arrival times, to guide the tuning of change and interval.
+        """
+        LOG.threaddebug(u'Plugin.logChannelTraffic called')
+        self._trafficTime = monotonic()
+        top = int(self.pluginPrefs.get(u'trafficTopN', 10) or 10)
+        rows, period = self._traffic.report(top)
+        if not rows:
+            LOG.info(u'channel traffic: no DATA messages received')
+            return
+        LOG.info(u'channel traffic: top %i channels by rate over %.0f sec',
+                 len(rows), period)
+        for row in rows:
+            gaps = u'-'
+            if row['mean'] is not None:
+                gaps = u'%.0f %.0f %s' % (
+                    1000.0 * row['min'], 1000.0 * row['mean'],
+                    u'-' if row['stdev'] is None
+                    else u'%.0f' % (1000.0 * row['stdev']))
+            LOG.info(u'traffic "%s" "%s" %.2f msg/sec [%i|%i %i] gap '
+                     u'[%s] ms age %.0f sec', row['server'], row['device'],
+                     row['rate'], row['frames'], row['writes'],
+                     row['suppressed'], gaps, row['age'])
+
+    def profileServer(self, valuesDict, typeId):
+        LOG.threaddebug(u'Plugin.profileServer called')
+        errors = indigo.Dict()
+        serverName = valuesDict.get(u'serverName')
+        server = self._servers.get(serverName)
+        if not (server and server.connected and server.running):
+            errors[u'serverName'] = u'Select a running server.'
+        try:
+            duration = float(valuesDict.get(u'duration'))
+        except (TypeError, ValueError):
+            duration = 0
+        if not 0 < duration <= 600:
+            errors[u'duration'] = (u'Duration must be a number > 0 and <= 600 '
+                                   u'sec.')
+        if errors:
+            return False, valuesDict, errors
+        folder = indigo.server.getLogsFolderPath(pluginId=self.pluginId)
+        stamp = datetime.now().strftime(u'%Y%m%d-%H%M%S')
+        server.profile(duration, join(folder, u'profile-%s-%s'
+                                      % (serverName, stamp)))
+        return True
@@ -0,0 +1,84 @@
+"""
+Test configuration for the PiDACS Bridge plugin and papamaclib.  The Indigo
+server is not available outside of Indigo, so a minimal indigo module is
+installed before the plugin is imported.
+"""
+
+import logging
+import sys
+import types
+from os.path import dirname, join
+
+import pytest
+
+SERVER_PLUGIN = join(dirname(dirname(__file__)), 'PiDACS Bridge.indigoPlugin',
+                     'Contents', 'Server Plugin')
+sys.path.insert(0, SERVER_PLUGIN)
+
+
+class Device(object):
+
+    def __init__(self, name, deviceTypeId, pluginProps=None, devId=None):
+        self.name = name
+        self.deviceTypeId = deviceTypeId
+        self.pluginProps = dict(pluginProps or {})
+        self.id = devId if devId is not None else id(self)
+        self.pluginId = 'com.papamac.pidacsbridge'
+        self.enabled = True
+        self.configured = True
+        self.onState = False
+        self.states = {}
+
+    def updateStateOnServer(self, key, value, **kwargs):
+        self.states[key] = value
+
+    def updateStatesOnServer(self, states):
+        for state in states:
+            self.states[state['key']] = state['value']
+
+    def setErrorStateOnServer(self, error):
+        self.states['error'] = error
+
+
+class Devices(dict):
+    """
+    Devices by name; like indigo.devices, also indexed by device id.
+    """
+
+    def __getitem__(self, key):
+        for dev in self.values():
+            if dev.id == key:
+                return dev
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def iter(self, filter=None):
+        return list(self.values())
+
+
+def _install_indigo():
+    indigo = types.ModuleType('indigo')
+    indigo.PluginBase = type('PluginBase', (object,), {})
+    indigo.Dict = dict
+    indigo.devices = Devices()
+    indigo.Device = Device
+    indigo.kStateImageSel = types.SimpleNamespace(
+        SensorOn=1, SensorOff=0, EnergyMeterOff=2)
+    indigo.kProtocol = types.SimpleNamespace(Plugin=1)
+    sys.modules['indigo'] = indigo
+
+
+_install_indigo()
+if not hasattr(logging.Logger, 'threaddebug'):  # Added by Indigo.
+    logging.Logger.threaddebug = lambda self, *args, **kwargs: None
+
+
+@pytest.fixture(autouse=True)
+def clear_devices():
+    yield
+    sys.modules['indigo'].devices.clear()
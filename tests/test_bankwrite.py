@@ -0,0 +1,76 @@
+import types
+
+import pytest
+
+import indigo
+import plugin
+
+
+class Server(object):
+    connected = running = True
+
+    def __init__(self, name):
+        self.reference_name = name
+        self.batches = []
+
+    def sendRequests(self, requests):
+        self.batches.append(list(requests))
+
+
+def add_output(name, devId, serverName, typeId=u'digitalOutput',
+               momentary=False):
+    indigo.devices[name] = indigo.Device(
+        name, typeId, {u'serverName': serverName, u'momentary': momentary,
+                       u'turnOffDelay': u'0.5'}, devId=devId)
+
+
+@pytest.fixture
+def servers(monkeypatch):
+    servers = {u'pi1': Server(u'pi1'), u'pi2': Server(u'pi2')}
+    monkeypatch.setattr(plugin.Plugin, u'_servers', servers)
+    monkeypatch.setattr(plugin.Plugin, u'_groups', {})
+    monkeypatch.setattr(plugin.Plugin, u'_controls', plugin.ControlTracker())
+    add_output(u'pump', 1, u'pi1')
+    add_output(u'bell', 2, u'pi1', momentary=True)
+    add_output(u'fan', 3, u'pi2', typeId=u'pwmOutput')
+    add_output(u'lamp', 4, u'pi2')
+    return servers
+
+
+def test_bank_write_sends_one_batch_per_server(servers):
+    action = types.SimpleNamespace(props={u'onDevices': [u'1', u'2', u'3'],
+                                          u'offDevices': [u'4']})
+    plugin.Plugin.bankWrite(plugin.Plugin, action)
+    assert servers[u'pi1'].batches == [[(u'pump', u'write', u'on'),
+                                        (u'bell', u'momentary', u'0.5')]]
+    assert servers[u'pi2'].batches == [[(u'fan', u'pwm', u'on'),
+                                        (u'lamp', u'write', u'off')]]
+    assert len(plugin.Plugin._controls._banks) == 1
+    for name in (u'pump', u'bell', u'fan', u'lamp'):
+        assert plugin.Plugin._controls.confirmed(name) is not None
+    assert plugin.Plugin._controls._banks == []
+    assert plugin.Plugin._controls.bankSkew.count == 1
+
+
+def test_bank_write_skips_stopped_servers(servers):
+    servers[u'pi2'].running = False
+    action = types.SimpleNamespace(props={u'onDevices': [u'3', u'1', u'99'],
+                                          u'offDevices': []})
+    plugin.Plugin.bankWrite(plugin.Plugin, action)
+    assert servers[u'pi1'].batches == [[(u'pump', u'write', u'on')]]
+    assert servers[u'pi2'].batches == []
+
+
+@pytest.mark.parametrize(u'values, field', [
+    ({u'onDevices': [], u'offDevices': []}, u'onDevices'),
+    ({u'onDevices': [u'1', u'2'], u'offDevices': [u'2']}, u'offDevices')])
+def test_validate_bank_write(values, field):
+    result = plugin.Plugin.validateActionConfigUi(
+        plugin.Plugin, values, u'bankWrite', 0)
+    assert result[0] is False and field in result[2]
+
+
+def test_validate_bank_write_accepts_disjoint_lists():
+    values = {u'onDevices': [u'1'], u'offDevices': [u'2']}
+    assert plugin.Plugin.validateActionConfigUi(
+        plugin.Plugin, values, u'bankWrite', 0) == (True, values)
@@ -0,0 +1,35 @@
+from papamaclib.messagesocket import ChannelFilter, data_channels
+from papamaclib.colortext import DATA
+
+
+def channels(message):
+    return data_channels('%s %s' % (DATA, message))
+
+
+def test_all_channels_until_first_request():
+    channel_filter = ChannelFilter()
+    assert channel_filter.accepts(channels('ab00 1'))
+    assert not channel_filter.request('read ab00')
+
+
+def test_subscribe_and_unsubscribe():
+    channel_filter = ChannelFilter()
+    assert channel_filter.request('subscribe ab00 pump')
+    assert channel_filter.accepts(channels('ab00 1'))
+    assert channel_filter.accepts(channels('pump[gb01] on'))  # Alias.
+    assert not channel_filter.accepts(channels('ab01 1'))
+    assert channel_filter.accepts(None)  # Not a DATA message.
+    channel_filter.request('subscribe ab01')
+    channel_filter.request('unsubscribe ab00')
+    assert channel_filter.channels == frozenset(['ab01', 'pump'])
+
+
+def test_wildcards():
+    channel_filter = ChannelFilter()
+    channel_filter.request('unsubscribe *')
+    assert not channel_filter.accepts(channels('ab00 1'))
+    assert channel_filter.accepts(None)
+    channel_filter.request('subscribe *')
+    assert channel_filter.channels is None
+    channel_filter.request('unsubscribe ab00')
+    assert channel_filter.channels == frozenset()
@@ -0,0 +1,72 @@
+import types
+
+import pytest
+
+import plugin
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(plugin, u'monotonic', clock)
+    return clock
+
+
+def test_inter_arrival_statistics(clock):
+    traffic = plugin.ChannelTraffic()
+    for gap in (0.0, 1.0, 2.0, 3.0):
+        clock.now += gap
+        traffic.record(u'pi1', u'tank', gap != 2.0)
+    clock.now += 4.0
+    rows, period = traffic.report(10)
+    assert period == 10.0
+    row, = rows
+    assert (row['server'], row['device']) == (u'pi1', u'tank')
+    assert (row['frames'], row['writes'], row['suppressed']) == (4, 3, 1)
+    assert row['rate'] == 0.4 and row['age'] == 4.0
+    assert row['min'] == 1.0 and row['mean'] == 2.0
+    assert row['stdev'] == pytest.approx((2.0 / 3.0) ** 0.5)
+
+
+def test_single_frame_has_no_gap_statistics(clock):
+    traffic = plugin.ChannelTraffic()
+    traffic.record(u'pi1', u'pump', True)
+    clock.now += 1.0
+    row, = traffic.report(10)[0]
+    assert row['frames'] == 1
+    assert row['min'] is row['mean'] is row['stdev'] is None
+
+
+def test_report_ranks_by_rate_since_the_previous_report(clock):
+    traffic = plugin.ChannelTraffic()
+    for _ in range(5):
+        traffic.record(u'pi1', u'busy', True)
+    traffic.record(u'pi2', u'quiet', True)
+    clock.now += 1.0
+    rows, period = traffic.report(1)
+    assert [row['device'] for row in rows] == [u'busy']
+    for _ in range(3):
+        traffic.record(u'pi2', u'quiet', True)
+    clock.now += 1.0
+    rows, period = traffic.report(2)
+    assert [(row['device'], row['rate']) for row in rows] == [(u'quiet', 3.0),
+                                                             (u'busy', 0.0)]
+    assert rows[1]['frames'] == 5
+
+
+def test_unexpected_data_logs_the_message_text(clock, caplog, monkeypatch):
+    monkeypatch.setattr(plugin, u'PLUGIN', types.SimpleNamespace(
+        pluginPrefs={u'logUnexpectedData': True}))
+    monkeypatch.setattr(plugin.Plugin, u'_traffic', plugin.ChannelTraffic())
+    plugin.Plugin.processMessage(u'pi1', u'%2i zz00 1.5 V' % plugin.DATA)
+    assert (u'received "pi1" unexpected DATA message zz00 1.5 V'
+            in caplog.text)
@@ -0,0 +1,65 @@
+import indigo
+import plugin
+
+
+def make_device(name, typeId=u'digitalOutput'):
+    return indigo.Device(name, typeId, {u'serverName': u'pi1'})
+
+
+def test_confirmed_matches_oldest_request():
+    tracker = plugin.ControlTracker()
+    dev = make_device(u'pump')
+    now = plugin.monotonic()
+    tracker.sent(dev, u'pi1', u'write 1', now - 0.2)
+    tracker.sent(dev, u'pi1', u'write 0', now - 0.1)
+    first = tracker.confirmed(u'pump')
+    second = tracker.confirmed(u'pump')
+    assert first >= 200.0 and second >= 100.0 and first > second
+    assert tracker.confirmed(u'pump') is None
+    latency, unconfirmed = tracker.metrics()
+    assert latency[0][0] == {u'server': u'pi1', u'type': u'digitalOutput'}
+    assert latency[0][1].count == 2
+    assert unconfirmed == []
+
+
+def test_unconfirmed_requests_expire():
+    tracker = plugin.ControlTracker()
+    dev = make_device(u'valve')
+    tracker.sent(dev, u'pi1', u'write 1',
+                 plugin.monotonic() - plugin.CONFIRM_TIMEOUT - 1.0)
+    tracker.expire()
+    assert tracker.confirmed(u'valve') is None
+    latency, unconfirmed = tracker.metrics()
+    assert unconfirmed == [({u'server': u'pi1', u'type': u'digitalOutput'},
+                            1)]
+
+
+def test_bank_write_records_skew():
+    tracker = plugin.ControlTracker()
+    now = plugin.monotonic()
+    names = [u'out%i' % index for index in range(3)]
+    for name in names:
+        tracker.sent(make_device(name), u'pi1', u'write 1', now)
+    tracker.sentBank(names, now)
+    for name in names:
+        tracker.confirmed(name)
+    assert tracker.bankSkew.count == 1
+
+
+def test_report_logs_unconfirmed_at_error(caplog):
+    tracker = plugin.ControlTracker()
+    tracker.sent(make_device(u'fan'), u'pi1', u'write 1',
+                 plugin.monotonic() - plugin.CONFIRM_TIMEOUT - 1.0)
+    tracker.expire()
+    tracker._reportTime -= plugin.STATUS_INTERVAL
+    with caplog.at_level(plugin.DEBUG, logger=u'Plugin'):
+        tracker.report()
+    assert [record.levelno for record in caplog.records
+            if u'latency' in record.getMessage()] == [plugin.ERROR]
+
+
+def test_run_task_logs_exceptions(caplog):
+    def failing():
+        raise RuntimeError(u'boom')
+    plugin.Plugin.runTask(failing)
+    assert u'failing failed boom' in caplog.text
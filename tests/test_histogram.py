@@ -0,0 +1,41 @@
+import pytest
+
+from papamaclib.messagesocket import Histogram, bucket_percentile
+
+
+def test_empty_histogram():
+    histogram = Histogram()
+    assert histogram.count == 0 and histogram.min is None
+    assert histogram.percentile(50) == 0.0
+
+
+def test_add_counts_values_by_upper_bound():
+    histogram = Histogram(bounds=(1.0, 10.0))
+    for value in (0.5, 1.0, 5.0, 50.0):
+        histogram.add(value)
+    counts, count, sum_, min_, max_ = histogram.snapshot()
+    assert counts == [2, 1, 1]
+    assert (count, sum_, min_, max_) == (4, 56.5, 0.5, 50.0)
+    histogram.reset()
+    assert histogram.snapshot() == ([0, 0, 0], 0, 0.0, None, None)
+
+
+def test_percentile_is_bounded_by_min_and_max():
+    histogram = Histogram(bounds=(10.0, 20.0))
+    for value in (12.0, 14.0, 16.0, 18.0):
+        histogram.add(value)
+    assert histogram.percentile(0) == 12.0
+    assert histogram.percentile(50) == pytest.approx(15.0)
+    assert histogram.percentile(100) == 18.0
+
+
+def test_bucket_percentile_interpolates_within_bucket():
+    bounds = (1.0, 2.0, 5.0)
+    counts = [0, 10, 10, 0]
+    assert bucket_percentile(bounds, counts, 25, 1.0, 5.0) == 1.5
+    assert bucket_percentile(bounds, counts, 75, 1.0, 5.0) == 3.5
+    assert bucket_percentile(bounds, [0, 0, 0, 0], 50, 0.0, 0.0) == 0.0
+
+
+def test_bucket_percentile_overflow_uses_max():
+    assert bucket_percentile((1.0,), [0, 4], 50, 2.0, 10.0) == 6.0
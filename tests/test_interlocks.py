@@ -0,0 +1,96 @@
+import time
+import types
+
+import pytest
+
+import indigo
+import plugin
+
+
+class Server(object):
+    connected = running = True
+    reference_name = u'pi1'
+
+    def __init__(self, interlocks):
+        self._interlocks = interlocks
+        self.requests = []
+
+    def sendRequest(self, devName, requestId, value):
+        assert not self._interlocks._lock.locked()
+        self.requests.append((devName, requestId, value))
+
+
+@pytest.fixture
+def devices(monkeypatch):
+    monkeypatch.setattr(plugin, u'PLUGIN', types.SimpleNamespace(
+        pluginId=u'com.papamac.pidacsbridge', pluginPrefs={}))
+    monkeypatch.setattr(plugin.Plugin, u'_servers', {})
+    monkeypatch.setattr(plugin.Plugin, u'_groups', {})
+    monkeypatch.setattr(plugin.Plugin, u'_controls', plugin.ControlTracker())
+    indigo.devices[u'tank'] = indigo.Device(
+        u'tank', u'analogInput', {u'serverName': u'pi1',
+                                  u'channelName': u'ab00'})
+    indigo.devices[u'pump'] = indigo.Device(
+        u'pump', u'digitalOutput', {u'serverName': u'pi1',
+                                    u'channelName': u'gb00',
+                                    u'momentary': False,
+                                    u'turnOffDelay': u'0'})
+
+
+def test_rule_parsing(devices):
+    rule = plugin.InterlockRule(3, u'if tank >= 3.5 for 200 ms then pump off')
+    assert rule.source == u'tank' and rule.sourceServerName == u'pi1'
+    assert rule.test(3.5, rule.threshold) and rule.threshold == 3.5
+    assert rule.hold == 0.2
+    assert (rule.serverName, rule.requestId, rule.value) == (u'pi1', u'write',
+                                                             u'off')
+    rule = plugin.InterlockRule(4, u'IF tank == on THEN pump ON')
+    assert rule.threshold == 1.0 and rule.hold == 0.0 and rule.value == u'on'
+
+
+@pytest.mark.parametrize(u'text', [
+    u'if tank > x then pump off',          # Invalid value.
+    u'if tank > 1 then pump toggle',       # Invalid state.
+    u'if tank > 1 then level off',         # Unknown device.
+    u'if tank > 1 then tank off',          # Not an output.
+    u'when tank > 1 then pump off'])
+def test_invalid_rules(devices, text):
+    with pytest.raises(ValueError) as err:
+        plugin.InterlockRule(7, text)
+    assert u'line 7' in str(err.value)
+
+
+def test_rules_fire_once_and_send_outside_the_lock(devices):
+    interlocks = plugin.Interlocks([
+        plugin.InterlockRule(1, u'if tank > 3 then pump off')])
+    server = plugin.Plugin._servers[u'pi1'] = Server(interlocks)
+    for value in (u'3.5', u'3.6', u'2', u'4'):
+        interlocks.evaluate(u'pi1', u'tank', value, plugin.monotonic())
+    assert server.requests == [(u'pump', u'write', u'off')] * 2
+    assert interlocks.latency.count == 2
+
+
+def test_hold_time(devices):
+    interlocks = plugin.Interlocks([
+        plugin.InterlockRule(1, u'if tank > 3 for 50 ms then pump off')])
+    server = plugin.Plugin._servers[u'pi1'] = Server(interlocks)
+    interlocks.evaluate(u'pi1', u'tank', u'3.5', plugin.monotonic())
+    interlocks.evaluate(u'pi1', u'tank', u'2.5', plugin.monotonic())
+    time.sleep(0.1)
+    assert server.requests == []
+    interlocks.evaluate(u'pi1', u'tank', u'3.5', plugin.monotonic())
+    time.sleep(0.2)
+    assert server.requests == [(u'pump', u'write', u'off')]
+    interlocks.close()
+
+
+def test_standby_members_are_ignored(devices):
+    indigo.devices[u'tank'].pluginProps[u'serverName'] = u'group'
+    interlocks = plugin.Interlocks([
+        plugin.InterlockRule(1, u'if tank > 3 then pump off')])
+    server = plugin.Plugin._servers[u'pi1'] = Server(interlocks)
+    plugin.Plugin._groups[u'group'] = types.SimpleNamespace(active=u'pi1')
+    interlocks.evaluate(u'pi2', u'tank', u'3.5', plugin.monotonic())
+    assert server.requests == []
+    interlocks.evaluate(u'pi1', u'tank', u'3.5', plugin.monotonic())
+    assert server.requests == [(u'pump', u'write', u'off')]
@@ -0,0 +1,75 @@
+from socket import socketpair
+from time import sleep
+
+from papamaclib import messagesocket
+from papamaclib.messagesocket import MessageClient, MessageServer, \
+    MessageSocket
+
+
+def _client(lagging):
+    left, right = socketpair()
+    client = MessageClient('server', queue_len=2, lagging=lagging)
+    client.connect_to_client(left, ('test', 0), hostname='client')
+    return client, right
+
+
+def test_lagging_client_drops_the_oldest_message(monkeypatch):
+    monkeypatch.setattr(messagesocket, 'SOCKET_TIMEOUT', 0.1)  # Fast stop.
+    client, peer = _client('drop')
+    for index in range(4):
+        assert client.enqueue('message %i' % index)
+    assert client.dropped == 2
+    received = []
+    reader = MessageSocket('reader', process_message=lambda name, message:
+                           received.append(message))
+    reader.connect_to_client(peer, ('test', 1), hostname='server')
+    reader.start()
+    client.start()
+    for _ in range(100):
+        if len(received) == 2:
+            break
+        sleep(0.01)
+    client.stop()
+    reader.stop()
+    assert received == ['message 2', 'message 3']
+
+
+def test_lagging_client_is_disconnected():
+    client, peer = _client('disconnect')
+    assert client.enqueue('message 0') and client.enqueue('message 1')
+    assert not client.enqueue('message 2')
+    assert not client.connected
+    peer.close()
+
+
+def test_publish_reaches_every_client(monkeypatch):
+    monkeypatch.setattr(messagesocket, 'SOCKET_TIMEOUT', 0.1)  # Fast stop.
+    server = MessageServer(0)
+    server.start()
+    port = server._socket.getsockname()[1]
+    received = {0: [], 1: []}
+    readers = []
+    try:
+        for index in received:
+            reader = MessageSocket(
+                index, process_message=lambda name, message:
+                received[name].append(message))
+            reader.connect_to_server('127.0.0.1', port)
+            reader.start()
+            readers.append(reader)
+        for _ in range(100):
+            if len(server.clients) == 2:
+                break
+            sleep(0.01)
+        for index in range(50):
+            server.publish('DATA pi1 ab0 %i' % index)
+        for _ in range(100):
+            if all(len(messages) == 50 for messages in received.values()):
+                break
+            sleep(0.01)
+    finally:
+        for reader in readers:
+            reader.stop()
+        server.stop()
+    expected = ['DATA pi1 ab0 %i' % index for index in range(50)]
+    assert received == {0: expected, 1: expected}
@@ -0,0 +1,107 @@
+import logging
+from socket import socketpair
+from threading import Thread
+from time import sleep
+
+from papamaclib import messagesocket
+from papamaclib.messagesocket import MessageSocket
+
+
+def _pair(process_message=None, disconnected=None):
+    left, right = socketpair()
+    receiver = MessageSocket('receiver', disconnected=disconnected,
+                             process_message=process_message)
+    receiver.connect_to_client(left, ('test', 0), hostname='receiver')
+    sender = MessageSocket('sender')
+    sender.connect_to_client(right, ('test', 1), hostname='sender')
+    return receiver, sender
+
+
+def test_stop_wakes_a_blocked_recv():
+    disconnected = []
+    receiver, sender = _pair(disconnected=disconnected.append)
+    receiver.start()
+    sleep(0.05)
+    start = messagesocket.monotonic()
+    assert receiver.stop(timeout=2.0) is True
+    assert messagesocket.monotonic() - start < 1.0
+    assert not receiver.is_alive()
+    assert not receiver.connected
+    assert disconnected == []
+    sender.stop()
+
+
+def test_stop_before_start_returns_true():
+    receiver, sender = _pair()
+    assert receiver.stop(timeout=0.1) is True
+    sender.stop()
+
+
+def test_send_batch_delivers_frames_in_sequence():
+    received = []
+    receiver, sender = _pair(
+        process_message=lambda name, message: received.append(message))
+    receiver.start()
+    try:
+        assert sender.send_batch(['one', 'two', 'three'])
+        assert sender.send('four')
+        for _ in range(100):
+            if len(received) == 4:
+                break
+            sleep(0.01)
+    finally:
+        receiver.stop(timeout=2.0)
+        sender.stop()
+    assert received == ['one', 'two', 'three', 'four']
+    counters = receiver.status.counters()
+    assert counters['recvd'] == 4
+    assert counters['seq_errs'] == counters['crc_errs'] == 0
+
+
+def test_concurrent_senders_keep_the_sequence():
+    received = []
+    receiver, sender = _pair(
+        process_message=lambda name, message: received.append(message))
+    receiver.start()
+
+    def send(index):
+        for count in range(50):
+            if count % 5:
+                sender.send('%i %i' % (index, count))
+            else:
+                sender.send_batch(['%i %i' % (index, count)])
+
+    threads = [Thread(target=send, args=(index,)) for index in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for _ in range(200):
+            if len(received) == 200:
+                break
+            sleep(0.01)
+    finally:
+        receiver.stop(timeout=2.0)
+        sender.stop()
+    assert len(received) == 200
+    counters = receiver.status.counters()
+    assert counters['recvd'] == 200
+    assert counters['seq_errs'] == counters['crc_errs'] == 0
+
+
+def test_expected_disconnect_reads_frames_in_transit(caplog):
+    received = []
+    disconnected = []
+    receiver, sender = _pair(
+        process_message=lambda name, message: received.append(message),
+        disconnected=disconnected.append)
+    receiver.start()
+    assert sender.send_batch(['one', 'two'])
+    receiver.expect_disconnect()
+    sender.stop()
+    receiver.join(2.0)
+    assert received == ['one', 'two']
+    assert disconnected == []
+    assert not [record for record in caplog.records
+                if record.levelno >= logging.ERROR]
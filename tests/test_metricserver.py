@@ -0,0 +1,56 @@
+from papamaclib.messagesocket import Histogram
+from papamaclib.metricserver import MetricServer, counter, format_metrics, \
+    gauge, histogram
+
+try:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:  # Python 2.7.
+    from urllib2 import urlopen, HTTPError
+
+
+def test_counter_and_gauge_samples():
+    text = format_metrics([
+        counter('frames_total', 'Frames received.',
+                [({'server': 'pi1'}, 3), ({'server': 'pi"2'}, 4)]),
+        gauge('connected', 'Connection state.', [({}, 1)])])
+    assert text.splitlines() == [
+        '# HELP frames_total Frames received.',
+        '# TYPE frames_total counter',
+        'frames_total{server="pi1"} 3.0',
+        'frames_total{server="pi\\"2"} 4.0',
+        '# HELP connected Connection state.',
+        '# TYPE connected gauge',
+        'connected 1.0']
+
+
+def test_histogram_buckets_are_cumulative():
+    latency = Histogram(bounds=(1.0, 10.0))
+    for value in (0.5, 2.0, 3.0, 20.0):
+        latency.add(value)
+    text = format_metrics([histogram('latency_ms', 'Latency.',
+                                     [({'server': 'pi1'}, latency)])])
+    assert text.splitlines()[2:] == [
+        'latency_ms_bucket{server="pi1",le="1.0"} 1',
+        'latency_ms_bucket{server="pi1",le="10.0"} 3',
+        'latency_ms_bucket{server="pi1",le="+Inf"} 4',
+        'latency_ms_sum{server="pi1"} 25.5',
+        'latency_ms_count{server="pi1"} 4']
+
+
+def test_server_scrape():
+    families = [gauge('up', 'Bridge running.', [({}, 1)])]
+    server = MetricServer(0, lambda: families)
+    server.start()
+    try:
+        url = 'http://%s:%s' % server._httpd.server_address[:2]
+        body = urlopen(url + '/metrics', timeout=5).read().decode('utf-8')
+        assert body == format_metrics(families)
+        try:
+            urlopen(url + '/other', timeout=5)
+        except HTTPError as err:
+            assert err.code == 404
+        else:
+            assert False, 'HTTPError not raised'
+    finally:
+        server.stop()
@@ -0,0 +1,113 @@
+import logging
+from errno import ENOSPC
+from os import stat
+from os.path import exists, getsize
+
+import pytest
+
+from papamaclib import msgcapture
+from papamaclib.messagesocket import HDR_LEN, encode_message
+
+
+def write_capture(path, count, max_size=msgcapture.MAX_SIZE):
+    writer = msgcapture.CaptureWriter(path, max_size)
+    frames = []
+    for seq in range(count):
+        frame = encode_message('DATA pi1 ab0 %i' % seq, seq)
+        direction = msgcapture.SENT if seq % 3 == 2 else msgcapture.RECEIVED
+        writer.append(direction, frame)
+        frames.append((direction, frame))
+    writer.close()
+    return frames
+
+
+def test_capture_round_trip(tmp_path):
+    path = str(tmp_path / 'test.cap')
+    frames = write_capture(path, 6)
+    records = list(msgcapture.read_capture(path))
+    assert [(direction, frame) for timestamp, direction, frame
+            in records] == frames
+    assert records[0][0] <= records[-1][0]
+    assert getsize(path) == (msgcapture.FILE_HEADER.size
+                             + 6 * msgcapture.RECORD_LEN)
+
+
+def test_reopened_capture_appends(tmp_path):
+    path = str(tmp_path / 'test.cap')
+    first = write_capture(path, 2)
+    second = write_capture(path, 2)
+    assert [frame for timestamp, direction, frame
+            in msgcapture.read_capture(path)] == [
+        frame for direction, frame in first + second]
+
+
+def test_capture_is_rotated_at_the_maximum_size(tmp_path):
+    path = str(tmp_path / 'test.cap')
+    per_chunk = msgcapture.CHUNK_SIZE // msgcapture.RECORD_LEN
+    write_capture(path, per_chunk + 10, max_size=msgcapture.CHUNK_SIZE)
+    assert exists(path + '.1')
+    rotated = len(list(msgcapture.read_capture(path + '.1')))
+    current = len(list(msgcapture.read_capture(path)))
+    assert rotated + current == per_chunk + 10 and current > 0
+
+
+def test_replay_restamps_received_frames(tmp_path):
+    path = str(tmp_path / 'test.cap')
+    write_capture(path, 6)
+    sent = []
+    count = msgcapture.replay(path, lambda frame: sent.append(frame) or True,
+                              speed=0.0)
+    assert count == 4
+    assert [int(frame[8:16], 16) for frame in sent] == [0, 1, 2, 3]
+    assert [frame[HDR_LEN:].decode().strip() for frame in sent] == [
+        'DATA pi1 ab0 %i' % seq for seq in (0, 1, 3, 4)]
+
+
+def test_replay_to_process_ends_without_error(tmp_path, caplog):
+    path = str(tmp_path / 'test.cap')
+    writer = msgcapture.CaptureWriter(path)
+    for seq in range(5):
+        writer.append(msgcapture.RECEIVED,
+                      encode_message('DATA pi1 ab0 %i' % seq, seq))
+    writer.close()
+    messages = []
+    with caplog.at_level(logging.DEBUG, logger='Plugin'):
+        counters = msgcapture.replay_to_process(
+            path, lambda name, message: messages.append(message))
+    assert len(messages) == 5
+    assert counters['recvd'] == 5
+    assert not [record for record in caplog.records
+                if record.levelno >= logging.ERROR]
+
+
+@pytest.mark.parametrize('fallocate', [True, False])
+def test_chunks_are_allocated_before_mapping(tmp_path, monkeypatch,
+                                             fallocate):
+    if not fallocate:
+        monkeypatch.setattr(msgcapture, 'posix_fallocate', None)
+    path = str(tmp_path / 'test.cap')
+    writer = msgcapture.CaptureWriter(path)
+    assert stat(path).st_blocks * 512 >= msgcapture.CHUNK_SIZE  # Not sparse.
+    writer.close()
+
+
+def _fail(*args):
+    raise OSError(ENOSPC, 'No space left on device')
+
+
+@pytest.mark.parametrize('failing, max_size', [
+    ('posix_fallocate', msgcapture.MAX_SIZE),   # Extending the file.
+    ('rename', msgcapture.CHUNK_SIZE)])         # Rotating the file.
+def test_file_errors_end_the_capture(tmp_path, monkeypatch, caplog, failing,
+                                     max_size):
+    path = str(tmp_path / 'test.cap')
+    writer = msgcapture.CaptureWriter(path, max_size)
+    monkeypatch.setattr(msgcapture, failing, _fail)
+    per_chunk = msgcapture.CHUNK_SIZE // msgcapture.RECORD_LEN
+    frame = encode_message('DATA pi1 ab0 1', 0)
+    for index in range(per_chunk + 10):
+        writer.append(msgcapture.RECEIVED, frame)
+    writer.close()
+    assert [record.levelno for record in caplog.records] == [logging.ERROR]
+    assert len(list(msgcapture.read_capture(path))) in (per_chunk - 1,
+                                                        per_chunk)
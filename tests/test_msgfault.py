@@ -0,0 +1,31 @@
+import types
+
+import pytest
+
+from papamaclib import messagesocket, msgfault
+
+
+def test_expected_result():
+    errors, lost, disconnect = msgfault.expected_result('corrupt', 5, False)
+    assert (errors['crc_errs'], errors['seq_errs'], lost) == (5, 5, 5)
+    assert not disconnect
+    assert msgfault.expected_result('reset', 1, True)[1:] == (0, True)
+    assert msgfault.expected_result('reset', 1, False)[1:] == (None, True)
+
+
+@pytest.mark.parametrize('fault', ['drop', 'corrupt'])
+def test_scenario_is_classified(fault, monkeypatch):
+    monkeypatch.setattr(messagesocket, 'SOCKET_TIMEOUT', 0.5)  # Fast stop.
+    server = msgfault.MessageServer(msgfault.PORT_NUMBER)
+    server.start()
+    publisher = msgfault.Publisher(server, 200.0)
+    publisher.start()
+    args = types.SimpleNamespace(rate=200.0, recv_timeout=5.0,
+                                 reconnect_delay=2.0, sessions=False)
+    try:
+        result = msgfault.run_scenario(fault, 3, 0.0, publisher, args)
+    finally:
+        publisher.stop()
+        server.stop()
+    assert result['ok'], result
+    assert result['lost'] == 3 and result['duplicated'] == 0
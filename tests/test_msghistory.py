@@ -0,0 +1,43 @@
+from papamaclib.msghistory import ChannelHistory, Ring
+
+LEVELS = ((1, 10), (60, 10))
+
+
+def test_ring_overwrites_oldest_entries():
+    ring = Ring(3, 2)
+    for index in range(5):
+        ring.append(float(index), 10.0 * index)
+    assert ring.size == 3
+    assert list(ring.column(0, 3)) == [2.0, 3.0, 4.0]
+    assert ring.count_since(3.0) == 2
+
+
+def test_rollups_close_on_new_samples():
+    history = ChannelHistory(100, LEVELS)
+    for timestamp, value in ((100.1, 1.0), (100.5, 3.0), (101.2, 5.0)):
+        history.add(value, timestamp)
+    assert history.series(1, now=101.5) == [(100.0, 1.0, 3.0, 2.0)]
+    assert history.series(0, 0.5, now=101.5) == [(101.2, 5.0)]
+
+
+def test_quiet_channel_rollups_close_by_wall_clock():
+    history = ChannelHistory(100, LEVELS)
+    history.add(2.0, 120.2)
+    history.add(4.0, 120.7)
+    assert history.summary(1, 60, now=120.9) is None  # Bucket still open.
+    assert history.summary(1, 60, now=150.0) == (2.0, 4.0, 3.0, 2)
+    assert history.summary(60, 3600, now=150.0) is None
+    assert history.summary(60, 3600, now=200.0) == (2.0, 4.0, 3.0, 2)
+    history.add(6.0, 200.5)
+    assert history.summary(1, 3600, now=202.0) == (2.0, 6.0, 4.0, 3)
+
+
+def test_unsupported_resolution():
+    history = ChannelHistory(100, LEVELS)
+    assert history.resolutions == [0, 1, 60]
+    try:
+        history.series(5)
+    except ValueError:
+        pass
+    else:
+        assert False, 'ValueError not raised'
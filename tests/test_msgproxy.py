@@ -0,0 +1,71 @@
+import sys
+from threading import Event
+from time import sleep
+
+import pytest
+
+from papamaclib import messagesocket
+from papamaclib.colortext import DATA
+from papamaclib.messagesocket import MessageSocket, monotonic
+from papamaclib.msgproxy import MessageProxy
+
+pytestmark = pytest.mark.skipif(sys.version_info[0] < 3,
+                                reason='SelectorMessageServer requires '
+                                       'Python 3')
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() >= deadline:
+            return False
+        sleep(0.01)
+    return True
+
+
+def test_new_client_receives_the_snapshot_then_live_messages(monkeypatch):
+    monkeypatch.setattr(messagesocket, 'SOCKET_TIMEOUT', 0.1)  # Fast stop.
+    proxy = MessageProxy(0)
+    proxy.start()
+    port = proxy._server._socket.getsockname()[1]
+    received = []
+    reader = MessageSocket('reader', process_message=lambda name, message:
+                           received.append(message))
+    try:
+        for message in ('%s ab00 1' % DATA, '%s ab01 2' % DATA,
+                        '%s ab00 3' % DATA, 'STATUS pi1 ok'):
+            proxy.forward(message)
+        assert wait_for(lambda: len(proxy.snapshot()) == 2)
+        reader.connect_to_server('127.0.0.1', port)
+        reader.start()
+        assert wait_for(lambda: len(received) == 2)
+        proxy.forward('%s ab01 4' % DATA)
+        assert wait_for(lambda: len(received) == 3)
+        reader.send('write gb00 on')  # Read-only; ignored.
+    finally:
+        reader.stop()
+        proxy.stop()
+    assert received == ['%s ab00 3' % DATA, '%s ab01 2' % DATA,
+                        '%s ab01 4' % DATA]
+
+
+def test_cache_is_updated_on_the_fan_out_call():
+    proxy = MessageProxy(0)
+    message = '%s sw1[ab00] 1' % DATA
+    proxy.forward(message)
+    assert proxy.snapshot() == []  # Not yet fanned out; I/O thread idle.
+    proxy.start()
+    try:
+        done = Event()
+        proxy._server.wake(done.set)
+        assert done.wait(5.0)
+        assert proxy.snapshot() == [message]
+        proxy.forward('%s sw1[ab00] 0' % DATA)
+        proxy.forward('%s ab01 5' % DATA)
+        done.clear()
+        proxy._server.wake(done.set)
+        assert done.wait(5.0)
+        assert proxy.snapshot() == ['%s sw1[ab00] 0' % DATA,
+                                    '%s ab01 5' % DATA]
+    finally:
+        proxy.stop()
@@ -0,0 +1,119 @@
+import sys
+from threading import Thread
+from time import sleep
+
+import pytest
+
+from papamaclib import msgshard
+
+pytestmark = pytest.mark.skipif(not msgshard.available,
+                                reason='shared memory requires Python 3.8')
+
+
+@pytest.fixture
+def ring():
+    ring = msgshard.ShardRing(capacity=4)
+    yield ring
+    ring.close(unlink=True)
+
+
+def test_ring_returns_records_in_order(ring):
+    ring.put(msgshard.DATA_RECORD, 25, 1.5, 'ab00\x001.25\x00V')
+    ring.put(msgshard.LOG_RECORD, 40, 2.5, 'error')
+    assert ring.get() == [(msgshard.DATA_RECORD, 25, 1.5, 'ab00\x001.25\x00V'),
+                          (msgshard.LOG_RECORD, 40, 2.5, 'error')]
+    assert ring.get() == []
+
+
+def test_ring_wraps_and_truncates(ring):
+    for index in range(10):
+        ring.put(msgshard.MESSAGE_RECORD, 20, float(index), str(index))
+        assert ring.get() == [(msgshard.MESSAGE_RECORD, 20, float(index),
+                               str(index))]
+    ring.put(msgshard.MESSAGE_RECORD, 20, 0.0, 'x' * 200)
+    assert len(ring.get()[0][3]) == msgshard.PAYLOAD_LEN
+
+
+def test_consumer_attaches_by_name(ring):
+    consumer = msgshard.ShardRing(ring.name)
+    ring.put(msgshard.CONNECTED, 0, 0.0, 'pi1[127.0.0.1:50000]')
+    assert consumer.get()[0][3] == 'pi1[127.0.0.1:50000]'
+    consumer.close()
+
+
+def test_short_data_messages_are_dropped(ring):
+    msgshard._put_message(ring, '%2i ab00' % msgshard.DATA, 1.0)
+    assert ring.get() == []
+    msgshard._put_message(ring, '%2i ab00 1.25' % msgshard.DATA, 2.0)
+    msgshard._put_message(ring, '20 connected', 3.0)
+    assert ring.get() == [(msgshard.DATA_RECORD, msgshard.DATA, 2.0,
+                           'ab00\x001.25'),
+                          (msgshard.MESSAGE_RECORD, 20, 3.0, '20 connected')]
+
+
+class Process(object):
+    joins = 0
+
+    def join(self, timeout=None):
+        self.joins += 1
+        sleep(0.05)
+
+    def is_alive(self):
+        return False
+
+
+class Pipe(object):
+
+    def send(self, messages):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_concurrent_closes_release_the_shard_once(ring):
+    client = msgshard.ShardClient('pi1', '127.0.0.1', 50000)
+    process = client._process = Process()
+    client._requests = Pipe()
+    client._ring = msgshard.ShardRing(capacity=4)
+    threads = [Thread(target=client.close) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert process.joins == 1
+    assert client._ring.closed and not client.alive()
+
+
+def test_interpreter_matches_parent_version():
+    path = msgshard.interpreter()
+    assert path is not None
+    assert msgshard.VERSION == '%i.%i' % sys.version_info[:2]
+
+
+def test_start_raises_without_interpreter(monkeypatch):
+    monkeypatch.setattr(msgshard, 'interpreter', lambda: None)
+    client = msgshard.ShardClient('pi1', '127.0.0.1', 50000)
+    with pytest.raises(RuntimeError):
+        client.start()
+
+
+def test_sharded_server_falls_back_to_in_process(monkeypatch):
+    import indigo
+    import plugin
+    from papamaclib.messagesocket import SelectorMessageServer
+    monkeypatch.setattr(msgshard, 'interpreter', lambda: None)
+    server = SelectorMessageServer(0)
+    server.start()
+    try:
+        port = server._socket.getsockname()[1]
+        dev = indigo.Device(u'pi1', u'server',
+                            {u'serverAddress': u'127.0.0.1',
+                             u'portNumber': str(port)})
+        sharded = plugin.ShardedServer(dev)
+        sharded.connect_to_server(u'127.0.0.1', port)
+        assert sharded.connected and sharded._shard is None
+        assert sharded.send(u'read ab00') is not None
+        sharded.stop()
+    finally:
+        server.stop()
@@ -0,0 +1,11 @@
+import types
+
+import plugin
+
+
+def test_missing_duration_is_a_validation_error():
+    self = types.SimpleNamespace(_servers={})
+    result = plugin.Plugin.profileServer(self, {u'serverName': u'pi1'},
+                                         u'profileServer')
+    assert result[0] is False
+    assert set(result[2]) == {u'serverName', u'duration'}
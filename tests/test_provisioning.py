@@ -0,0 +1,91 @@
+import json
+
+import indigo
+import plugin
+
+
+def test_csv_spec_omits_empty_and_missing_cells(tmp_path):
+    path = tmp_path / 'channels.csv'
+    path.write_text(u'name, deviceType ,serverName,channelName,units\n'
+                    u' tank ,analogInput,pi1,ab00,\n'
+                    u'pump,digitalOutput,pi1\n')
+    assert plugin.Plugin.readChannelSpec(str(path)) == [
+        {u'name': u'tank', u'deviceType': u'analogInput',
+         u'serverName': u'pi1', u'channelName': u'ab00'},
+        {u'name': u'pump', u'deviceType': u'digitalOutput',
+         u'serverName': u'pi1'}]
+
+
+def test_json_spec_omits_null_values(tmp_path):
+    path = tmp_path / 'channels.json'
+    path.write_text(json.dumps([{u'name': u' fan ', u'units': None,
+                                 u'momentary': False}]))
+    assert plugin.Plugin.readChannelSpec(str(path)) == [
+        {u'name': u'fan', u'momentary': False}]
+
+
+def add(name, typeId, props, devId):
+    indigo.devices[name] = indigo.Device(name, typeId, props, devId)
+
+
+def test_channel_index_detects_group_member_conflicts():
+    add(u'pi1', u'server', {u'serverId': u'a'}, 1)
+    add(u'pi2', u'server', {u'serverId': u'b'}, 2)
+    add(u'group', u'serverGroup', {u'serverId': u'c',
+                                   u'members': [u'pi1', u'pi2']}, 3)
+    add(u'tank', u'analogInput', {u'serverName': u'group',
+                                  u'channelName': u'ab00'}, 4)
+    index = plugin.ChannelIndex()
+    assert index.serverIds == {u'a': 1, u'b': 2, u'c': 3}
+    assert index.owner(u'pi2', u'ab00', u'other') == u'tank'
+    assert index.owner(u'pi2', u'ab00', u'tank') is None
+    assert index.owner(u'pi1', u'ab01', u'other') is None
+    index.remove(u'tank')
+    assert index.owner(u'pi1', u'ab00', u'other') is None
+
+
+def validate(values, typeId, devId):
+    return plugin.Plugin.validateDeviceConfigUi(plugin.Plugin, values, typeId,
+                                                devId)
+
+
+def test_validate_channel_device():
+    add(u'pi1', u'server', {u'serverId': u'a'}, 1)
+    add(u'tank', u'analogInput', {u'serverName': u'pi1',
+                                  u'channelName': u'ab00'}, 2)
+    add(u'level', u'analogInput', {}, 3)
+    values = {u'serverName': u'pi1', u'channelName': u'ab00'}
+    result = validate(values, u'analogInput', 3)
+    assert result[0] is False and u'channelName' in result[2]
+    values = {u'serverName': u'pi1', u'channelName': u'xx00'}
+    result = validate(values, u'analogInput', 3)
+    assert result[2][u'channelName'] == u'Invalid channel name.'
+
+
+def test_validate_server_device():
+    add(u'pi1', u'server', {u'serverId': u'a', u'proxyPort': u'6000'}, 1)
+    add(u'pi2', u'server', {}, 2)
+    values = {u'serverAddress': u'127.0.0.1', u'portNumber': u'50000',
+              u'proxyPort': u'6000', u'serverId': u'a'}
+    result = validate(values, u'server', 2)
+    assert result[0] is False
+    assert set(result[2]) == {u'proxyPort', u'serverId'}
+    values.update(proxyPort=u'6001', serverId=u'b')
+    result = validate(values, u'server', 2)
+    assert result == (True, values)
+    assert values[u'socketId'] == u'127.0.0.1:50000'
+
+
+def test_first_start_consumes_the_provisioned_flag(monkeypatch):
+    started = []
+    monkeypatch.setattr(plugin.Plugin, u'_provisioned', {u'tank'})
+    monkeypatch.setattr(plugin.Plugin, u'startDevice',
+                        lambda dev, **kwargs: started.append(dev.name))
+    dev = indigo.Device(u'tank', u'analogInput', {u'serverName': u'pi1',
+                                                  u'channelName': u'ab00'})
+    dev.subModel = u'PiDACS'
+    assert plugin.Plugin.provisioned(u'tank')
+    plugin.Plugin.deviceStartComm(plugin.Plugin, dev)
+    assert started == [] and not plugin.Plugin.provisioned(u'tank')
+    plugin.Plugin.deviceStartComm(plugin.Plugin, dev)
+    assert started == [u'tank']
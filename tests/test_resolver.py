@@ -0,0 +1,88 @@
+from socket import gaierror
+from threading import Event
+from time import sleep
+
+import pytest
+
+from papamaclib import messagesocket
+from papamaclib.messagesocket import Resolver
+
+
+class Lookups(list):
+    """
+    Replacement for gethostbyname that records the hosts looked up and
+    returns (or raises) the result set for each host.
+    """
+
+    def __init__(self):
+        list.__init__(self)
+        self.results = {}
+
+    def __call__(self, host):
+        self.append(host)
+        result = self.results[host]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    lookups = Lookups()
+    monkeypatch.setattr(messagesocket, 'gethostbyname', lookups)
+    return lookups
+
+
+def test_addresses_are_not_looked_up(lookups):
+    assert Resolver().resolve('192.168.1.20') == '192.168.1.20'
+    assert lookups == []
+
+
+def test_results_are_cached_for_the_ttl(lookups):
+    lookups.results['pi1'] = '10.0.0.1'
+    resolver = Resolver(ttl=0.1)
+    assert resolver.resolve('pi1') == '10.0.0.1'
+    lookups.results['pi1'] = '10.0.0.2'
+    assert resolver.resolve('pi1') == '10.0.0.1'
+    assert lookups == ['pi1']
+    sleep(0.15)
+    assert resolver.resolve('pi1') == '10.0.0.2'
+    assert lookups == ['pi1', 'pi1']
+    stats = resolver.stats()
+    assert (stats['hit'], stats['miss']) == (1, 2)
+    assert resolver.lookup_time.count == 2
+
+
+def test_failures_are_cached_for_the_negative_ttl(lookups):
+    lookups.results['pi2'] = gaierror(-2, 'Name or service not known')
+    resolver = Resolver(negative_ttl=60.0)
+    for _ in range(2):
+        with pytest.raises(gaierror):
+            resolver.resolve('pi2')
+    assert lookups == ['pi2']
+    assert resolver.stats()['failure'] == 1
+
+
+def test_last_good_address_is_returned_after_a_failure(lookups):
+    lookups.results['pi3'] = '10.0.0.3'
+    resolver = Resolver(ttl=0.0, negative_ttl=0.0)
+    assert resolver.resolve('pi3') == '10.0.0.3'
+    lookups.results['pi3'] = gaierror(-3, 'Temporary failure')
+    assert resolver.resolve('pi3') == '10.0.0.3'
+    assert resolver.stats()['stale'] == 1
+
+
+def test_slow_lookup_times_out_and_fills_the_cache(monkeypatch):
+    release = Event()
+
+    def gethostbyname(host):
+        release.wait(2.0)
+        return '10.0.0.4'
+
+    monkeypatch.setattr(messagesocket, 'gethostbyname', gethostbyname)
+    resolver = Resolver(timeout=0.05)
+    with pytest.raises(gaierror):
+        resolver.resolve('pi4')
+    assert resolver.stats()['timeout'] == 1
+    release.set()
+    assert resolver.resolve('pi4', timeout=2.0) == '10.0.0.4'
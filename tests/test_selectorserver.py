@@ -0,0 +1,142 @@
+import sys
+from socket import create_connection, socket, SOL_SOCKET, SO_RCVBUF, \
+    SO_SNDBUF
+from threading import Event, Lock, Thread
+from time import sleep
+
+import pytest
+
+from papamaclib import messagesocket
+from papamaclib.messagesocket import CLIENT_QUEUE_LEN, MSG_LEN, \
+    MessageSocket, SelectorMessageServer, encode_message, monotonic
+
+pytestmark = pytest.mark.skipif(sys.version_info[0] < 3,
+                                reason='SelectorMessageServer requires '
+                                       'Python 3')
+
+
+@pytest.fixture
+def server():
+    server = SelectorMessageServer(0)
+    server.start()
+    yield server
+    server.stop()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() >= deadline:
+            return False
+        sleep(0.01)
+    return True
+
+
+def test_publish_and_requests(monkeypatch):
+    monkeypatch.setattr(messagesocket, 'SOCKET_TIMEOUT', 0.1)  # Fast stop.
+    requests = []
+    server = SelectorMessageServer(
+        0, process_request=lambda name, message: requests.append(message))
+    server.start()
+    port = server._socket.getsockname()[1]
+    received = {0: [], 1: []}
+    readers = []
+    try:
+        for index in received:
+            reader = MessageSocket(
+                index, process_message=lambda name, message:
+                received[name].append(message))
+            reader.connect_to_server('127.0.0.1', port)
+            reader.start()
+            readers.append(reader)
+        assert wait_for(lambda: len(server.clients) == 2)
+        for index in range(50):
+            server.publish('DATA pi1 ab0 %i' % index)
+        readers[0].send('write gb00 on')
+        assert wait_for(lambda: all(len(messages) == 50
+                                    for messages in received.values()))
+        assert wait_for(lambda: requests)
+    finally:
+        for reader in readers:
+            reader.stop()
+        server.stop()
+    expected = ['DATA pi1 ab0 %i' % index for index in range(50)]
+    assert received == {0: expected, 1: expected}
+    assert requests == ['write gb00 on']
+
+
+def test_incomplete_handshake_is_closed():
+    server = SelectorMessageServer(0, handshake_timeout=0.2)
+    server.start()
+    port = server._socket.getsockname()[1]
+    client = create_connection(('127.0.0.1', port))
+    client.settimeout(5.0)
+    try:
+        assert client.recv(MSG_LEN) == b''
+        assert server.clients == []
+    finally:
+        client.close()
+        server.stop()
+
+
+def test_wake_runs_every_call(server):
+    threads, calls = 8, 2000
+    lock = Lock()
+    count = [0]
+    done = Event()
+
+    def call():
+        with lock:
+            count[0] += 1
+            if count[0] == threads * calls:
+                done.set()
+
+    def waker():
+        for index in range(calls):
+            server.wake(call)
+
+    wakers = [Thread(target=waker) for index in range(threads)]
+    for thread in wakers:
+        thread.start()
+    for thread in wakers:
+        thread.join()
+    # The I/O thread only runs calls when woken, so a lost wake leaves calls
+    # queued until the next wake.
+    assert done.wait(5.0), '%i of %i calls run' % (count[0], threads * calls)
+
+
+def test_stop_closes_pending_handshake_clients(server):
+    port = server._socket.getsockname()[1]
+    client = create_connection(('127.0.0.1', port))
+    assert wait_for(lambda: len(server._selector.get_map()) == 3)
+    pending = [key.data for key in server._selector.get_map().values()
+               if key.data]
+    server.stop()
+    assert not pending[0].connected
+    client.close()
+
+
+def test_sent_counts_completed_frames(server):
+    port = server._socket.getsockname()[1]
+    client = socket()
+    client.setsockopt(SOL_SOCKET, SO_RCVBUF, 4096)
+    client.connect(('127.0.0.1', port))
+    client.settimeout(5.0)
+    client.sendall(encode_message('tester', 0))
+    assert wait_for(lambda: server.clients)
+    selector_client = server.clients[0]
+    selector_client.socket.setsockopt(SOL_SOCKET, SO_SNDBUF, 4096)
+    published = Event()
+    for index in range(CLIENT_QUEUE_LEN):
+        server.publish('DATA pi1 ab0 %i' % index)
+    server.wake(published.set)
+    assert published.wait(5.0)
+    sent = selector_client.status.counters()['sent']
+    assert 0 < selector_client.queued()  # The client is not reading.
+    assert sent + selector_client.queued() <= CLIENT_QUEUE_LEN
+    received = 0
+    while received < CLIENT_QUEUE_LEN * MSG_LEN:
+        received += len(client.recv(65536))
+    assert wait_for(lambda: selector_client.status.counters()['sent']
+                    == CLIENT_QUEUE_LEN)
+    client.close()
@@ -0,0 +1,105 @@
+import indigo
+import plugin
+from papamaclib.messagesocket import Histogram
+
+
+class Status(object):
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.crcErrors = 0
+
+    def counters(self):
+        return {u'shorts': 0, u'crc_errs': self.crcErrors, u'dt_errs': 0,
+                u'seq_errs': 0}
+
+
+class Server(object):
+    connected = running = True
+
+    def __init__(self, status=None):
+        self.status = status
+        self.requests = []
+
+    def sendRequest(self, devName, request, *args):
+        self.requests.append((devName, request))
+
+
+def make_group():
+    dev = indigo.Device(u'group', u'serverGroup',
+                        {u'members': [u'pi1', u'pi2'],
+                         u'heartbeatInterval': u'4'})
+    indigo.devices[u'probe'] = indigo.Device(u'probe', u'analogInput',
+                                             {u'serverName': u'group'})
+    return plugin.ServerGroup(dev)
+
+
+def test_lost_probe_is_replaced():
+    group = make_group()
+    server = Server()
+    servers = {u'pi1': server}
+    group._heartbeat(servers, 100.0)
+    assert server.requests == [(u'probe', u'read')]
+    assert group._score(u'pi1', server, 101.0) is not None
+    assert group._score(u'pi1', server, 103.0) is None  # Overdue.
+    group._heartbeat(servers, 104.0)  # No reply; probe again.
+    assert len(server.requests) == 2
+    assert group._score(u'pi1', server, 104.5) is None  # Until answered.
+    assert group.answered(u'pi1', u'probe')
+    assert group._score(u'pi1', server, 105.0) is not None
+
+
+def test_outstanding_probe_is_not_resent_early():
+    group = make_group()
+    server = Server()
+    group._heartbeat({u'pi1': server}, 100.0)
+    group._heartbeat({u'pi1': server}, 102.0)
+    assert len(server.requests) == 1
+
+
+def heartbeats(group, servers, latencies):
+    """
+    Add 20 latency values (ms) for each member and run a heartbeat.
+    """
+    for serverName, latency in latencies.items():
+        for index in range(20):
+            servers[serverName].status.latency.add(latency)
+    group._heartbeatTime = 0.0
+    group.check()
+
+
+def make_members(monkeypatch):
+    servers = {u'pi1': Server(Status()), u'pi2': Server(Status())}
+    monkeypatch.setattr(plugin.Plugin, u'_servers', servers)
+    return make_group(), servers
+
+
+def test_clock_offset_does_not_decide_failover(monkeypatch):
+    group, servers = make_members(monkeypatch)
+    for index in range(3):
+        heartbeats(group, servers, {u'pi1': 5000.0, u'pi2': 10.0})
+        assert group.active == u'pi1'
+    assert group._lag == {u'pi1': 0.0, u'pi2': 0.0}
+
+
+def test_latency_above_the_baseline_fails_over(monkeypatch):
+    group, servers = make_members(monkeypatch)
+    heartbeats(group, servers, {u'pi1': 5000.0, u'pi2': 10.0})
+    heartbeats(group, servers, {u'pi1': 5400.0, u'pi2': 10.0})
+    assert group._lag[u'pi1'] > plugin.SWITCH_MARGIN
+    assert group.active == u'pi2'
+    heartbeats(group, servers, {u'pi1': 5000.0, u'pi2': 10.0})
+    assert group.active == u'pi2'  # Within SWITCH_MARGIN.
+
+
+def test_header_errors_are_penalized_per_heartbeat(monkeypatch):
+    group, servers = make_members(monkeypatch)
+    servers[u'pi1'].status.crcErrors = 3
+    heartbeats(group, servers, {u'pi1': 10.0, u'pi2': 10.0})
+    assert group._penalty == {u'pi1': 3 * plugin.ERROR_PENALTY, u'pi2': 0.0}
+    assert group.active == u'pi2'
+    heartbeats(group, servers, {u'pi1': 10.0, u'pi2': 10.0})
+    assert group._penalty == {u'pi1': 0.0, u'pi2': 0.0}
+    servers[u'pi1'].status = Status()  # Reconnected.
+    heartbeats(group, servers, {u'pi1': 10.0, u'pi2': 10.0})
+    assert group._penalty[u'pi1'] == 0.0
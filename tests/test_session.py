@@ -0,0 +1,50 @@
+import types
+
+from papamaclib.messagesocket import Session, SessionRegistry
+
+
+def _session(start_seq, count, replay_len=4):
+    session = Session('abc', replay_len)
+    session._send_seq = start_seq
+    frames = [session.encode('message %i' % index) for index in range(count)]
+    return session, frames
+
+
+def test_replay_from_across_the_sequence_wrap():
+    session, frames = _session(0xfffffffe, 4)
+    assert session.send_seq == 2
+    assert session.replay_from(0xfffffffe) == frames
+    assert session.replay_from(0xffffffff) == frames[1:]
+    assert session.replay_from(0) == frames[2:]
+    assert session.replay_from(1) == frames[3:]
+    assert session.replay_from(2) == []
+
+
+def test_replay_from_beyond_the_buffer():
+    session, frames = _session(0xfffffffc, 6)
+    assert session.send_seq == 2
+    assert session.replay_from(0xfffffffe) == frames[2:]
+    assert session.replay_from(0xfffffffd) is None
+    assert session.replay_from(3) is None
+
+
+def _client(handshake):
+    return types.SimpleNamespace(handshake=handshake, name='client',
+                                 connected=True)
+
+
+def test_registry_resumes_a_session():
+    registry = SessionRegistry(replay_len=8)
+    session, reply = registry.open(_client('host resume new 00000000'))
+    assert len(reply) == 1 and 'new' in reply[0].decode()
+    frames = [session.encode('message %i' % index) for index in range(3)]
+    session.client.connected = False
+    resumed, reply = registry.open(_client('host resume %s 00000001'
+                                           % session.id))
+    assert resumed is session
+    assert 'resumed 00000001' in reply[0].decode()
+    assert reply[1:] == frames[1:]
+
+
+def test_registry_ignores_a_hostname_handshake():
+    assert SessionRegistry().open(_client('host')) == (None, [])
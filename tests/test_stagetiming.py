@@ -0,0 +1,48 @@
+from socket import socketpair
+
+import pytest
+
+from papamaclib import messagesocket
+from papamaclib.messagesocket import MessageSocket, MessageStatus
+
+
+@pytest.fixture
+def stages():
+    messagesocket.set_instrumentation(True)
+    yield messagesocket.STAGES
+    messagesocket.set_instrumentation(False)
+
+
+def _sender(sock):
+    sender = MessageSocket('sender')
+    sender._socket = sock
+    sender._status = MessageStatus('sender')
+    return sender
+
+
+def test_recv_times_each_stage(stages):
+    left, right = socketpair()
+    sender = _sender(right)
+    sender.send('pi1')
+    receiver = MessageSocket('receiver')
+    receiver.connect_to_client(left, ('test', 0))
+    sender.send('DATA ab00 3.5 V')
+    assert receiver.recv() == 'DATA ab00 3.5 V'
+    for stage in ('recv_wait', 'read', 'header'):
+        assert stages[stage].count == 2
+    assert stages['parse'].count == stages['indigo'].count == 0
+    left.close()
+    right.close()
+
+
+def test_instrumentation_off_records_nothing():
+    messagesocket.set_instrumentation(False)
+    assert messagesocket.STAGES is None
+    left, right = socketpair()
+    sender = _sender(right)
+    sender.send('pi1')
+    receiver = MessageSocket('receiver')
+    receiver.connect_to_client(left, ('test', 0))
+    assert receiver.name == 'pi1[test:0]'
+    left.close()
+    right.close()
@@ -0,0 +1,76 @@
+import types
+
+import indigo
+import plugin
+from papamaclib.messagesocket import Histogram
+
+
+class Server(object):
+
+    def __init__(self):
+        self.status = types.SimpleNamespace(latency=Histogram())
+        self.writeTime = Histogram()
+        self.requests = []
+
+    def sendRequest(self, channelName, request, value):
+        self.requests.append((channelName, request, value))
+
+
+def measure(throttle, server, latency, frames=0, devName=u'level'):
+    for index in range(20):
+        server.status.latency.add(latency)
+        server.writeTime.add(1.0)
+    for index in range(frames):
+        throttle.count(devName)
+    throttle._time -= plugin.THROTTLE_INTERVAL
+    throttle.check()
+
+
+def make_throttle():
+    indigo.devices[u'level'] = indigo.Device(
+        u'level', u'analogInput',
+        {u'channelName': u'ab00', u'change': u'0.1', u'interval': u'1',
+         u'throttleChange': u'0.5', u'throttleInterval': u'5'})
+    server = Server()
+    return plugin.Throttle(server, u'pi1'), server
+
+
+def test_backlog_throttles_high_rate_channels():
+    throttle, server = make_throttle()
+    measure(throttle, server, 1.0)
+    assert throttle.level == 0 and server.requests == []
+    frames = int(2 * plugin.THROTTLE_RATE * plugin.THROTTLE_INTERVAL)
+    measure(throttle, server, 2000.0, frames)
+    assert throttle.level == 1
+    assert server.requests == [(u'ab00', u'change', u'0.2'),
+                               (u'ab00', u'interval', u'2')]
+
+
+def test_low_rate_channels_are_not_throttled():
+    throttle, server = make_throttle()
+    measure(throttle, server, 1.0)
+    measure(throttle, server, 2000.0, 1)
+    assert throttle.level == 1 and server.requests == []
+
+
+def test_release_after_reconnect_restores_configured_values():
+    throttle, server = make_throttle()
+    measure(throttle, server, 1.0)
+    measure(throttle, server, 2000.0, 100)
+    reconnected = Server()
+    throttle.attach(reconnected)
+    assert throttle.level == 1
+    throttle.release()
+    assert throttle.level == 0
+    assert reconnected.requests == [(u'ab00', u'change', u'0.1'),
+                                    (u'ab00', u'interval', u'1')]
+
+
+def test_throttle_is_kept_across_reconnects(monkeypatch):
+    dev = indigo.Device(u'pi1', u'server', {u'serverAddress': u'pi1.local',
+                                            u'portNumber': u'50000'})
+    monkeypatch.setattr(plugin.Plugin, u'_throttles', {})
+    first = plugin.PluginServer(dev)
+    second = plugin.PluginServer(dev)
+    assert second.throttle is first.throttle
+    assert second.throttle._server is second